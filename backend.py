@@ -1,6 +1,9 @@
 import argparse
+import datetime
+import json
 import torch
 import os
+import time
 
 from utilities.constants import LOGGER_NAME_BACKEND
 from utilities.constants import LOGGER_NAME_TXT2IMG
@@ -13,7 +16,21 @@ from utilities.constants import VALUE_LANGUAGE_EN
 from utilities.constants import KEY_PROMPT
 from utilities.constants import KEY_NEG_PROMPT
 from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_GROUP_ID
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import VALUE_BASE_MODEL_DEFAULT
+from utilities.constants import MODEL_AFFINITY_WINDOW_SECONDS
+from utilities.constants import LORA_AFFINITY_MAX_JOBS
+from utilities.constants import LORA_CACHE_SIZE
+from utilities.constants import REFERENCE_CACHE_SIZE
+from utilities.constants import SUPPORTED_CPU_PRECISIONS
+from utilities.constants import VALUE_CPU_PRECISION_FLOAT64
+from utilities.constants import KEY_TIMINGS
+from utilities.constants import KEY_PEAK_RSS_MB
+from utilities.constants import KEY_PEAK_DEVICE_MB
 from utilities.constants import VALUE_JOB_DONE
+from utilities.constants import VALUE_JOB_PENDING
 from utilities.constants import VALUE_JOB_FAILED
 from utilities.constants import VALUE_JOB_RUNNING
 from utilities.constants import KEY_JOB_TYPE
@@ -28,21 +45,90 @@ from utilities.translator import translate_prompt
 from utilities.config import Config
 from utilities.database import Database
 from utilities.logger import Logger
+from utilities.logger import clear_log_context
+from utilities.logger import configure_logging
+from utilities.logger import set_log_context
+from utilities.metrics import Metrics
 from utilities.model import Model
+from utilities.model import ModelUnavailableError
+from utilities.profiler import JobProfiler
 from utilities.text2img import Text2Img
 from utilities.img2img import Img2Img
 from utilities.inpainting import Inpainting
 from utilities.times import wait_for_seconds
-from utilities.memory import empty_memory_cache
-from utilities.external import gfpgan
+from utilities.times import DummySpanRecorder
+from utilities.times import SpanRecorder
+from utilities.memory import get_peak_memory
+from utilities.memory import get_reclaim_counts
+from utilities.memory import reclaim_memory_if_needed
+from utilities.memory import reset_peak_memory
+from utilities.memory import set_high_water_marks
+from utilities.external import GfpganWorker
 
 
 logger = Logger(name=LOGGER_NAME_BACKEND)
 database = Database(logger)
+metrics = Metrics(logger=logger)
+reported_reclaim_counts = {}  # what record_job_memory() added to the metrics
+
+
+def get_metric_labels(job: dict) -> dict:
+    """Gets the labels of the per job metrics, the job type and its resolution"""
+    labels = {"type": job.get(KEY_JOB_TYPE, "")}
+    if labels["type"] != VALUE_JOB_RESTORATION:
+        config = Config().set_config(job)
+        try:
+            labels["resolution"] = f"{config.get_width()}x{config.get_height()}"
+        except (TypeError, ValueError):
+            labels["resolution"] = ""
+    return labels
+
+
+def record_job_memory(job: dict) -> dict:
+    """
+    Reports the peak memory of `job`, measured since reset_peak_memory(), and how often
+    memory was reclaimed so far to the metrics.
+
+    Returns the columns of the job row holding the peaks.
+    """
+    rss_bytes, device_bytes = get_peak_memory()
+    labels = {"type": job[KEY_JOB_TYPE]}
+    metrics.set("sd_job_peak_rss_bytes", rss_bytes, labels)
+    metrics.set("sd_job_peak_device_bytes", device_bytes, labels)
+    for kind, count in get_reclaim_counts().items():
+        if count > reported_reclaim_counts.get(kind, 0):
+            metrics.inc(
+                "sd_memory_reclaims_total",
+                {"kind": kind},
+                count - reported_reclaim_counts.get(kind, 0),
+            )
+            reported_reclaim_counts[kind] = count
+    # 0 means unknown, e.g. no GPU
+    return {
+        KEY_PEAK_RSS_MB: round(rss_bytes / 2**20, 1) or None,
+        KEY_PEAK_DEVICE_MB: round(device_bytes / 2**20, 1) or None,
+    }
+
+
+def translate(text: str, language: str) -> str:
+    start = time.monotonic()
+    text_en = translate_prompt(text, language)
+    metrics.observe("sd_translation_seconds", time.monotonic() - start)
+    return text_en
 
 
 def load_model(
-    logger: Logger, use_gpu: bool, gpu_device_name: str, reduce_memory_usage: bool, model_caching_folder_path: str
+    logger: Logger,
+    use_gpu: bool,
+    gpu_device_name: str,
+    reduce_memory_usage: bool,
+    model_caching_folder_path: str,
+    lora_folder_path: str = "",
+    lora_cache_size: int = LORA_CACHE_SIZE,
+    reference_cache_size: int = REFERENCE_CACHE_SIZE,
+    cpu_precision: str = VALUE_CPU_PRECISION_FLOAT64,
+    onnx_folder_path: str = "",
+    onnx_threads: int = 0,
 ) -> Model:
     # model candidates:
     # "runwayml/stable-diffusion-v1-5"
@@ -54,7 +140,7 @@ def load_model(
     # "prompthero/openjourney"
     # "naclbit/trinart_stable_diffusion_v2"
     # "hakurei/waifu-diffusion"
-    model_name = "SG161222/Realistic_Vision_V2.0"
+    model_name = VALUE_BASE_MODEL_DEFAULT
     # inpainting model candidates:
     # "runwayml/stable-diffusion-inpainting"
     inpainting_model_name = "https://huggingface.co/SG161222/Realistic_Vision_V2.0/resolve/main/Realistic_Vision_V2.0-inpainting.ckpt"
@@ -66,15 +152,131 @@ def load_model(
         use_gpu=use_gpu,
         gpu_device_name=gpu_device_name,
         model_caching_folder_path=model_caching_folder_path,
+        lora_folder_path=lora_folder_path,
+        lora_cache_size=lora_cache_size,
+        reference_cache_size=reference_cache_size,
+        onnx_folder_path=onnx_folder_path,
+        onnx_threads=onnx_threads,
     )
     if use_gpu and reduce_memory_usage:
         model.set_low_memory_mode()
+    if not model.use_gpu():
+        model.set_cpu_precision(cpu_precision)
+    start = time.monotonic()
     model.load_all()
+    metrics.observe("sd_model_load_seconds", time.monotonic() - start)
 
     return model
 
 
-def backend(model, gfpgan_folderpath, is_debugging: bool):
+def restore_jobs(
+    gfpgan_worker: GfpganWorker, next_job: dict, batch_size: int, is_debugging: bool
+) -> dict:
+    """
+    Restores `next_job` together with up to `batch_size - 1` other pending restoration
+    jobs in one worker request. The other jobs are finished here, the result of
+    `next_job` is returned.
+    """
+    jobs = [next_job]
+    if not is_debugging and batch_size > 1:
+        for job in database.get_jobs(
+            job_status=VALUE_JOB_PENDING,
+            job_types=[VALUE_JOB_RESTORATION],
+            limit_count=batch_size - 1,
+        ):
+            database.update_job({KEY_JOB_STATUS: VALUE_JOB_RUNNING}, job_uuid=job[UUID])
+            jobs.append(job)
+
+    start = time.monotonic()
+    try:
+        results = gfpgan_worker.restore_batch(
+            [
+                (job[UUID], job.get(REFERENCE_IMG, ""), Config().set_config(job))
+                for job in jobs
+            ]
+        )
+    except BaseException:
+        # the caller fails next_job, the others would stay running forever
+        for job in jobs[1:]:
+            database.update_job({KEY_JOB_STATUS: VALUE_JOB_FAILED}, job_uuid=job[UUID])
+            metrics.inc("sd_jobs_failed_total", {"type": job[KEY_JOB_TYPE]})
+        raise
+    # the worker restores one image after another
+    exec_seconds = (time.monotonic() - start) / len(jobs)
+    for job, result_dict in zip(jobs, results):
+        if result_dict and not is_debugging:
+            database.record_job_cost(job, exec_seconds)
+            metrics.observe("sd_job_exec_seconds", exec_seconds, get_metric_labels(job))
+
+    for job, result_dict in zip(jobs[1:], results[1:]):
+        if not result_dict:
+            logger.error(f"failed to run gfpgan for {job[UUID]}")
+            database.update_job({KEY_JOB_STATUS: VALUE_JOB_FAILED}, job_uuid=job[UUID])
+            metrics.inc("sd_jobs_failed_total", {"type": job[KEY_JOB_TYPE]})
+            continue
+        database.update_job(result_dict, job_uuid=job[UUID])
+        database.update_job({KEY_JOB_STATUS: VALUE_JOB_DONE}, job_uuid=job[UUID])
+        metrics.inc("sd_images_total", {"type": job[KEY_JOB_TYPE]})
+
+    return results[0]
+
+
+def reuse_done_result(model: Model, job: dict) -> dict:
+    """
+    Gets the result of an identical job done before with the model `job` would run on.
+    """
+    if job[KEY_JOB_TYPE] == VALUE_JOB_INPAINTING:
+        base_model = model.inpainting_model_name
+    else:
+        base_model = job.get(KEY_BASE_MODEL, "") or VALUE_BASE_MODEL_DEFAULT
+    result_dict = database.get_done_result(job[UUID], base_model)
+    if job[KEY_JOB_TYPE] in [VALUE_JOB_IMG2IMG, VALUE_JOB_INPAINTING, VALUE_JOB_TXT2IMG]:
+        metrics.inc(
+            "sd_cache_requests_total",
+            {"cache": "result", "result": "hit" if result_dict else "miss"},
+        )
+    return result_dict
+
+
+def finish_job(
+    job: dict,
+    result_dict: dict,
+    spans: SpanRecorder = DummySpanRecorder(),
+    stats: dict = {},
+):
+    """
+    Stores the result of `job`, plus `stats` such as its peak memory, and finishes
+    pending jobs identical to it with the same result instead of running them.
+    """
+    # update_job() replaces the image with its filepath, each job gets its own copy
+    duplicate_result_dict = dict(result_dict)
+    with spans.span("store_result"):
+        database.update_job(result_dict, job_uuid=job[UUID])
+    database.update_job(
+        {
+            KEY_JOB_STATUS: VALUE_JOB_DONE,
+            KEY_TIMINGS: json.dumps(spans.to_dict()),
+            **stats,
+        },
+        job_uuid=job[UUID],
+    )
+    metrics.inc("sd_images_total", {"type": job[KEY_JOB_TYPE]})
+
+    for job_uuid in database.get_pending_duplicates(job[UUID]):
+        logger.info(f"{job_uuid} is identical to {job[UUID]}, reusing its result")
+        database.update_job(dict(duplicate_result_dict), job_uuid=job_uuid)
+        database.update_job({KEY_JOB_STATUS: VALUE_JOB_DONE}, job_uuid=job_uuid)
+        metrics.inc("sd_images_total", {"type": job[KEY_JOB_TYPE]})
+
+
+def backend(
+    model,
+    gfpgan_worker: GfpganWorker,
+    restoration_batch_size: int,
+    is_debugging: bool,
+    profiler: JobProfiler = JobProfiler(),
+    model_affinity_window: float = MODEL_AFFINITY_WINDOW_SECONDS,
+):
     text2img = Text2Img(model, logger=Logger(name=LOGGER_NAME_TXT2IMG))
     text2img.breakfast()
     img2img = Img2Img(model, logger=Logger(name=LOGGER_NAME_IMG2IMG))
@@ -82,23 +284,60 @@ def backend(model, gfpgan_folderpath, is_debugging: bool):
     inpainting = Inpainting(model, logger=Logger(name=LOGGER_NAME_INPAINT))
     inpainting.breakfast()
 
+    # group of the last job, its remaining jobs go first
+    group_id = ""
+    # adapters of the last jobs, preferred for a while so that they are switched less
+    lora_model = ""
+    lora_streak = 0
+
     while 1:
+        clear_log_context()
         wait_for_seconds(1)
+        metrics.flush_if_due()
 
         if is_debugging:
             pending_jobs = database.get_jobs()
         else:
-            pending_jobs = database.get_one_pending_job()
+            pending_jobs = database.get_one_pending_job(
+                group_id=group_id,
+                lora_model=lora_model if lora_streak < LORA_AFFINITY_MAX_JOBS else None,
+                base_model=model.model_name,
+                fairness_seconds=model_affinity_window,
+            )
         if len(pending_jobs) == 0:
             continue
 
         next_job = pending_jobs[0]
+        group_id = next_job.get(KEY_GROUP_ID, "")
+        if next_job.get(KEY_LORA_MODEL, "") == lora_model:
+            lora_streak += 1
+        else:
+            lora_model = next_job.get(KEY_LORA_MODEL, "")
+            lora_streak = 1
+        spans = SpanRecorder()
+        reset_peak_memory()
+        set_log_context(job_uuid=next_job[UUID], job_type=next_job[KEY_JOB_TYPE])
 
         if not is_debugging:
             database.update_job(
                 {KEY_JOB_STATUS: VALUE_JOB_RUNNING}, job_uuid=next_job[UUID]
             )
+            created_at = database.get_created_at(next_job[UUID])
+            if created_at is not None:
+                metrics.observe(
+                    "sd_queue_wait_seconds",
+                    (datetime.datetime.now() - created_at).total_seconds(),
+                    get_metric_labels(next_job),
+                )
 
+            with spans.span("reuse_lookup"):
+                result_dict = reuse_done_result(model, next_job)
+            if result_dict:
+                logger.info(f"{next_job[UUID]} was done before, reusing its result")
+                finish_job(next_job, result_dict, spans)
+                continue
+
+        start = time.monotonic()
         prompt = next_job.get(KEY_PROMPT, "")
         negative_prompt = next_job.get(KEY_NEG_PROMPT, "")
 
@@ -108,25 +347,59 @@ def backend(model, gfpgan_folderpath, is_debugging: bool):
             and KEY_LANGUAGE in next_job
         ):
             if VALUE_LANGUAGE_EN != next_job[KEY_LANGUAGE]:
+                set_log_context(stage="translate")
+                translation_start = time.perf_counter()
                 logger.info(
                     f"found {next_job[KEY_LANGUAGE]}, translate prompt and negative prompt first"
                 )
-                prompt_en = translate_prompt(prompt, next_job[KEY_LANGUAGE])
+                prompt_en = translate(prompt, next_job[KEY_LANGUAGE])
                 logger.info(f"translated {prompt} to {prompt_en}")
                 prompt = prompt_en
                 if negative_prompt:
-                    negative_prompt_en = translate_prompt(
+                    negative_prompt_en = translate(
                         negative_prompt, next_job[KEY_LANGUAGE]
                     )
                     logger.info(f"translated {negative_prompt} to {negative_prompt_en}")
                     negative_prompt = negative_prompt_en
+                spans.add("translate", translation_start, time.perf_counter())
 
-        config = Config().set_config(next_job)
+        with spans.span("config"):
+            config = Config().set_config(next_job)
 
+        set_log_context(stage="run")
+        profiler.start(next_job[UUID])
+        switch_seconds = 0
         try:
+            # rows added before the frontend filled in the model, see validate_job()
+            base_model = next_job.get(KEY_BASE_MODEL, "") or VALUE_BASE_MODEL_DEFAULT
+            if (
+                next_job[KEY_JOB_TYPE] in [VALUE_JOB_IMG2IMG, VALUE_JOB_TXT2IMG]
+                and base_model != model.model_name
+            ):
+                logger.info(f"switching from {model.model_name} to {base_model}")
+                switch_start = time.monotonic()
+                with spans.span("model_switch"):
+                    model.update_model_name(base_model)
+                switch_seconds = time.monotonic() - switch_start
+                if not is_debugging:
+                    database.record_model_switch(base_model, switch_seconds)
+                metrics.observe(
+                    "sd_model_switch_seconds", switch_seconds, {"model": base_model}
+                )
+
+            if next_job[KEY_JOB_TYPE] != VALUE_JOB_RESTORATION:
+                with spans.span("lora"):
+                    model.apply_lora(
+                        config.get_lora_model(),
+                        inpainting=next_job[KEY_JOB_TYPE] == VALUE_JOB_INPAINTING,
+                    )
+
             if next_job[KEY_JOB_TYPE] == VALUE_JOB_TXT2IMG:
                 result_dict = text2img.lunch(
-                    prompt=prompt, negative_prompt=negative_prompt, config=config
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    config=config,
+                    spans=spans,
                 )
             elif next_job[KEY_JOB_TYPE] == VALUE_JOB_IMG2IMG:
                 ref_img = next_job[REFERENCE_IMG]
@@ -135,6 +408,7 @@ def backend(model, gfpgan_folderpath, is_debugging: bool):
                     negative_prompt=negative_prompt,
                     reference_image=ref_img,
                     config=config,
+                    spans=spans,
                 )
             elif next_job[KEY_JOB_TYPE] == VALUE_JOB_INPAINTING:
                 ref_img = next_job[REFERENCE_IMG]
@@ -145,16 +419,13 @@ def backend(model, gfpgan_folderpath, is_debugging: bool):
                     reference_image=ref_img,
                     mask_image=mask_img,
                     config=config,
+                    spans=spans,
                 )
             elif next_job[KEY_JOB_TYPE] == VALUE_JOB_RESTORATION:
-                ref_img_filepath = next_job[REFERENCE_IMG]
-                result_dict = gfpgan(
-                    gfpgan_folderpath,
-                    next_job[UUID],
-                    ref_img_filepath,
-                    config=config,
-                    logger=logger,
-                )
+                with spans.span("restore"):
+                    result_dict = restore_jobs(
+                        gfpgan_worker, next_job, restoration_batch_size, is_debugging
+                    )
                 if not result_dict:
                     raise ValueError("failed to run gfpgan")
             else:
@@ -163,30 +434,94 @@ def backend(model, gfpgan_folderpath, is_debugging: bool):
             break
         except BaseException as e:
             logger.error(e)
+            # after running out of memory, give back all that can be given back
+            reclaim_memory_if_needed(
+                force=isinstance(e, (MemoryError, torch.cuda.OutOfMemoryError))
+            )
             database.update_job(
-                {KEY_JOB_STATUS: VALUE_JOB_FAILED}, job_uuid=next_job[UUID]
+                {
+                    KEY_JOB_STATUS: VALUE_JOB_FAILED,
+                    KEY_TIMINGS: json.dumps(spans.to_dict()),
+                    **record_job_memory(next_job),
+                },
+                job_uuid=next_job[UUID],
             )
-            empty_memory_cache()
+            metrics.inc("sd_jobs_failed_total", {"type": next_job[KEY_JOB_TYPE]})
+            if isinstance(e, ModelUnavailableError):
+                # rather than failing every txt2img and img2img job from now on
+                break
             continue
+        finally:
+            profiler.stop()
 
-        database.update_job(result_dict, job_uuid=next_job[UUID])
-        if not is_debugging:
-            database.update_job(
-                {KEY_JOB_STATUS: VALUE_JOB_DONE}, job_uuid=next_job[UUID]
-            )
+        set_log_context(stage="store_result")
+        stats = record_job_memory(next_job)
+        if is_debugging:
+            database.update_job(result_dict, job_uuid=next_job[UUID])
+        else:
+            # restore_jobs() records the costs of its batch itself
+            if next_job[KEY_JOB_TYPE] != VALUE_JOB_RESTORATION:
+                # the switch is in the cost model on its own, see record_model_switch()
+                exec_seconds = time.monotonic() - start - switch_seconds
+                database.record_job_cost(next_job, exec_seconds)
+                metrics.observe(
+                    "sd_job_exec_seconds", exec_seconds, get_metric_labels(next_job)
+                )
+            finish_job(next_job, result_dict, spans, stats)
 
     logger.critical("stopped")
 
 
 def main(args):
+    configure_logging(use_queue=args.log_queue, json_lines=args.log_format == "json")
     database.set_image_output_folder(args.image_output_folder)
     database.connect(args.db)
+    metrics.connect(args.metrics_db or f"{args.db}.metrics")
+    set_high_water_marks(
+        rss_bytes=args.rss_high_water_mb * 1024 * 1024,
+        device_bytes=args.device_high_water_mb * 1024 * 1024,
+    )
 
     if not os.path.isdir(args.model_caching_folder):
         os.makedirs(args.model_caching_folder, exist_ok=True)
 
-    model = load_model(logger, args.gpu, args.gpu_device, args.reduce_memory_usage, args.model_caching_folder)
-    backend(model, args.gfpgan, args.debug)
+    model = load_model(
+        logger,
+        args.gpu,
+        args.gpu_device,
+        args.reduce_memory_usage,
+        args.model_caching_folder,
+        lora_folder_path=args.lora_folder,
+        lora_cache_size=args.lora_cache_size,
+        reference_cache_size=args.reference_cache_size,
+        cpu_precision=args.cpu_precision,
+        onnx_folder_path=args.onnx_folder,
+        onnx_threads=args.onnx_threads,
+    )
+    metrics.watch_cache("lora", model.lora_cache)
+    for kind, cache in model.reference_cache.caches.items():
+        metrics.watch_cache(f"reference_{kind}", cache)
+    gfpgan_worker = GfpganWorker(
+        args.gfpgan,
+        python_filepath=args.gfpgan_python,
+        timeout_seconds=args.gfpgan_timeout,
+        logger=logger,
+    )
+    profiler = JobProfiler(
+        sample_rate=args.profile_sample_rate,
+        folderpath=args.profile_folder,
+        max_bytes=args.profile_max_mb * 1024 * 1024,
+        logger=logger,
+    )
+    backend(
+        model,
+        gfpgan_worker,
+        args.restoration_batch_size,
+        args.debug,
+        profiler,
+        model_affinity_window=args.model_affinity_window,
+    )
+    gfpgan_worker.stop()
 
     database.safe_disconnect()
 
@@ -222,6 +557,59 @@ if __name__ == "__main__":
         help="Reduce memory usage when using GPU",
     )
 
+    # Add an argument to set what to run in without GPU
+    parser.add_argument(
+        "--cpu-precision",
+        type=str,
+        default=VALUE_CPU_PRECISION_FLOAT64,
+        choices=SUPPORTED_CPU_PRECISIONS,
+        help="Precision to run in on CPU, int8 quantizes the Linear layers of the text encoder and UNet and leaves them out of LoRA adapters",
+    )
+
+    # Add arguments to run the graphs of tools/export_onnx.py with ONNX Runtime on CPU
+    parser.add_argument(
+        "--onnx-folder",
+        type=str,
+        default="",
+        help="Folder tools/export_onnx.py exported the base models to, run them with ONNX Runtime instead of PyTorch on CPU",
+    )
+    parser.add_argument(
+        "--onnx-threads",
+        type=int,
+        default=0,
+        help="Threads per ONNX Runtime operator, 0 for as many as there are cores",
+    )
+
+    # Add arguments to set where LoRA adapters are and how many of them to keep fused
+    parser.add_argument(
+        "--lora-folder",
+        type=str,
+        default="",
+        help="Folder of the LoRA adapters jobs may name, <name>.safetensors or <name>/pytorch_lora_weights.bin",
+    )
+    parser.add_argument(
+        "--lora-cache-size",
+        type=int,
+        default=LORA_CACHE_SIZE,
+        help="Adapter sets to keep the fused weights of, each holds a copy of the layers its adapters change",
+    )
+
+    # Add an argument to set how many reference images to keep decoded and encoded
+    parser.add_argument(
+        "--reference-cache-size",
+        type=int,
+        default=REFERENCE_CACHE_SIZE,
+        help="Reference images, tensors and VAE latents to keep each for repeated img2img and inpainting",
+    )
+
+    # Add an argument to set how long jobs for another base model may wait
+    parser.add_argument(
+        "--model-affinity-window",
+        type=float,
+        default=MODEL_AFFINITY_WINDOW_SECONDS,
+        help="Seconds jobs asking for another base model wait at most before the backend switches to it, 0 to only switch once no job for the loaded one is left",
+    )
+
     # Add an argument to reduce memory usage
     parser.add_argument(
         "--gfpgan",
@@ -230,6 +618,38 @@ if __name__ == "__main__":
         help="GFPGAN folderpath",
     )
 
+    # Add an argument to set the python interpreter of GFPGAN
+    parser.add_argument(
+        "--gfpgan-python",
+        type=str,
+        default="/usr/bin/python",
+        help="Python interpreter to run the GFPGAN worker with",
+    )
+
+    # Add an argument to set the timeout of a restoration
+    parser.add_argument(
+        "--gfpgan-timeout",
+        type=int,
+        default=300,
+        help="Seconds to wait for GFPGAN to restore an image before restarting it",
+    )
+
+    # Add an argument to set how many restoration jobs to run at once
+    parser.add_argument(
+        "--restoration-batch-size",
+        type=int,
+        default=8,
+        help="Max number of pending restoration jobs to restore in one GFPGAN call",
+    )
+
+    # Add an argument to set where to keep metrics
+    parser.add_argument(
+        "--metrics-db",
+        type=str,
+        default="",
+        help="Path to the SQLite file shared with the frontend for /metrics, defaults to <db>.metrics",
+    )
+
     # Add an argument to set the path of the database file
     parser.add_argument(
         "--image-output-folder",
@@ -239,6 +659,60 @@ if __name__ == "__main__":
         help="Path to output images",
     )
 
+    # Add arguments to set when to reclaim memory
+    parser.add_argument(
+        "--rss-high-water-mb",
+        type=int,
+        default=0,
+        help="Collect garbage after a job only above this resident memory, 0 for 80%% of the RAM",
+    )
+    parser.add_argument(
+        "--device-high-water-mb",
+        type=int,
+        default=0,
+        help="Release cached GPU memory only above this much reserved, 0 for 80%% of the GPU memory",
+    )
+
+    # Add an argument to profile some of the jobs
+    parser.add_argument(
+        "--profile-sample-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of jobs to profile with cProfile and the torch profiler, 0 to never profile",
+    )
+
+    # Add an argument to set where to keep profiles
+    parser.add_argument(
+        "--profile-folder",
+        type=str,
+        default="profiles",
+        help="Folder to write the profiles to, one folder per job uuid",
+    )
+
+    # Add an argument to cap the disk usage of profiles
+    parser.add_argument(
+        "--profile-max-mb",
+        type=int,
+        default=500,
+        help="Delete the oldest profiles once all of them take more megabytes than this",
+    )
+
+    # Add an argument to log without blocking the caller
+    parser.add_argument(
+        "--log-queue",
+        action="store_true",
+        help="Format and write log messages on a background thread",
+    )
+
+    # Add an argument to set the log format
+    parser.add_argument(
+        "--log-format",
+        type=str,
+        choices=["text", "json"],
+        default="text",
+        help="json writes one JSON object per line, with job uuid and stage where known",
+    )
+
     args = parser.parse_args()
 
     main(args)
@@ -1,15 +1,21 @@
 import argparse
+import hashlib
+import itertools
+import math
+import os
 import uuid
 from flask import jsonify
 from flask import Flask
 from flask import render_template
 from flask import request
+from flask import Response
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 from utilities.constants import LOGGER_NAME_FRONTEND
 
 from utilities.logger import Logger
+from utilities.logger import configure_logging
 
 from utilities.constants import APIKEY
 from utilities.constants import KEY_JOB_TYPE
@@ -20,39 +26,103 @@ from utilities.constants import MAX_JOB_NUMBER
 from utilities.constants import OPTIONAL_KEYS
 from utilities.constants import KEY_LANGUAGE
 from utilities.constants import SUPPORTED_LANGS
+from utilities.constants import KEY_INPAINT_MODE
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import VALUE_BASE_MODEL_DEFAULT
+from utilities.constants import SUPPORTED_BASE_MODELS
+from utilities.constants import SUPPORTED_INPAINT_MODES
+from utilities.constants import KEY_TILE_SIZE
+from utilities.constants import KEY_TILE_OVERLAP
+from utilities.constants import KEY_TILE_BATCH_SIZE
+from utilities.constants import TILE_MIN_SIZE
+from utilities.constants import TILE_MAX_SIZE
+from utilities.constants import TILE_MAX_BATCH_SIZE
+from utilities.constants import TILE_MAX_PIXELS
+from utilities.constants import KEY_WIDTH
+from utilities.constants import VALUE_WIDTH_DEFAULT
+from utilities.constants import KEY_HEIGHT
+from utilities.constants import VALUE_HEIGHT_DEFAULT
 from utilities.constants import REQUIRED_KEYS
 from utilities.constants import UUID
 from utilities.constants import VALUE_JOB_TXT2IMG
 from utilities.constants import VALUE_JOB_IMG2IMG
 from utilities.constants import VALUE_JOB_INPAINTING
 from utilities.constants import VALUE_JOB_RESTORATION
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import VALUE_JOB_PENDING
+from utilities.constants import VALUE_JOB_RUNNING
 from utilities.constants import IMAGE_NOT_FOUND_BASE64
+from utilities.constants import RANDOM_JOBS_CACHE_SECONDS
+from utilities.constants import OUTPUT_ONLY_KEYS
+from utilities.constants import KEY_FIELDS
+from utilities.constants import KEY_GROUP_ID
+from utilities.constants import KEY_POSITION
+from utilities.constants import KEY_ETA
+from utilities.constants import COST_MODEL_CACHE_SECONDS
+from utilities.constants import QUEUE_CACHE_SECONDS
+from utilities.constants import KEY_SWEEP
+from utilities.constants import SUPPORTED_SWEEP_KEYS
+from utilities.constants import KEY_PAGE_SIZE
+from utilities.constants import KEY_CURSOR
+from utilities.constants import KEY_NEXT_CURSOR
+from utilities.constants import DEFAULT_PAGE_SIZE
+from utilities.constants import MAX_PAGE_SIZE
+from utilities.cache import TTLCache
+from utilities.cost_model import estimate_queue
+from utilities.cost_model import estimate_seconds
+from utilities.compression import compress
 from utilities.database import Database
+from utilities.database import QuotaExceededError
+from utilities.database import decode_cursor
+from utilities.database import encode_cursor
 from utilities.images import load_image
+from utilities.lora import normalize_lora_spec
+from utilities.metrics import Metrics
+from utilities.limiter_storage import SQLiteStorage  # registers sqlite:// for limiter
 
 logger = Logger(name=LOGGER_NAME_FRONTEND)
 database = Database(logger)
 app = Flask(__name__)
-limiter = Limiter(
-    get_remote_address,
-    app=app,
-)
+# bound to the app in main() once the storage is known
+limiter = Limiter(get_remote_address)
+random_jobs_cache = TTLCache(maxsize=1, ttl_seconds=RANDOM_JOBS_CACHE_SECONDS)
+costs_cache = TTLCache(maxsize=1, ttl_seconds=COST_MODEL_CACHE_SECONDS)
+queue_cache = TTLCache(maxsize=1, ttl_seconds=QUEUE_CACHE_SECONDS)
+# shared with the backend, which records most of the metrics
+metrics = Metrics(logger=logger)
 
 
-@app.route("/add_job", methods=["POST"])
-@limiter.limit("4/second")
-def add_job():
-    req = request.get_json()
+@app.after_request
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.status_code != 200
+        or response.mimetype != "application/json"
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    coding, body = compress(
+        response.get_data(), request.headers.get("Accept-Encoding", "")
+    )
+    if coding:
+        response.set_data(body)
+        response.headers["Content-Encoding"] = coding
+    return response
 
-    if APIKEY not in req:
-        logger.error(f"{APIKEY} not present in {req}")
-        return "", 401
-    user = database.validate_user(req[APIKEY])
-    if not user:
-        logger.error(f"user not found with {req[APIKEY]}")
-        return "", 401
 
+def validate_job(req: dict, ignored_keys=[]):
+    """
+    Checks an /add_job style request of an already validated user, brings its
+    lora_model into the canonical form the backend groups jobs by, and fills in the
+    default base_model of txt2img and img2img jobs.
+
+    Returns None if the job can be added, otherwise the error response.
+    """
     for key in req.keys():
+        if key in ignored_keys:
+            continue
         if (key not in REQUIRED_KEYS) and (key not in OPTIONAL_KEYS):
             return jsonify({"msg": "provided one or more unrecognized keys"}), 404
 
@@ -75,18 +145,216 @@ def add_job():
     if KEY_LANGUAGE in req and req[KEY_LANGUAGE] not in SUPPORTED_LANGS:
         return jsonify({"msg": f"not suporting {req[KEY_LANGUAGE]}"}), 404
 
-    if database.count_all_pending_jobs(req[APIKEY]) > MAX_JOB_NUMBER:
-        return (
-            jsonify({"msg": "too many jobs in queue, please wait or cancel some"}),
-            500,
-        )
+    if KEY_INPAINT_MODE in req and req[KEY_INPAINT_MODE] not in SUPPORTED_INPAINT_MODES:
+        return jsonify({"msg": f"not suporting {req[KEY_INPAINT_MODE]}"}), 404
+
+    if req.get(KEY_BASE_MODEL, ""):
+        if req.get(KEY_JOB_TYPE, None) not in [VALUE_JOB_TXT2IMG, VALUE_JOB_IMG2IMG]:
+            msg = f"{KEY_BASE_MODEL} only supported by txt2img and img2img jobs"
+            return jsonify({"msg": msg}), 404
+        if req[KEY_BASE_MODEL] not in SUPPORTED_BASE_MODELS:
+            return jsonify({"msg": f"not suporting {req[KEY_BASE_MODEL]}"}), 404
+    elif req.get(KEY_JOB_TYPE, None) in [VALUE_JOB_TXT2IMG, VALUE_JOB_IMG2IMG]:
+        # the model loaded at start, as before jobs could ask for one, rather than
+        # whichever model the previous job left loaded
+        req[KEY_BASE_MODEL] = VALUE_BASE_MODEL_DEFAULT
+
+    tile_ranges = {
+        KEY_TILE_SIZE: (0, TILE_MAX_SIZE),
+        KEY_TILE_OVERLAP: (0, TILE_MAX_SIZE),
+        KEY_TILE_BATCH_SIZE: (1, TILE_MAX_BATCH_SIZE),
+    }
+    for key, (minimum, maximum) in tile_ranges.items():
+        if key in req and (
+            type(req[key]) is not int or not minimum <= req[key] <= maximum
+        ):
+            msg = f"{key} must be an integer within {minimum} and {maximum}"
+            return jsonify({"msg": msg}), 404
+    # a tile_size of 0 disables tiling, the pipeline crops sides to multiples of 8
+    tile_size = req.get(KEY_TILE_SIZE, 0)
+    if tile_size and (tile_size < TILE_MIN_SIZE or tile_size % 8):
+        msg = f"{KEY_TILE_SIZE} must be 0 or a multiple of 8 from {TILE_MIN_SIZE} on"
+        return jsonify({"msg": msg}), 404
+    # else the tiles leave gaps in between
+    if tile_size and req.get(KEY_TILE_OVERLAP, 0) >= tile_size:
+        msg = f"{KEY_TILE_OVERLAP} must be below {KEY_TILE_SIZE}"
+        return jsonify({"msg": msg}), 404
+    if tile_size:
+        # the output is blended at full size, and the tiles to run grow with it
+        width = req.get(KEY_WIDTH, VALUE_WIDTH_DEFAULT)
+        height = req.get(KEY_HEIGHT, VALUE_HEIGHT_DEFAULT)
+        if (
+            type(width) is not int
+            or type(height) is not int
+            or width < 1
+            or height < 1
+            or width * height > TILE_MAX_PIXELS
+        ):
+            msg = f"tiled images must be of at most {TILE_MAX_PIXELS} pixels"
+            return jsonify({"msg": msg}), 404
+
+    if KEY_LORA_MODEL in req:
+        try:
+            req[KEY_LORA_MODEL] = normalize_lora_spec(req[KEY_LORA_MODEL])
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 404
+
+    return None
+
+
+def get_costs() -> dict:
+    costs = costs_cache.get("costs", None)
+    if costs is None:
+        costs = database.get_costs()
+        costs_cache.set("costs", costs)
+    return costs
+
+
+def get_polled_queue() -> tuple:
+    """
+    Returns (queue, {uuid: (position, eta_seconds)}, total_seconds) of the queue at
+    most QUEUE_CACHE_SECONDS ago, so that polls and submissions do not each scan and
+    estimate it.
+    """
+    polled = queue_cache.get("queue", None)
+    if polled is None:
+        queue = database.get_queue()
+        polled = (queue, *estimate_queue(queue, get_costs()))
+        queue_cache.set("queue", polled)
+    return polled
+
+
+def estimate_new_jobs(jobs: list, job_uuids: list) -> list:
+    """
+    Returns the (position, eta_seconds) of `jobs` just added as `job_uuids`, estimated
+    on the polled queue rather than on another scan of it.
+    """
+    queue, _, _ = get_polled_queue()
+    queue = [job for job in queue if job[UUID] not in job_uuids]
+    running = [job for job in queue if job.get(KEY_JOB_STATUS, "") == VALUE_JOB_RUNNING]
+    new_jobs = [
+        {**job, UUID: job_uuid, KEY_JOB_STATUS: VALUE_JOB_PENDING}
+        for job, job_uuid in zip(jobs, job_uuids)
+    ]
+    # get_queue() lists the pending jobs newest first, the last one added is newest
+    queue = running + new_jobs[::-1] + queue[len(running) :]
+    estimates, _ = estimate_queue(queue, get_costs())
+    return [estimates[job_uuid] for job_uuid in job_uuids]
+
+
+def check_queue_wait(jobs: list):
+    """
+    Returns None if `jobs` may join the queue, otherwise the error response.
+    """
+    max_queue_wait = app.config.get("MAX_QUEUE_WAIT_SECONDS", 0)
+    if not max_queue_wait:
+        return None
+    _, _, total_seconds = get_polled_queue()
+    total_seconds += sum([estimate_seconds(job, get_costs()) for job in jobs])
+    if total_seconds <= max_queue_wait:
+        return None
+    response = jsonify(
+        {"msg": "the queue is too long right now, please try again later"}
+    )
+    response.headers["Retry-After"] = str(math.ceil(total_seconds - max_queue_wait))
+    return response, 503
+
+
+@app.route("/add_job", methods=["POST"])
+@limiter.limit("4/second")
+def add_job():
+    req = request.get_json()
+
+    if APIKEY not in req:
+        logger.error(f"{APIKEY} not present in {req}")
+        return "", 401
+    user = database.validate_user(req[APIKEY])
+    if not user:
+        logger.error(f"user not found with {req[APIKEY]}")
+        return "", 401
+
+    error = validate_job(req) or check_queue_wait([req])
+    if error:
+        return error
 
     job_uuid = str(uuid.uuid4())
     logger.info("adding a new job with uuid {}..".format(job_uuid))
 
-    database.insert_new_job(req, job_uuid=job_uuid)
+    try:
+        database.insert_new_job(req, job_uuid=job_uuid, max_pending=MAX_JOB_NUMBER)
+    except QuotaExceededError as e:
+        return jsonify({"msg": str(e)}), 429
+
+    position, eta = estimate_new_jobs([req], [job_uuid])[0]
+    return jsonify({"msg": "", UUID: job_uuid, KEY_POSITION: position, KEY_ETA: eta})
+
+
+@app.route("/add_jobs", methods=["POST"])
+@limiter.limit("4/second")
+def add_jobs():
+    """
+    Adds one job per combination of the values in `sweep`, e.g.
+    {"seed": ["1", "2"], "steps": [20, 50]} on top of an /add_job request adds 4 jobs.
+    """
+    req = request.get_json()
+
+    if APIKEY not in req:
+        logger.error(f"{APIKEY} not present in {req}")
+        return "", 401
+    user = database.validate_user(req[APIKEY])
+    if not user:
+        logger.error(f"user not found with {req[APIKEY]}")
+        return "", 401
 
-    return jsonify({"msg": "", UUID: job_uuid})
+    error = validate_job(req, ignored_keys=[KEY_SWEEP])
+    if error:
+        return error
+
+    sweep = req.get(KEY_SWEEP, {})
+    if not isinstance(sweep, dict) or not sweep:
+        return jsonify({"msg": f"missing {KEY_SWEEP}"}), 404
+    for key, values in sweep.items():
+        if key not in SUPPORTED_SWEEP_KEYS:
+            return jsonify({"msg": f"not supporting {key} in {KEY_SWEEP}"}), 404
+        if not isinstance(values, list) or not values:
+            return jsonify({"msg": f"{key} in {KEY_SWEEP} must be a list"}), 404
+
+    job_count = 1
+    for values in sweep.values():
+        job_count *= len(values)
+    if job_count > MAX_JOB_NUMBER:
+        return jsonify({"msg": f"at most {MAX_JOB_NUMBER} jobs per sweep"}), 404
+
+    base_job = {key: value for key, value in req.items() if key != KEY_SWEEP}
+    jobs = [
+        {**base_job, **dict(zip(sweep.keys(), combination))}
+        for combination in itertools.product(*sweep.values())
+    ]
+    error = check_queue_wait(jobs)
+    if error:
+        return error
+
+    job_uuids = [str(uuid.uuid4()) for _ in jobs]
+    group_id = str(uuid.uuid4())
+    logger.info(f"adding {len(jobs)} jobs with group id {group_id}..")
+
+    try:
+        database.insert_new_jobs(
+            jobs, job_uuids=job_uuids, group_id=group_id, max_pending=MAX_JOB_NUMBER
+        )
+    except QuotaExceededError as e:
+        return jsonify({"msg": str(e)}), 429
+
+    job_estimates = estimate_new_jobs(jobs, job_uuids)
+    return jsonify(
+        {
+            "msg": "",
+            KEY_GROUP_ID: group_id,
+            "uuids": job_uuids,
+            KEY_POSITION: [position for position, _ in job_estimates],
+            KEY_ETA: [eta for _, eta in job_estimates],
+        }
+    )
 
 
 @app.route("/cancel_job", methods=["POST"])
@@ -140,49 +408,124 @@ def get_jobs():
     if not user:
         return "", 401
 
-    # define max number of jobs to fetch from db
-    job_count_limit = 20
+    fields = req.get(KEY_FIELDS, "")
+    fields = fields.split(",") if isinstance(fields, str) else fields
+    fields = [field.strip() for field in fields if field.strip()]
+    for field in fields:
+        if field not in OUTPUT_ONLY_KEYS + REQUIRED_KEYS + OPTIONAL_KEYS:
+            return jsonify({"msg": f"not supporting field {field}"}), 404
+
+    try:
+        page_size = int(req.get(KEY_PAGE_SIZE, DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        page_size = 0
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        return (
+            jsonify({"msg": f"{KEY_PAGE_SIZE} must be within 1 and {MAX_PAGE_SIZE}"}),
+            404,
+        )
+
+    try:
+        cursor = decode_cursor(req.get(KEY_CURSOR, ""))
+    except ValueError:
+        return jsonify({"msg": f"invalid {KEY_CURSOR}"}), 404
+
+    job_types = req[KEY_JOB_TYPE].split(",") if req.get(KEY_JOB_TYPE, "") else []
 
+    # answer polls of unchanged jobs before any image is read
+    jobs_etag = database.get_jobs_etag(
+        job_uuid=req.get(UUID, ""),
+        apikey=req[APIKEY],
+        job_types=job_types,
+        limit_count=page_size if UUID in req else page_size + 1,
+        cursor=() if UUID in req else cursor,
+    )
+    # jobs of others moving through the queue change positions and ETAs, too
+    queue, estimates, _ = get_polled_queue()
+    queue_etag = ",".join(
+        f"{estimates[job[UUID]][0]}:{int(estimates[job[UUID]][1]) // 10}"
+        for job in queue
+        if job.get(APIKEY, "") == req[APIKEY]
+    )
+    etag = hashlib.sha1(
+        f"{jobs_etag}|{','.join(fields)}|{queue_etag}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    next_cursor = ()
     if UUID in req:
         jobs = database.get_jobs(
             job_uuid=req[UUID],
             apikey=req[APIKEY],
-            job_types=req[KEY_JOB_TYPE].split(",") if req.get(KEY_JOB_TYPE, "") else [],
-            limit_count=job_count_limit,
+            job_types=job_types,
+            limit_count=page_size,
+            fields=fields,
         )
     else:
-        jobs = database.get_jobs(
+        jobs, next_cursor = database.get_jobs_page(
             apikey=req[APIKEY],
-            job_types=req[KEY_JOB_TYPE].split(",") if req.get(KEY_JOB_TYPE, "") else [],
-            limit_count=job_count_limit,
+            job_types=job_types,
+            fields=fields,
+            page_size=page_size,
+            cursor=cursor,
         )
 
     for job in jobs:
-        # load image to job if has one
+        if job.get(UUID, "") in estimates:
+            job[KEY_POSITION], job[KEY_ETA] = estimates[job[UUID]]
+
+        # load image to job if has one, only present when asked for in fields
         for key in [BASE64IMAGE, REFERENCE_IMG, MASK_IMG]:
             if key in job and "base64" not in job[key]:
                 data = load_image(job[key], to_base64=True)
                 job[key] = data if data else IMAGE_NOT_FOUND_BASE64
 
-    return jsonify({"jobs": jobs})
+    response = jsonify({"jobs": jobs, KEY_NEXT_CURSOR: encode_cursor(next_cursor)})
+    # weak as the bytes differ per Content-Encoding
+    response.set_etag(etag, weak=True)
+    return response
 
 
 @app.route("/random_jobs", methods=["GET"])
 @limiter.limit("4/second")
 def random_jobs():
-    # define max number of jobs to fetch from db
-    job_count_limit = 20
-
-    jobs = database.get_random_jobs(limit_count=job_count_limit)
-
-    for job in jobs:
-        # load image to job if has one
-        for key in [BASE64IMAGE, REFERENCE_IMG, MASK_IMG]:
-            if key in job and "base64" not in job[key]:
-                data = load_image(job[key], to_base64=True)
-                job[key] = data if data else IMAGE_NOT_FOUND_BASE64
-
-    return jsonify({"jobs": jobs})
+    # the same sample is served to everyone for a few seconds
+    jobs = random_jobs_cache.get("jobs", None)
+    if jobs is None:
+        # define max number of jobs to fetch from db
+        job_count_limit = 20
+
+        jobs = database.get_random_jobs(limit_count=job_count_limit)
+
+        for job in jobs:
+            # load image to job if has one
+            for key in [BASE64IMAGE, REFERENCE_IMG, MASK_IMG]:
+                if key in job and "base64" not in job[key]:
+                    data = load_image(job[key], to_base64=True)
+                    job[key] = data if data else IMAGE_NOT_FOUND_BASE64
+
+        random_jobs_cache.set("jobs", jobs)
+
+    response = jsonify({"jobs": jobs})
+    response.headers["Cache-Control"] = f"public, max-age={RANDOM_JOBS_CACHE_SECONDS}"
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def get_metrics():
+    gauges = {
+        "sd_jobs": [
+            ({"status": status, "type": job_type}, count)
+            for status, job_type, count in database.count_queued_jobs()
+        ]
+    }
+    return Response(
+        metrics.render(gauges), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.route("/")
@@ -197,12 +540,56 @@ def restoration():
     return render_template("restoration.html")
 
 
+def serve_with_gunicorn(host: str, port: str, workers: int, threads: int):
+    """
+    Serves the app with several gunicorn worker processes, each running several threads.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class FrontendApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+
+        def load(self):
+            return app
+
+    FrontendApplication().run()
+
+
 def main(args):
+    configure_logging(use_queue=args.log_queue, json_lines=args.log_format == "json")
     database.set_image_output_folder(args.image_output_folder)
     database.connect(args.db)
 
+    metrics.connect(args.metrics_db or f"{args.db}.metrics")
+    metrics.watch_cache("random_jobs", random_jobs_cache)
+    metrics.watch_cache("costs", costs_cache)
+    metrics.watch_cache("queue", queue_cache)
+    for name, cache in database.get_caches().items():
+        metrics.watch_cache(name, cache)
+
+    limiter_storage_uri = args.limiter_storage
+    if not limiter_storage_uri:
+        # worker processes must share one storage, otherwise each one has its own limits
+        limiter_storage_uri = (
+            "memory://"
+            if args.server == "flask"
+            else f"sqlite:///{os.path.abspath(args.db)}.limits"
+        )
+    logger.info(f"rate limits are stored in {limiter_storage_uri}")
+    app.config["RATELIMIT_STORAGE_URI"] = limiter_storage_uri
+    app.config["RATELIMIT_ENABLED"] = not args.no_rate_limit
+    limiter.init_app(app)
+
     app.config["TITLE"] = args.title
-    app.run(host="0.0.0.0", port=args.port)
+    app.config["MAX_QUEUE_WAIT_SECONDS"] = args.max_queue_wait
+    if args.server == "gunicorn":
+        serve_with_gunicorn("0.0.0.0", args.port, args.workers, args.threads)
+    else:
+        app.run(host="0.0.0.0", port=args.port)
 
     database.safe_disconnect()
 
@@ -240,6 +627,78 @@ if __name__ == "__main__":
         help="Port to expose the service",
     )
 
+    # Add an argument to set how to serve
+    parser.add_argument(
+        "--server",
+        type=str,
+        choices=["flask", "gunicorn"],
+        default="flask",
+        help="flask development server, or gunicorn for production",
+    )
+
+    # Add an argument to set the number of worker processes
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of worker processes (gunicorn only)",
+    )
+
+    # Add an argument to set the number of threads per worker
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=4,
+        help="Number of threads per worker process (gunicorn only)",
+    )
+
+    # Add an argument to set where to keep rate limits
+    parser.add_argument(
+        "--limiter-storage",
+        type=str,
+        default="",
+        help="Rate limit storage URI, defaults to memory:// for flask and sqlite:///<db>.limits for gunicorn",
+    )
+
+    # Add an argument to turn off rate limiting
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Disable rate limiting, e.g. for load testing",
+    )
+
+    # Add an argument to bound how long new jobs may wait
+    parser.add_argument(
+        "--max-queue-wait",
+        type=int,
+        default=0,
+        help="Reject new jobs with 503 when the estimated queue takes longer than this many seconds, 0 to never reject",
+    )
+
+    # Add an argument to set where to keep metrics
+    parser.add_argument(
+        "--metrics-db",
+        type=str,
+        default="",
+        help="Path to the SQLite file shared with the backend for /metrics, defaults to <db>.metrics",
+    )
+
+    # Add an argument to log without blocking the caller
+    parser.add_argument(
+        "--log-queue",
+        action="store_true",
+        help="Format and write log messages on a background thread",
+    )
+
+    # Add an argument to set the log format
+    parser.add_argument(
+        "--log-format",
+        type=str,
+        choices=["text", "json"],
+        default="text",
+        help="json writes one JSON object per line, with job uuid and stage where known",
+    )
+
     args = parser.parse_args()
 
     main(args)
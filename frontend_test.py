@@ -0,0 +1,161 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+# seconds importing frontend.py may take, well above what it needs without the ML stack
+IMPORT_TIME_BUDGET_SECONDS = 1.5
+
+# none of these may be loaded by the frontend, they only belong to the backend
+FORBIDDEN_MODULES = ["numpy", "scipy", "skimage", "torch", "diffusers", "transformers"]
+
+
+def get_import_times(module: str) -> dict:
+    """
+    Imports `module` in a fresh interpreter with -X importtime.
+
+    Returns {module name: cumulative microseconds} of every module it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # import time: self [us] | cumulative | imported package
+        _, cumulative, name = line.split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+class TestFrontendImport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.import_times = get_import_times("frontend")
+
+    def test_no_ml_stack(self):
+        loaded = [
+            name
+            for name in self.import_times
+            if name.split(".")[0] in FORBIDDEN_MODULES
+        ]
+        self.assertEqual(loaded, [])
+
+    def test_import_time_budget(self):
+        seconds = self.import_times["frontend"] / 1e6
+        self.assertLess(seconds, IMPORT_TIME_BUDGET_SECONDS)
+
+
+class TestValidateJob(unittest.TestCase):
+    def setUp(self):
+        import frontend
+
+        self.frontend = frontend
+        self.job = {"apikey": "a", "prompt": "cat", "type": "img", "ref_img": "x"}
+
+    def get_error(self, **kwargs) -> str:
+        with self.frontend.app.app_context():
+            error = self.frontend.validate_job(dict(self.job, **kwargs))
+        if error is None:
+            return ""
+        response, status = error
+        self.assertEqual(status, 404)
+        return response.get_json()["msg"]
+
+    def test_base_model(self):
+        from utilities.constants import VALUE_BASE_MODEL_DEFAULT
+
+        for job_type, base_model in [
+            ("txt", VALUE_BASE_MODEL_DEFAULT),
+            ("img", VALUE_BASE_MODEL_DEFAULT),
+            ("inpaint", None),
+        ]:
+            job = dict(self.job, type=job_type, mask_img="x")
+            with self.frontend.app.app_context():
+                self.assertIsNone(self.frontend.validate_job(job))
+            self.assertEqual(job.get("base_model", None), base_model)
+
+    def test_tiles(self):
+        self.assertEqual(self.get_error(), "")
+        self.assertEqual(self.get_error(tile_size=0, tile_overlap=100), "")
+        self.assertEqual(
+            self.get_error(tile_size=512, tile_overlap=0, tile_batch_size=8), ""
+        )
+        self.assertEqual(self.get_error(tile_size=64, width=4096, height=4096), "")
+        # only tiled images are limited here
+        self.assertEqual(self.get_error(width=60000, height=60000), "")
+        for kwargs in [
+            {"tile_size": -1},
+            {"tile_size": "512"},
+            {"tile_size": 512.0},
+            {"tile_size": True},
+            {"tile_size": 1032},
+            {"tile_overlap": -64},
+            {"tile_batch_size": 0},
+            {"tile_batch_size": 9},
+            {"tile_batch_size": 10000},
+        ]:
+            self.assertRegex(self.get_error(**kwargs), "must be an integer", kwargs)
+        for tile_size in [1, 8, 56, 100]:
+            self.assertRegex(
+                self.get_error(tile_size=tile_size, tile_overlap=0),
+                "multiple of 8",
+                tile_size,
+            )
+        self.assertRegex(
+            self.get_error(tile_size=64, tile_overlap=64), "must be below"
+        )
+        for width, height in [(60000, 60000), (4104, 4096), (0, 512), ("512", 512)]:
+            self.assertRegex(
+                self.get_error(tile_size=512, width=width, height=height),
+                "at most",
+                (width, height),
+            )
+
+class TestQueueEstimates(unittest.TestCase):
+    def setUp(self):
+        import frontend
+
+        self.frontend = frontend
+        frontend.queue_cache.clear()
+        frontend.costs_cache.set("costs", {"txt|512|512|100|Default": 10.0})
+        self.queue = [
+            {"uuid": "a", "type": "txt", "status": "running"},
+            {"uuid": "b", "type": "txt", "status": "pending"},
+        ]
+
+    def tearDown(self):
+        self.frontend.queue_cache.clear()
+        self.frontend.costs_cache.clear()
+
+    def test_one_scan(self):
+        job = {"apikey": "a", "prompt": "cat", "type": "txt"}
+        with mock.patch.object(
+            self.frontend.database, "get_queue", return_value=self.queue
+        ) as get_queue, self.frontend.app.app_context():
+            self.frontend.app.config["MAX_QUEUE_WAIT_SECONDS"] = 30
+            try:
+                self.assertIsNone(self.frontend.check_queue_wait([job]))
+                self.assertEqual(self.frontend.check_queue_wait([job, job])[1], 503)
+            finally:
+                del self.frontend.app.config["MAX_QUEUE_WAIT_SECONDS"]
+            # the jobs just added go behind the running one
+            self.assertEqual(
+                self.frontend.estimate_new_jobs([job, job], ["c", "d"]),
+                [(2, 30.0), (1, 20.0)],
+            )
+            # also once the cached scan has them already
+            self.queue.insert(1, {**job, "uuid": "e", "status": "pending"})
+            self.frontend.queue_cache.clear()
+            self.assertEqual(self.frontend.estimate_new_jobs([job], ["e"]), [(1, 20.0)])
+        self.assertEqual(get_queue.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
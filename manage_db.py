@@ -8,6 +8,26 @@ from utilities.constants import APIKEY
 from utilities.constants import UUID
 from utilities.constants import USERS_TABLE_NAME
 from utilities.constants import HISTORY_TABLE_NAME
+from utilities.constants import GALLERY_TABLE_NAME
+from utilities.constants import METADATA_TABLE_NAME
+from utilities.constants import KEY_USERS_VERSION
+from utilities.constants import QUOTAS_TABLE_NAME
+from utilities.constants import KEY_QUOTA_WINDOW
+from utilities.constants import VALUE_QUOTA_WINDOW_NONE
+from utilities.constants import VALUE_QUOTA_WINDOW_DAILY
+from utilities.constants import VALUE_QUOTA_WINDOW_MONTHLY
+from utilities.constants import SUPPORTED_QUOTA_WINDOWS
+from utilities.constants import VALUE_JOB_PENDING
+from utilities.constants import COST_MODEL_TABLE_NAME
+from utilities.cost_model import get_cost_key
+from utilities.cost_model import get_cost_units
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_IS_PRIVATE
+from utilities.constants import VALUE_JOB_DONE
+from utilities.constants import VALUE_JOB_TXT2IMG
+from utilities.constants import VALUE_JOB_IMG2IMG
+from utilities.constants import VALUE_JOB_INPAINTING
 
 
 # Function to acquire a lock on the database file
@@ -28,6 +48,7 @@ USERS_TABLE_COLUMNS = [
     "username TEXT UNIQUE",
     f"{APIKEY} TEXT",
     "quota INT DEFAULT 50",
+    f"{KEY_QUOTA_WINDOW} TEXT DEFAULT '{VALUE_QUOTA_WINDOW_NONE}'",
 ]
 
 HISTORY_TABLE_COLUMNS = [
@@ -54,10 +75,196 @@ HISTORY_TABLE_COLUMNS = [
     "base_model TEXT",
     "lora_model TEXT",
     "is_private BOOLEAN DEFAULT False",
+    "inpaint_mode TEXT",
+    "tile_size INT",
+    "tile_overlap INT",
+    "tile_batch_size INT",
+    "group_id TEXT",
+    "job_hash TEXT",
+    "exec_seconds REAL",
+    "timings TEXT",
+    "peak_rss_mb REAL",
+    "peak_device_mb REAL",
 ]
 
+GALLERY_TABLE_COLUMNS = [
+    "id INTEGER PRIMARY KEY AUTOINCREMENT",
+    f"{UUID} TEXT UNIQUE",
+]
+
+QUOTAS_TABLE_COLUMNS = [
+    f"{APIKEY} TEXT PRIMARY KEY",
+    "pending INT DEFAULT 0",  # jobs in pending status
+    "window_key TEXT DEFAULT ''",  # the current quota window, see quota_window_key()
+    "window_used INT DEFAULT 0",  # jobs added within window_key
+    "tokens REAL",  # token bucket of job submissions, NULL when full
+    "tokens_at REAL",  # epoch when tokens was last updated
+]
+
+COST_MODEL_TABLE_COLUMNS = [
+    "key TEXT PRIMARY KEY",  # see utilities/cost_model.py
+    "seconds REAL",
+    "samples INT DEFAULT 0",
+]
+
+METADATA_TABLE_COLUMNS = [
+    "key TEXT PRIMARY KEY",
+    "value INTEGER DEFAULT 0",
+]
+
+
+def create_users_version_triggers(c):
+    """Bump the users version on any change of the users table, so that frontends drop their cached apikeys"""
+    c.execute(
+        f"INSERT OR IGNORE INTO {METADATA_TABLE_NAME} (key, value) VALUES (?, 0)",
+        (KEY_USERS_VERSION,),
+    )
+    for operation in ["INSERT", "UPDATE", "DELETE"]:
+        c.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {USERS_TABLE_NAME}_{operation.lower()}_version
+            AFTER {operation} ON {USERS_TABLE_NAME}
+            BEGIN
+                UPDATE {METADATA_TABLE_NAME} SET value = value + 1 WHERE key = '{KEY_USERS_VERSION}';
+            END"""
+        )
+
+
+def create_history_indexes(c):
+    """Index the history table for the keyset pagination of /get_jobs and result reuse"""
+    c.execute(
+        f"CREATE INDEX IF NOT EXISTS {HISTORY_TABLE_NAME}_{APIKEY}_created_at"
+        f" ON {HISTORY_TABLE_NAME} ({APIKEY}, created_at, {UUID})"
+    )
+    c.execute(
+        f"CREATE INDEX IF NOT EXISTS {HISTORY_TABLE_NAME}_job_hash"
+        f" ON {HISTORY_TABLE_NAME} (job_hash, {KEY_JOB_STATUS})"
+    )
+
+
+def quota_window_key(row):
+    """SQL expression of the current quota window of the user of a history row"""
+    return (
+        f"CASE (SELECT {KEY_QUOTA_WINDOW} FROM {USERS_TABLE_NAME} WHERE {APIKEY} = {row}.{APIKEY})"
+        f" WHEN '{VALUE_QUOTA_WINDOW_DAILY}' THEN strftime('%Y-%m-%d', 'now')"
+        f" WHEN '{VALUE_QUOTA_WINDOW_MONTHLY}' THEN strftime('%Y-%m', 'now')"
+        " ELSE '' END"
+    )
+
+
+def create_quota_triggers(c):
+    """Keep the per apikey counters of the quotas table in sync with the history table"""
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {QUOTAS_TABLE_NAME}_insert AFTER INSERT ON {HISTORY_TABLE_NAME}
+        BEGIN
+            INSERT OR IGNORE INTO {QUOTAS_TABLE_NAME} ({APIKEY}) VALUES (NEW.{APIKEY});
+            UPDATE {QUOTAS_TABLE_NAME} SET
+                pending = pending + (NEW.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}'),
+                window_used = CASE WHEN window_key = {quota_window_key("NEW")} THEN window_used + 1 ELSE 1 END,
+                window_key = {quota_window_key("NEW")}
+            WHERE {APIKEY} = NEW.{APIKEY};
+        END"""
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {QUOTAS_TABLE_NAME}_update
+        AFTER UPDATE OF {KEY_JOB_STATUS} ON {HISTORY_TABLE_NAME}
+        WHEN (OLD.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}') != (NEW.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}')
+        BEGIN
+            UPDATE {QUOTAS_TABLE_NAME} SET
+                pending = MAX(0, pending + (NEW.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}') - (OLD.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}'))
+            WHERE {APIKEY} = NEW.{APIKEY};
+        END"""
+    )
+    # cancelled jobs give their share of the quota back
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {QUOTAS_TABLE_NAME}_delete AFTER DELETE ON {HISTORY_TABLE_NAME}
+        WHEN OLD.{KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}'
+        BEGIN
+            UPDATE {QUOTAS_TABLE_NAME} SET
+                pending = MAX(0, pending - 1),
+                window_used = CASE WHEN window_key = {quota_window_key("OLD")} THEN MAX(0, window_used - 1) ELSE window_used END
+            WHERE {APIKEY} = OLD.{APIKEY};
+        END"""
+    )
+    # recount pending jobs, e.g. of jobs added before the triggers existed
+    c.execute(f"UPDATE {QUOTAS_TABLE_NAME} SET pending = 0")
+    c.execute(
+        f"INSERT INTO {QUOTAS_TABLE_NAME} ({APIKEY}, pending)"
+        f" SELECT {APIKEY}, COUNT(*) FROM {HISTORY_TABLE_NAME} WHERE {KEY_JOB_STATUS} = '{VALUE_JOB_PENDING}' GROUP BY {APIKEY}"
+        f" ON CONFLICT({APIKEY}) DO UPDATE SET pending = excluded.pending"
+    )
+
+
+def learn_cost_model(c):
+    """Learn the cost model from the history rows of jobs that recorded their run time"""
+    c.execute(
+        f"SELECT {KEY_JOB_TYPE}, width, height, steps, scheduler, exec_seconds FROM {HISTORY_TABLE_NAME}"
+        f" WHERE {KEY_JOB_STATUS} = '{VALUE_JOB_DONE}' AND exec_seconds IS NOT NULL"
+    )
+    totals = {}  # key -> [seconds, samples]
+    for row in c.fetchall():
+        job = {
+            key: value
+            for key, value in zip(
+                [KEY_JOB_TYPE, "width", "height", "steps", "scheduler"], row[:5]
+            )
+            if value is not None
+        }
+        samples = [(get_cost_key(job), row[5])]
+        units = get_cost_units(job)
+        if units > 0:
+            samples.append((row[0], row[5] / units))
+        for key, seconds in samples:
+            total = totals.setdefault(key, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    c.executemany(
+        f"INSERT OR REPLACE INTO {COST_MODEL_TABLE_NAME} (key, seconds, samples) VALUES (?, ?, ?)",
+        [(key, seconds / samples, samples) for key, (seconds, samples) in totals.items()],
+    )
+    print(f"Learned {len(totals)} costs from the history table.")
+
+
+def is_gallery_job(row):
+    """SQL condition for a history row (NEW, OLD or the table name) to be in the gallery"""
+    return (
+        f"{row}.{KEY_JOB_STATUS} = '{VALUE_JOB_DONE}' AND {row}.{KEY_IS_PRIVATE} = 0"
+        f" AND {row}.{KEY_JOB_TYPE} IN ('{VALUE_JOB_TXT2IMG}', '{VALUE_JOB_IMG2IMG}', '{VALUE_JOB_INPAINTING}')"
+    )
+
+
+def create_gallery_triggers(c):
+    """Keep the gallery table in sync with the history table, whoever writes to it"""
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {GALLERY_TABLE_NAME}_insert AFTER INSERT ON {HISTORY_TABLE_NAME}
+        WHEN {is_gallery_job("NEW")}
+        BEGIN
+            INSERT OR IGNORE INTO {GALLERY_TABLE_NAME} ({UUID}) VALUES (NEW.{UUID});
+        END"""
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {GALLERY_TABLE_NAME}_update
+        AFTER UPDATE OF {KEY_JOB_STATUS}, {KEY_IS_PRIVATE}, {KEY_JOB_TYPE} ON {HISTORY_TABLE_NAME}
+        BEGIN
+            DELETE FROM {GALLERY_TABLE_NAME} WHERE {UUID} = OLD.{UUID} AND IFNULL(({is_gallery_job("NEW")}), 0) = 0;
+            INSERT OR IGNORE INTO {GALLERY_TABLE_NAME} ({UUID}) SELECT NEW.{UUID} WHERE {is_gallery_job("NEW")};
+        END"""
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {GALLERY_TABLE_NAME}_delete AFTER DELETE ON {HISTORY_TABLE_NAME}
+        BEGIN
+            DELETE FROM {GALLERY_TABLE_NAME} WHERE {UUID} = OLD.{UUID};
+        END"""
+    )
+    # backfill jobs finished before the triggers existed
+    c.execute(
+        f"INSERT OR IGNORE INTO {GALLERY_TABLE_NAME} ({UUID}) SELECT {UUID} FROM {HISTORY_TABLE_NAME}"
+        f" WHERE {is_gallery_job(HISTORY_TABLE_NAME)} ORDER BY created_at"
+    )
+
 
 def create_or_update_table(c, table_name):
+    """Create the table, or add the columns it misses. Returns True if it was created"""
     c.execute(
         "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
     )
@@ -67,14 +274,23 @@ def create_or_update_table(c, table_name):
         target_columns = USERS_TABLE_COLUMNS
     elif table_name == HISTORY_TABLE_NAME:
         target_columns = HISTORY_TABLE_COLUMNS
+    elif table_name == GALLERY_TABLE_NAME:
+        target_columns = GALLERY_TABLE_COLUMNS
+    elif table_name == METADATA_TABLE_NAME:
+        target_columns = METADATA_TABLE_COLUMNS
+    elif table_name == QUOTAS_TABLE_NAME:
+        target_columns = QUOTAS_TABLE_COLUMNS
+    elif table_name == COST_MODEL_TABLE_NAME:
+        target_columns = COST_MODEL_TABLE_COLUMNS
     else:
         target_columns = []
 
     if existing_table is None:
         # Table doesn't exist, so create it
-        create_table_query = f"CREATE TABLE {table_name} {', '.join(target_columns)}"
+        create_table_query = f"CREATE TABLE {table_name} ({', '.join(target_columns)})"
         c.execute(create_table_query)
         print(f"Table '{table_name}' created successfully.")
+        return True
     else:
         # Table exists, check if any columns are missing
         c.execute(f"PRAGMA table_info({table_name})")
@@ -93,6 +309,7 @@ def create_or_update_table(c, table_name):
                 )
                 c.execute(alter_table_query)
                 print(f"Column '{column.strip()}' added to table '{table_name}'.")
+    return False
 
 
 def modify_table(c, table_name, operation, column_name=None, data_type=None):
@@ -143,14 +360,20 @@ def update_user(c, username, apikey):
         raise ValueError("username does not exist! create it first?")
 
 
-def update_quota(c, apikey, quota):
+def update_quota(c, apikey, quota, window=""):
+    """Set how many jobs the user may add per quota window, and optionally the window"""
     c.execute(f"SELECT username FROM {USERS_TABLE_NAME} WHERE {APIKEY}=?", (apikey,))
     result = c.fetchone()
-    if result is not None:
+    if result is None:
+        raise ValueError(f"{apikey} does not exist")
+    c.execute(
+        f"UPDATE {USERS_TABLE_NAME} SET quota=? WHERE {APIKEY}=?", (quota, apikey)
+    )
+    if window:
         c.execute(
-            f"UPDATE {USERS_TABLE_NAME} SET quota=? WHERE {APIKEY}=?", (quota, apikey)
+            f"UPDATE {USERS_TABLE_NAME} SET {KEY_QUOTA_WINDOW}=? WHERE {APIKEY}=?",
+            (window, apikey),
         )
-    raise ValueError(f"{apikey} does not exist")
 
 
 def update_username(c, apikey, username):
@@ -285,9 +508,19 @@ def manage(args):
         # Access the database
         c = conn.cursor()
 
-        # Create the users and history tables if they don't exist
+        # Create the users, history and all derived tables if they don't exist
         create_or_update_table(c, USERS_TABLE_NAME)
         create_or_update_table(c, HISTORY_TABLE_NAME)
+        create_or_update_table(c, GALLERY_TABLE_NAME)
+        create_or_update_table(c, METADATA_TABLE_NAME)
+        create_or_update_table(c, QUOTAS_TABLE_NAME)
+        if create_or_update_table(c, COST_MODEL_TABLE_NAME):
+            # seeded once only, the backend keeps it up to date, "learn" starts over
+            learn_cost_model(c)
+        create_history_indexes(c)
+        create_gallery_triggers(c)
+        create_quota_triggers(c)
+        create_users_version_triggers(c)
 
         # Perform the requested action
         if args.action == "create":
@@ -311,7 +544,7 @@ def manage(args):
                 elif args.table_action == "show":
                     modify_table(c, args.table_name, args.table_action)
             elif args.update_type == "quota":
-                update_quota(c, args.apikey, args.quota)
+                update_quota(c, args.apikey, args.quota, args.window)
         elif args.action == "delete":
             if args.delete_type == "user":
                 delete_user(c, args.username)
@@ -323,6 +556,8 @@ def manage(args):
             show_users(c, args.username, args.details)
         elif args.action == "vacuum":
             c.execute("vacuum")
+        elif args.action == "learn":
+            learn_cost_model(c)
 
         # Commit the changes to the database
         conn.commit()
@@ -357,6 +592,12 @@ def main():
     update_quota_parser = update_subparsers.add_parser("quota")
     update_quota_parser.add_argument("apikey")
     update_quota_parser.add_argument("quota")
+    update_quota_parser.add_argument(
+        "--window",
+        choices=SUPPORTED_QUOTA_WINDOWS,
+        default="",
+        help=f"Enforce quota per UTC day or month, never with {VALUE_QUOTA_WINDOW_NONE}",
+    )
 
     # Sub-parser for updating a table
     update_table_parser = update_subparsers.add_parser("table")
@@ -398,6 +639,9 @@ def main():
 
     vacuum_parser = subparsers.add_parser("vacuum")
 
+    # Sub-parser for relearning the cost model from scratch
+    learn_parser = subparsers.add_parser("learn")
+
     args = parser.parse_args()
 
     manage(args)
@@ -0,0 +1,171 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from manage_db import COST_MODEL_TABLE_NAME
+from manage_db import GALLERY_TABLE_NAME
+from manage_db import HISTORY_TABLE_NAME
+from manage_db import METADATA_TABLE_NAME
+from manage_db import QUOTAS_TABLE_NAME
+from manage_db import USERS_TABLE_NAME
+from manage_db import create_gallery_triggers
+from manage_db import create_history_indexes
+from manage_db import create_or_update_table
+from manage_db import create_quota_triggers
+from manage_db import create_user
+from manage_db import create_users_version_triggers
+from manage_db import delete_user
+from manage_db import update_quota
+from utilities.constants import APIKEY
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_PROMPT
+from utilities.constants import MASK_IMG
+from utilities.constants import REFERENCE_IMG
+from utilities.constants import UUID
+from utilities.constants import VALUE_JOB_DONE
+from utilities.constants import VALUE_QUOTA_WINDOW_DAILY
+from utilities.database import Database
+from utilities.database import QuotaExceededError
+from utilities.images import image_to_base64
+
+
+def create_tables(db_filepath: str):
+    """Creates the tables, indexes and triggers like manage_db.py migrates a database"""
+    with contextlib.redirect_stdout(io.StringIO()), sqlite3.connect(
+        db_filepath
+    ) as conn:
+        c = conn.cursor()
+        for table_name in [
+            USERS_TABLE_NAME,
+            HISTORY_TABLE_NAME,
+            GALLERY_TABLE_NAME,
+            METADATA_TABLE_NAME,
+            QUOTAS_TABLE_NAME,
+            COST_MODEL_TABLE_NAME,
+        ]:
+            create_or_update_table(c, table_name)
+        create_history_indexes(c)
+        create_gallery_triggers(c)
+        create_quota_triggers(c)
+        create_users_version_triggers(c)
+        create_user(c, "user", "k")
+        update_quota(c, "k", 3, VALUE_QUOTA_WINDOW_DAILY)
+    conn.close()
+
+
+class TestManageDb(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db_filepath = os.path.join(self.folder, "test.db")
+        create_tables(self.db_filepath)
+        self.database = Database()
+        self.database.connect(self.db_filepath)
+        self.job = {APIKEY: "k", KEY_PROMPT: "cat", KEY_JOB_TYPE: "txt"}
+
+    def tearDown(self):
+        self.database.safe_disconnect()
+        shutil.rmtree(self.folder)
+
+    def get_quota(self) -> tuple:
+        return (
+            self.database.get_cursor()
+            .execute(
+                f"SELECT pending, window_used, tokens FROM {QUOTAS_TABLE_NAME} WHERE {APIKEY}=?",
+                ("k",),
+            )
+            .fetchone()
+        )
+
+    def change_users(self, change):
+        with contextlib.redirect_stdout(io.StringIO()), sqlite3.connect(
+            self.db_filepath
+        ) as conn:
+            change(conn.cursor())
+        conn.close()
+
+    def test_create_or_update_table(self):
+        with contextlib.redirect_stdout(io.StringIO()), sqlite3.connect(
+            self.db_filepath
+        ) as conn:
+            # what decides whether the cost model gets seeded
+            c = conn.cursor()
+            self.assertFalse(create_or_update_table(c, COST_MODEL_TABLE_NAME))
+            c.execute(f"DROP TABLE {COST_MODEL_TABLE_NAME}")
+            self.assertTrue(create_or_update_table(c, COST_MODEL_TABLE_NAME))
+        conn.close()
+
+    def test_quota_triggers(self):
+        self.assertTrue(self.database.insert_new_job(dict(self.job), "a", 5))
+        self.assertTrue(self.database.insert_new_job(dict(self.job), "b", 5))
+        self.assertEqual(self.get_quota()[:2], (2, 2))
+
+        self.database.update_job({KEY_JOB_STATUS: VALUE_JOB_DONE}, "a")
+        self.assertEqual(self.get_quota()[:2], (1, 2))
+
+        # cancelling gives the quota back, finished jobs keep it
+        self.assertTrue(self.database.cancel_job("b"))
+        self.assertFalse(self.database.cancel_job("a"))
+        self.assertEqual(self.get_quota()[:2], (0, 1))
+        self.assertEqual(self.database.count_all_pending_jobs("k"), 0)
+
+    def test_insert_new_jobs_rollback(self):
+        self.assertTrue(self.database.insert_new_job(dict(self.job), "a", 5))
+        quota = self.get_quota()
+
+        # taken the quota, then failed on the uuid already in use
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.database.insert_new_jobs(
+                [dict(self.job), dict(self.job)], job_uuids=["c", "a"], max_pending=5
+            )
+        self.database.commit()
+        self.assertEqual(self.get_quota(), quota)
+        self.assertEqual(
+            [job[UUID] for job in self.database.get_jobs(apikey="k")], ["a"]
+        )
+
+    def test_rejected_images_not_saved(self):
+        image_folder = os.path.join(self.folder, "images")
+        os.makedirs(image_folder)
+        self.database.set_image_output_folder(image_folder)
+        job = dict(self.job, type="img")
+        job[REFERENCE_IMG] = image_to_base64(Image.new("RGB", (8, 8), (255, 0, 0)))
+        self.assertTrue(self.database.insert_new_job(dict(job), max_pending=1))
+        filenames = os.listdir(image_folder)
+        self.assertEqual(len(filenames), 1)
+        with open(os.path.join(image_folder, filenames[0]), "rb") as f:
+            saved = f.read()
+
+        job[REFERENCE_IMG] = image_to_base64(Image.new("RGB", (8, 8), (0, 0, 255)))
+        job[MASK_IMG] = image_to_base64(Image.new("RGB", (8, 8)))
+        for _ in range(3):
+            with self.assertRaisesRegex(QuotaExceededError, "too many jobs"):
+                self.database.insert_new_job(dict(job), max_pending=1)
+        self.assertEqual(os.listdir(image_folder), filenames)
+        with open(os.path.join(image_folder, filenames[0]), "rb") as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_validate_user(self):
+        self.assertEqual(self.database.validate_user("k"), "user")
+        with mock.patch("utilities.database.USERS_VERSION_CHECK_SECONDS", 3600):
+            self.assertEqual(self.database.validate_user("new"), "")
+            self.change_users(lambda c: create_user(c, "new user", "new"))
+            # unknown apikeys are cached too
+            self.assertEqual(self.database.validate_user("new"), "")
+
+        with mock.patch("utilities.database.USERS_VERSION_CHECK_SECONDS", 0):
+            # the trigger bumped the users version
+            self.assertEqual(self.database.validate_user("new"), "new user")
+            self.change_users(lambda c: delete_user(c, "user"))
+            self.assertEqual(self.database.validate_user("k"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Measures txt2img on CPU in each precision the backend supports with --cpu-precision,
+the seconds per denoising step and the peak resident memory, with the same model, seed
+and prompt for every precision.
+
+Every precision runs in a process of its own, so that neither the weights nor the peak
+memory of one carry over to the next.
+
+example:
+    python -m tools.benchmark_cpu_precision --steps 10
+    python -m tools.benchmark_cpu_precision --precisions float32 int8 --size 256
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from utilities.constants import SUPPORTED_CPU_PRECISIONS
+from utilities.constants import VALUE_BASE_MODEL_DEFAULT
+
+
+def run(args):
+    import torch
+
+    from utilities.memory import get_peak_memory
+    from utilities.memory import reset_peak_memory
+    from utilities.model import Model
+
+    model = Model(args.model, "", use_gpu=False)
+    model.set_cpu_precision(args.precision)
+    start = time.perf_counter()
+    model.load_txt2img_and_img2img_pipeline()
+    load_seconds = time.perf_counter() - start
+    pipeline = model.txt2img_pipeline
+
+    step_ends = []
+    reset_peak_memory()
+    start = time.perf_counter()
+    pipeline(
+        prompt=args.prompt,
+        width=args.size,
+        height=args.size,
+        num_inference_steps=args.steps,
+        generator=torch.Generator("cpu").manual_seed(args.seed),
+        callback=lambda step, timestep, latents: step_ends.append(time.perf_counter()),
+    )
+    total_seconds = time.perf_counter() - start
+    step_seconds = [end - begin for begin, end in zip([start] + step_ends, step_ends)]
+    print(
+        json.dumps(
+            {
+                "precision": args.precision,
+                "load_seconds": load_seconds,
+                "total_seconds": total_seconds,
+                # the first step also warms up the kernels
+                "step_seconds": statistics.median(step_seconds[1:] or step_seconds),
+                "peak_rss_bytes": get_peak_memory()[0],
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=VALUE_BASE_MODEL_DEFAULT)
+    parser.add_argument(
+        "--precisions",
+        nargs="+",
+        default=SUPPORTED_CPU_PRECISIONS,
+        choices=SUPPORTED_CPU_PRECISIONS,
+    )
+    parser.add_argument("--precision", type=str, help="Run only this one, in-process")
+    parser.add_argument("--prompt", type=str, default="a photo of a cat on a sofa")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--size", type=int, default=512, help="Width and height")
+    args = parser.parse_args()
+
+    if args.precision:
+        run(args)
+        return
+
+    results = []
+    for precision in args.precisions:
+        command = [sys.executable, "-m", "tools.benchmark_cpu_precision"]
+        command += ["--precision", precision, "--model", args.model]
+        command += ["--prompt", args.prompt, "--seed", str(args.seed)]
+        command += ["--steps", str(args.steps), "--size", str(args.size)]
+        output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{args.model}, {args.size}x{args.size}, {args.steps} steps, seed {args.seed}")
+    for result in results:
+        print(
+            f"{result['precision']:>9}: {result['step_seconds']:6.2f} s per step,"
+            f" {result['total_seconds']:7.1f} s total,"
+            f" {result['peak_rss_bytes'] / 1024 / 1024:8.0f} MB peak RSS,"
+            f" loaded in {result['load_seconds']:.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
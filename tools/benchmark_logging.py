@@ -0,0 +1,71 @@
+"""
+Measures what a log call costs the calling thread, with the handlers attached directly
+and behind the queue, for the text and the JSON lines formats.
+
+Messages go to a log file and to a terminal stand-in that discards them, optionally
+after `--slow-ms` per write to mimic a slow terminal or disk.
+
+example:
+    python -m tools.benchmark_logging --calls 20000
+    python -m tools.benchmark_logging --calls 200 --slow-ms 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from utilities.logger import Logger
+from utilities.logger import configure_logging
+from utilities.logger import set_log_context
+
+
+class SlowWriter:
+    def __init__(self, slow_seconds: float):
+        self.__slow_seconds = slow_seconds
+
+    def write(self, text: str):
+        if self.__slow_seconds:
+            time.sleep(self.__slow_seconds)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--slow-ms", type=float, default=0, help="Delay of each write")
+    args = parser.parse_args()
+
+    stderr = sys.stderr
+    # the stream handler of a Logger writes to sys.stderr as of its creation
+    sys.stderr = SlowWriter(args.slow_ms / 1000)
+    with tempfile.TemporaryDirectory() as folder:
+        logger = Logger(name="benchmark", filepath=os.path.join(folder, "benchmark.log"))
+        set_log_context(job_uuid="00000000-0000-0000-0000-000000000000", stage="denoise")
+        results = []
+        for use_queue in [False, True]:
+            for json_lines in [False, True]:
+                configure_logging(use_queue=use_queue, json_lines=json_lines)
+                start = time.perf_counter()
+                for i in range(args.calls):
+                    logger.info(f"message {i} of the benchmark")
+                elapsed = time.perf_counter() - start
+                # includes waiting for the queue to drain
+                configure_logging()
+                drained = time.perf_counter() - start
+                results.append((use_queue, json_lines, elapsed, drained))
+    sys.stderr = stderr
+
+    print(f"{args.calls} calls, {args.slow_ms} ms per write")
+    for use_queue, json_lines, elapsed, drained in results:
+        mode = f"{'queue' if use_queue else 'direct'} {'json' if json_lines else 'text'}"
+        print(
+            f"{mode:>12}: {elapsed / args.calls * 1e6:8.1f} us per call,"
+            f" {drained:.2f} s until written"
+        )
+
+
+if __name__ == "__main__":
+    main()
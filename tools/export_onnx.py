@@ -0,0 +1,46 @@
+"""
+Exports the text encoder, UNet and VAE decoder of a base model to ONNX, the UNet and
+VAE decoder once per resolution bucket, for the backend to run with ONNX Runtime on
+CPU when started with --onnx-folder pointing at the same output folder. Jobs of sizes
+no bucket was exported for still run on PyTorch.
+
+Needs torch, diffusers and onnx, the UNet alone takes a few GB of disk per bucket.
+
+example:
+    python -m tools.export_onnx --output-folder /data/onnx --buckets 512x512 512x768
+    python -m tools.export_onnx --model prompthero/openjourney --output-folder /data/onnx
+"""
+import argparse
+import torch
+from diffusers import StableDiffusionPipeline
+
+from utilities.constants import VALUE_BASE_MODEL_DEFAULT
+from utilities.onnx_pipeline import export_onnx
+from utilities.onnx_pipeline import get_onnx_folderpath
+from utilities.onnx_pipeline import parse_bucket
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=VALUE_BASE_MODEL_DEFAULT)
+    parser.add_argument("--output-folder", type=str, required=True)
+    parser.add_argument(
+        "--buckets",
+        nargs="+",
+        type=parse_bucket,
+        default=[(512, 512)],
+        help="Resolutions to export the UNet and VAE decoder for, <W>x<H>",
+    )
+    args = parser.parse_args()
+
+    # the graphs are float32 whatever the backend runs PyTorch in
+    pipeline = StableDiffusionPipeline.from_pretrained(
+        args.model, torch_dtype=torch.float32, safety_checker=None
+    )
+    folderpath = get_onnx_folderpath(args.output_folder, args.model)
+    for filepath in export_onnx(pipeline, folderpath, args.buckets):
+        print(f"exported {filepath}")
+
+
+if __name__ == "__main__":
+    main()
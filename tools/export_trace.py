@@ -0,0 +1,78 @@
+"""
+Exports the per stage timings the backend stored for recent jobs as Chrome trace JSON,
+to open in chrome://tracing or https://ui.perfetto.dev.
+
+Every job becomes one slice named by its type that contains the slices of its stages,
+e.g. encode_prompt, denoise, vae_decode and png_encode.
+
+example:
+    python -m tools.export_trace --db happysd.db --limit 200 -o trace.json
+"""
+import argparse
+import json
+import sqlite3
+
+from utilities.constants import HISTORY_TABLE_NAME
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_TIMINGS
+from utilities.constants import UUID
+from utilities.times import timings_to_trace_events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", type=str, default="happysd.db")
+    parser.add_argument("--limit", type=int, default=100, help="Number of latest jobs")
+    parser.add_argument("--output", "-o", type=str, default="trace.json")
+    args = parser.parse_args()
+
+    c = sqlite3.connect(args.db).cursor()
+    rows = c.execute(
+        f"SELECT {UUID}, {KEY_JOB_TYPE}, {KEY_JOB_STATUS}, {KEY_TIMINGS}"
+        f" FROM {HISTORY_TABLE_NAME} WHERE {KEY_TIMINGS} IS NOT NULL"
+        " ORDER BY updated_at DESC LIMIT ?",
+        (args.limit,),
+    ).fetchall()
+
+    # the backend runs one job after another, all on one track
+    events = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": 0,
+            "tid": 0,
+            "args": {"name": "backend"},
+        }
+    ]
+    for job_uuid, job_type, job_status, timings in reversed(rows):
+        try:
+            timings = json.loads(timings)
+        except ValueError:
+            continue
+        args_of_job = {UUID: job_uuid, KEY_JOB_STATUS: job_status}
+        job_events = timings_to_trace_events(timings, args=args_of_job)
+        if not job_events:
+            continue
+        start = min(event["ts"] for event in job_events)
+        stop = max(event["ts"] + event["dur"] for event in job_events)
+        events.append(
+            {
+                "name": job_type,
+                "ph": "X",
+                "ts": start,
+                "dur": stop - start,
+                "pid": 0,
+                "tid": 0,
+                "args": args_of_job,
+            }
+        )
+        events += job_events
+
+    with open(args.output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"exported {len(rows)} jobs to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
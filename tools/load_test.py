@@ -0,0 +1,75 @@
+"""
+Minimal HTTP load test to compare serving modes of frontend.py.
+
+Keeps `--concurrency` clients sending requests to `--url` for `--duration` seconds and
+reports requests per second and latency percentiles. Start the frontend with
+`--no-rate-limit` first, otherwise most requests are answered with 429.
+
+example:
+    python frontend.py --db happysd.db --no-rate-limit --server gunicorn --workers 4
+    python tools/load_test.py --url http://127.0.0.1:8888/random_jobs
+"""
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def run_client(url: str, body: bytes, deadline: float, latencies: list, statuses: dict, lock):
+    headers = {"Content-Type": "application/json"} if body else {}
+    while time.monotonic() < deadline:
+        request = urllib.request.Request(url, data=body or None, headers=headers)
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 0
+        elapsed = time.monotonic() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8888/random_jobs")
+    parser.add_argument("--data", type=str, default="", help="JSON body to POST")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(args.url, args.data.encode(), deadline, latencies, statuses, lock),
+        )
+        for _ in range(args.concurrency)
+    ]
+    start = time.monotonic()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if 200 <= status < 400)
+    print(f"requests: {len(latencies)} in {elapsed:.1f}s, statuses: {statuses}")
+    print(f"successful requests per second: {ok / elapsed:.1f}")
+    if latencies:
+        for percentile in [50, 90, 99]:
+            index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+            print(f"p{percentile} latency: {latencies[index] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
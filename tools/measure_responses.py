@@ -0,0 +1,89 @@
+"""
+Measures the bytes sent for a /get_jobs polling workload with each response encoding.
+
+Walks the first `--pages` pages of jobs of `--apikey` the way the web page does, first
+without and then with every Accept-Encoding, and finally re-polls every page with the
+ETag it got, as a client does while nothing changed.
+
+example:
+    python frontend.py --db happysd.db --no-rate-limit
+    python tools/measure_responses.py --apikey your_apikey
+"""
+import argparse
+import json
+import urllib.error
+import urllib.request
+
+
+def post(url: str, payload: dict, headers: dict) -> tuple:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json", **headers},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8888/get_jobs")
+    parser.add_argument("--apikey", type=str, required=True)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--fields", type=str, default="", help="comma separated, all if empty")
+    args = parser.parse_args()
+
+    payloads = []
+    cursor = ""
+    for _ in range(args.pages):
+        payload = {"apikey": args.apikey, "page_size": args.page_size}
+        if args.fields:
+            payload["fields"] = args.fields
+        if cursor:
+            payload["cursor"] = cursor
+        status, _, body = post(args.url, payload, {})
+        if status != 200:
+            raise SystemExit(f"{args.url} answered {status}: {body[:200]}")
+        payloads.append(payload)
+        cursor = json.loads(body)["next_cursor"]
+        if not cursor:
+            break
+
+    print(f"{len(payloads)} pages of up to {args.page_size} jobs")
+    identity_bytes = 0
+    etags = []
+    for encoding in ["identity", "gzip", "br"]:
+        total = 0
+        for payload in payloads:
+            _, headers, body = post(args.url, payload, {"Accept-Encoding": encoding})
+            if encoding == "identity":
+                etags.append(headers.get("ETag", ""))
+            elif headers.get("Content-Encoding", "identity") != encoding:
+                total = 0
+                break
+            total += len(body)
+        if encoding == "identity":
+            identity_bytes = total
+        if total:
+            saved = 100 * (1 - total / identity_bytes)
+            print(f"{encoding:>12}: {total} bytes, {saved:.1f}% saved")
+        else:
+            print(f"{encoding:>12}: not supported by the server")
+
+    total = 0
+    not_modified = 0
+    for payload, etag in zip(payloads, etags):
+        status, _, body = post(args.url, payload, {"If-None-Match": etag})
+        not_modified += status == 304
+        total += len(body)
+    print(
+        f"{'unchanged':>12}: {total} bytes, {not_modified}/{len(payloads)} answered with 304"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl_seconds` after they were set.
+
+    `hits` and `misses` count the lookups of `get` since the cache was created.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 60.0, timer=time.monotonic):
+        self.__maxsize = maxsize
+        self.__ttl_seconds = ttl_seconds
+        self.__timer = timer
+        self.__entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= self.__timer():
+                del self.__entries[key]
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__entries[key] = (self.__timer() + self.__ttl_seconds, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__maxsize:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -0,0 +1,49 @@
+import unittest
+
+from utilities.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl_seconds=10, timer=self.timer)
+
+    def test_expiry(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.timer.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.timer.now = 10
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_lru(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b", "missing"), "missing")
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_falsy_values(self):
+        self.cache.set("a", "")
+        self.assertEqual(self.cache.get("a", None), "")
+        self.cache.pop("a")
+        self.assertEqual(self.cache.get("a", None), None)
+        self.cache.set("b", 0)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
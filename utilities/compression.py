@@ -0,0 +1,67 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIN_COMPRESS_SIZE = 1024  # smaller bodies are not worth the CPU and the extra header
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def get_supported_encodings() -> list:
+    """Returns the content codings this server can produce, in order of preference"""
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def parse_accept_encoding(accept_encoding: str) -> dict:
+    """
+    Parses an Accept-Encoding header into {coding: q}, codings default to q=1.
+    """
+    result = {}
+    for item in accept_encoding.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        coding = parts[0].lower()
+        if not coding:
+            continue
+        q = 1.0
+        for parameter in parts[1:]:
+            if parameter.startswith("q="):
+                try:
+                    q = float(parameter[2:])
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Picks the best content coding accepted by the client, or "" for identity.
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    best = ""
+    best_q = 0.0
+    for coding in get_supported_encodings():
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, accept_encoding: str, min_size: int = MIN_COMPRESS_SIZE) -> tuple:
+    """
+    Compresses `body` with the best coding the client accepts.
+
+    Returns (coding, body), coding is "" when the body is returned unchanged.
+    """
+    if len(body) < min_size:
+        return "", body
+    coding = choose_encoding(accept_encoding)
+    if coding == "br":
+        return coding, brotli.compress(body, quality=BROTLI_QUALITY)
+    if coding == "gzip":
+        return coding, gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return "", body
@@ -0,0 +1,35 @@
+import gzip
+import unittest
+
+from utilities import compression
+from utilities.compression import choose_encoding
+from utilities.compression import compress
+from utilities.compression import parse_accept_encoding
+
+
+class TestCompression(unittest.TestCase):
+    def test_parse_accept_encoding(self):
+        self.assertEqual(
+            parse_accept_encoding("gzip, deflate;q=0.5, br;q=0"),
+            {"gzip": 1.0, "deflate": 0.5, "br": 0.0},
+        )
+        self.assertEqual(parse_accept_encoding(""), {})
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding(""), "")
+        self.assertEqual(choose_encoding("identity"), "")
+        self.assertEqual(choose_encoding("gzip;q=0"), "")
+        self.assertEqual(choose_encoding("br;q=0, gzip"), "gzip")
+        self.assertEqual(choose_encoding("*"), compression.get_supported_encodings()[0])
+
+    def test_compress(self):
+        body = b'{"jobs": []}' * 1000
+        coding, compressed = compress(body, "gzip")
+        self.assertEqual(coding, "gzip")
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertEqual(compress(body, ""), ("", body))
+        self.assertEqual(compress(b"{}", "gzip"), ("", b"{}"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,15 @@ from utilities.constants import KEY_STRENGTH
 from utilities.constants import VALUE_STRENGTH_DEFAULT
 from utilities.constants import KEY_SCHEDULER
 from utilities.constants import KEY_IS_PRIVATE
+from utilities.constants import KEY_INPAINT_MODE
+from utilities.constants import VALUE_INPAINT_MODE_DEFAULT
+from utilities.constants import KEY_TILE_SIZE
+from utilities.constants import VALUE_TILE_SIZE_DEFAULT
+from utilities.constants import KEY_TILE_OVERLAP
+from utilities.constants import VALUE_TILE_OVERLAP_DEFAULT
+from utilities.constants import KEY_TILE_BATCH_SIZE
+from utilities.constants import VALUE_TILE_BATCH_SIZE_DEFAULT
+from utilities.constants import KEY_LORA_MODEL
 from utilities.constants import VALUE_SCHEDULER_DEFAULT
 from utilities.constants import VALUE_SCHEDULER_DDIM
 from utilities.constants import VALUE_SCHEDULER_DPM_SOLVER_MULTISTEP
@@ -153,3 +162,65 @@ class Config:
         )
         self.__config[KEY_STRENGTH] = strength
         return self
+
+    def get_inpaint_mode(self) -> str:
+        return self.__config.get(KEY_INPAINT_MODE, VALUE_INPAINT_MODE_DEFAULT)
+
+    def set_inpaint_mode(self, mode: str):
+        if not mode:
+            mode = VALUE_INPAINT_MODE_DEFAULT
+        self.__logger.info(
+            "{} changed from {} to {}".format(
+                KEY_INPAINT_MODE, self.get_inpaint_mode(), mode
+            )
+        )
+        self.__config[KEY_INPAINT_MODE] = mode
+        return self
+
+    def get_tile_size(self) -> int:
+        return int(self.__config.get(KEY_TILE_SIZE, VALUE_TILE_SIZE_DEFAULT))
+
+    def set_tile_size(self, size: int):
+        self.__logger.info(
+            "{} changed from {} to {}".format(KEY_TILE_SIZE, self.get_tile_size(), size)
+        )
+        self.__config[KEY_TILE_SIZE] = size
+        return self
+
+    def get_tile_overlap(self) -> int:
+        return int(self.__config.get(KEY_TILE_OVERLAP, VALUE_TILE_OVERLAP_DEFAULT))
+
+    def set_tile_overlap(self, overlap: int):
+        self.__logger.info(
+            "{} changed from {} to {}".format(
+                KEY_TILE_OVERLAP, self.get_tile_overlap(), overlap
+            )
+        )
+        self.__config[KEY_TILE_OVERLAP] = overlap
+        return self
+
+    def get_tile_batch_size(self) -> int:
+        return max(
+            1, int(self.__config.get(KEY_TILE_BATCH_SIZE, VALUE_TILE_BATCH_SIZE_DEFAULT))
+        )
+
+    def set_tile_batch_size(self, batch_size: int):
+        self.__logger.info(
+            "{} changed from {} to {}".format(
+                KEY_TILE_BATCH_SIZE, self.get_tile_batch_size(), batch_size
+            )
+        )
+        self.__config[KEY_TILE_BATCH_SIZE] = batch_size
+        return self
+
+    def get_lora_model(self) -> str:
+        return self.__config.get(KEY_LORA_MODEL, "") or ""
+
+    def set_lora_model(self, lora_model: str):
+        self.__logger.info(
+            "{} changed from {} to {}".format(
+                KEY_LORA_MODEL, self.get_lora_model(), lora_model
+            )
+        )
+        self.__config[KEY_LORA_MODEL] = lora_model
+        return self
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+import weakref
+from typing import Callable
+
+
+class _ConnectionHolder:
+    # closes its connection once the thread local holding it is dropped
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.pid = os.getpid()
+
+    def close(self, commit: bool = False):
+        # connections inherited through a fork belong to the parent
+        if self.connection is None or self.pid != os.getpid():
+            return
+        try:
+            if commit:
+                self.connection.commit()
+            self.connection.close()
+        except sqlite3.Error:
+            pass
+        self.connection = None
+
+    def __del__(self):
+        self.close()
+
+
+class ThreadConnections:
+    """
+    One SQLite connection per thread and per process, opened by `connect` on first use
+    and closed as soon as its thread exits, so that servers running one thread per
+    request do not pile up connections and file descriptors.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self.__connect = connect
+        self.__local = threading.local()
+        # only weakly, the thread local keeps a holder alive as long as its thread
+        self.__holders = weakref.WeakSet()
+        self.__lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        holder = getattr(self.__local, "holder", None)
+        # a connection must neither be shared by threads nor survive a fork
+        if holder is None or holder.pid != os.getpid() or holder.connection is None:
+            holder = _ConnectionHolder(self.__connect())
+            self.__local.holder = holder
+            with self.__lock:
+                self.__holders.add(holder)
+        return holder.connection
+
+    def count(self) -> int:
+        """Returns how many connections are open"""
+        with self.__lock:
+            return sum(1 for holder in self.__holders if holder.connection is not None)
+
+    def close_all(self, commit: bool = False):
+        """Closes the connections of every thread of this process, committing first if `commit`"""
+        with self.__lock:
+            holders = list(self.__holders)
+            self.__holders = weakref.WeakSet()
+        for holder in holders:
+            holder.close(commit=commit)
+        self.__local = threading.local()
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from utilities.connections import ThreadConnections
+
+
+class TestThreadConnections(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db_filepath = os.path.join(self.folder.name, "test.db")
+        self.connections = ThreadConnections(
+            lambda: sqlite3.connect(self.db_filepath, check_same_thread=False)
+        )
+
+    def tearDown(self):
+        self.connections.close_all()
+        self.folder.cleanup()
+
+    def test_per_thread(self):
+        connection = self.connections.get()
+        self.assertIs(self.connections.get(), connection)
+        others = []
+        thread = threading.Thread(target=lambda: others.append(self.connections.get()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], connection)
+
+    def test_closed_on_thread_exit(self):
+        self.connections.get()
+        threads = [
+            threading.Thread(target=lambda: self.connections.get().execute("SELECT 1"))
+            for _ in range(50)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # only the one of the main thread is left
+        self.assertEqual(self.connections.count(), 1)
+
+    def test_close_all(self):
+        connection = self.connections.get()
+        self.connections.close_all()
+        self.assertEqual(self.connections.count(), 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+        # reopened on the next use
+        self.connections.get().execute("SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
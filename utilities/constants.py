@@ -7,6 +7,23 @@ LOGGER_NAME_TXT2IMG = VALUE_APP + "_txt2img"
 LOGGER_NAME_IMG2IMG = VALUE_APP + "_img2img"
 LOGGER_NAME_INPAINT = VALUE_APP + "_inpaint"
 MAX_JOB_NUMBER = 10
+INPAINT_MAX_PIXELS = 1024 * 1024  # upper bound of pixels per inpainting inference
+TILE_MIN_SIZE = 64  # tile sides of tiled img2img, multiples of 8 in between
+TILE_MAX_SIZE = 1024
+TILE_MAX_BATCH_SIZE = 8  # upper bound of tiles per tiled img2img inference
+TILE_MAX_PIXELS = 4096 * 4096  # upper bound of the output pixels of tiled img2img
+REFERENCE_CACHE_SIZE = 16  # entries per kind of ReferenceCache, see reference_cache.py
+RANDOM_JOBS_CACHE_SECONDS = 5  # how long the same /random_jobs sample is served
+JOB_BUCKET_CAPACITY = MAX_JOB_NUMBER  # burst of jobs an apikey may submit at once
+JOB_BUCKET_REFILL_SECONDS = 6  # one more job may be submitted every that many seconds
+DEFAULT_JOB_SECONDS = 60  # estimated run time of a job nothing is known about
+DEFAULT_MODEL_SWITCH_SECONDS = 30  # estimated time to swap the base model, until measured
+MODEL_AFFINITY_WINDOW_SECONDS = 300  # jobs for another base model wait at most that long
+COST_MODEL_ALPHA = 0.2  # weight of the newest sample in the moving average of costs
+COST_MODEL_CACHE_SECONDS = 10  # how long the frontend uses a loaded cost model
+QUEUE_CACHE_SECONDS = 2  # how long /get_jobs polls share one estimate of the queue
+DEFAULT_PAGE_SIZE = 20  # jobs per /get_jobs page
+MAX_PAGE_SIZE = 100
 
 LOCK_FILEPATH = "/tmp/happysd_db.lock"
 
@@ -18,6 +35,13 @@ VALUE_OUTPUT_FOLDER_DEFAULT = ""
 #
 HISTORY_TABLE_NAME = "history"
 USERS_TABLE_NAME = "users"
+GALLERY_TABLE_NAME = "gallery"  # done public jobs that may show up in /random_jobs
+METADATA_TABLE_NAME = "metadata"  # key-value counters maintained by triggers
+QUOTAS_TABLE_NAME = "quotas"  # per apikey counters maintained by triggers on history
+COST_MODEL_TABLE_NAME = "cost_model"  # learned seconds per job, see cost_model.py
+KEY_USERS_VERSION = "users_version"  # bumped on every change of the users table
+USERS_CACHE_SECONDS = 60  # how long an apikey lookup is cached
+USERS_VERSION_CHECK_SECONDS = 1  # how often to check KEY_USERS_VERSION for changes
 
 #
 # REST API Keys
@@ -59,6 +83,17 @@ VALUE_SCHEDULER_DDIM = "DDIMScheduler"
 KEY_STRENGTH = "strength"
 VALUE_STRENGTH_DEFAULT = 0.5  # default value for KEY_STRENGTH
 KEY_IS_PRIVATE = "is_private"
+KEY_INPAINT_MODE = "inpaint_mode"
+VALUE_INPAINT_MODE_DEFAULT = "full"  # default value for KEY_INPAINT_MODE
+VALUE_INPAINT_MODE_CROP = "crop"
+KEY_TILE_SIZE = "tile_size"
+VALUE_TILE_SIZE_DEFAULT = 0  # default value for KEY_TILE_SIZE, 0 disables tiling
+KEY_TILE_OVERLAP = "tile_overlap"
+VALUE_TILE_OVERLAP_DEFAULT = 64  # default value for KEY_TILE_OVERLAP
+KEY_TILE_BATCH_SIZE = "tile_batch_size"
+VALUE_TILE_BATCH_SIZE_DEFAULT = 1  # default value for KEY_TILE_BATCH_SIZE
+KEY_LORA_MODEL = "lora_model"  # e.g. "add_detail:0.5,film_grain", see lora.py
+KEY_BASE_MODEL = "base_model"  # one of SUPPORTED_BASE_MODELS, the default if omitted
 
 REQUIRED_KEYS = [
     APIKEY,  # str
@@ -78,6 +113,12 @@ OPTIONAL_KEYS = [
     MASK_IMG,  # str (base64 or filepath)
     KEY_LANGUAGE,  # str
     KEY_IS_PRIVATE,  # boolean
+    KEY_INPAINT_MODE,  # str
+    KEY_TILE_SIZE,  # int
+    KEY_TILE_OVERLAP,  # int
+    KEY_TILE_BATCH_SIZE,  # int
+    KEY_LORA_MODEL,  # str
+    KEY_BASE_MODEL,  # str
 ]
 
 # - output only
@@ -85,6 +126,9 @@ UUID = "uuid"
 BASE64IMAGE = "img"
 KEY_PRIORITY = "priority"
 KEY_JOB_STATUS = "status"
+KEY_GROUP_ID = "group_id"  # shared by all jobs of one /add_jobs call
+KEY_POSITION = "position"  # int, jobs to run before this one, 0 when running
+KEY_ETA = "eta_seconds"  # float, estimated seconds until this job is done
 VALUE_JOB_PENDING = "pending"  # default value for KEY_JOB_STATUS
 VALUE_JOB_RUNNING = "running"
 VALUE_JOB_DONE = "done"
@@ -95,6 +139,7 @@ OUTPUT_ONLY_KEYS = [
     KEY_PRIORITY,  # int
     BASE64IMAGE,  # str (base64)
     KEY_JOB_STATUS,  # str
+    KEY_GROUP_ID,  # str
 ]
 
 ANONYMOUS_KEYS = [
@@ -106,13 +151,106 @@ ANONYMOUS_KEYS = [
     BASE64IMAGE,
 ]
 
+# - pagination of /get_jobs
+KEY_FIELDS = "fields"  # str, comma separated keys to return
+KEY_PAGE_SIZE = "page_size"  # int
+KEY_CURSOR = "cursor"  # str, next_cursor of the previous page
+KEY_NEXT_CURSOR = "next_cursor"  # str, empty on the last page
+
+# - parameter sweeps of /add_jobs
+KEY_SWEEP = "sweep"  # dict, one of SUPPORTED_SWEEP_KEYS -> list of values
+
 # -- internal
-KEY_BASE_MODEL = "base_model"
+KEY_JOB_HASH = "job_hash"  # identical for jobs with identical outputs, see job_hash.py
+KEY_EXEC_SECONDS = "exec_seconds"  # seconds the backend spent on the job
+KEY_TIMINGS = "timings"  # JSON of the stages of the job, see SpanRecorder in times.py
+KEY_PEAK_RSS_MB = "peak_rss_mb"  # peak resident memory of the backend during the job
+KEY_PEAK_DEVICE_MB = "peak_device_mb"  # peak device memory reserved during the job
 INTERNAL_KEYS = [
-    KEY_BASE_MODEL,
+    KEY_JOB_HASH,
+    KEY_EXEC_SECONDS,
+    KEY_TIMINGS,
+    KEY_PEAK_RSS_MB,
+    KEY_PEAK_DEVICE_MB,
+]
+
+
+#
+# quota
+#
+KEY_QUOTA_WINDOW = "quota_window"  # column of the users table
+VALUE_QUOTA_WINDOW_NONE = "none"  # users.quota is not enforced
+VALUE_QUOTA_WINDOW_DAILY = "daily"  # users.quota jobs per UTC day
+VALUE_QUOTA_WINDOW_MONTHLY = "monthly"  # users.quota jobs per UTC month
+SUPPORTED_QUOTA_WINDOWS = [
+    VALUE_QUOTA_WINDOW_NONE,
+    VALUE_QUOTA_WINDOW_DAILY,
+    VALUE_QUOTA_WINDOW_MONTHLY,
+]
+
+
+#
+# sweep
+#
+SUPPORTED_SWEEP_KEYS = [
+    KEY_SEED,
+    KEY_STEPS,
+    KEY_GUIDANCE_SCALE,
+    KEY_SCHEDULER,
+]
+
+
+#
+# inpainting
+#
+SUPPORTED_INPAINT_MODES = [
+    VALUE_INPAINT_MODE_DEFAULT,
+    VALUE_INPAINT_MODE_CROP,
+]
+
+
+#
+# base model
+#
+VALUE_BASE_MODEL_DEFAULT = "SG161222/Realistic_Vision_V2.0"  # loaded at start
+SUPPORTED_BASE_MODELS = [
+    VALUE_BASE_MODEL_DEFAULT,
+    "runwayml/stable-diffusion-v1-5",
+    "CompVis/stable-diffusion-v1-4",
+    "stabilityai/stable-diffusion-2-1",
+    "darkstorm2150/Protogen_x3.4_Official_Release",
+    "darkstorm2150/Protogen_x5.8_Official_Release",
+    "prompthero/openjourney",
+    "naclbit/trinart_stable_diffusion_v2",
+    "hakurei/waifu-diffusion",
+]
+KEY_MODEL_SWITCH = "model_switch"  # cost model key of loading another base model
+
+
+#
+# cpu precision
+#
+VALUE_CPU_PRECISION_FLOAT64 = "float64"  # default, what the backend always ran on CPU
+VALUE_CPU_PRECISION_FLOAT32 = "float32"
+VALUE_CPU_PRECISION_BFLOAT16 = "bfloat16"
+VALUE_CPU_PRECISION_INT8 = "int8"  # float32 with Linear layers dynamically quantized
+SUPPORTED_CPU_PRECISIONS = [
+    VALUE_CPU_PRECISION_FLOAT64,
+    VALUE_CPU_PRECISION_FLOAT32,
+    VALUE_CPU_PRECISION_BFLOAT16,
+    VALUE_CPU_PRECISION_INT8,
 ]
 
 
+#
+# lora
+#
+MAX_LORA_ADAPTERS = 4  # adapters per job
+MAX_LORA_WEIGHT = 2.0  # upper bound of the absolute weight of an adapter
+LORA_CACHE_SIZE = 4  # adapter sets whose fused weights are kept per backend
+LORA_AFFINITY_MAX_JOBS = 8  # jobs in a row preferred for sharing the adapters in use
+
+
 #
 # language
 #
@@ -0,0 +1,151 @@
+import datetime
+
+from utilities.config import Config
+from utilities.constants import DEFAULT_JOB_SECONDS
+from utilities.constants import DEFAULT_MODEL_SWITCH_SECONDS
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_MODEL_SWITCH
+from utilities.constants import UUID
+from utilities.constants import VALUE_JOB_RUNNING
+
+
+def get_cost_key(job: dict) -> str:
+    """
+    Gets the cost model key of `job`, type|width|height|steps|scheduler with the
+    defaults of Config for omitted values.
+    """
+    config = Config().set_config(job)
+    try:
+        return "|".join(
+            [
+                job.get(KEY_JOB_TYPE, ""),
+                str(config.get_width()),
+                str(config.get_height()),
+                str(config.get_steps()),
+                config.get_scheduler(),
+            ]
+        )
+    except (TypeError, ValueError):
+        return job.get(KEY_JOB_TYPE, "")
+
+
+def get_cost_units(job: dict) -> float:
+    """
+    Gets the amount of work of `job` in megapixel-steps, the unit of the per type rates
+    used for keys that were never seen.
+    """
+    config = Config().set_config(job)
+    try:
+        return config.get_width() * config.get_height() * config.get_steps() / 1e6
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def estimate_seconds(job: dict, costs: dict) -> float:
+    """
+    Estimates the seconds `job` takes to run from `costs`, the cost model table as
+    {key: seconds}, which holds both exact keys and per type rates.
+    """
+    key = get_cost_key(job)
+    if key in costs:
+        return costs[key]
+    job_type = job.get(KEY_JOB_TYPE, "")
+    units = get_cost_units(job)
+    if job_type in costs and units > 0:
+        return costs[job_type] * units
+    return DEFAULT_JOB_SECONDS
+
+
+def get_model_switch_keys(model_name: str) -> list:
+    """Gets the cost model keys of switching to `model_name`, exact and for any model"""
+    return [f"{KEY_MODEL_SWITCH}|{model_name}", KEY_MODEL_SWITCH]
+
+
+def estimate_model_switch_seconds(model_name: str, costs: dict) -> float:
+    """
+    Estimates the seconds it takes to unload the current base model and load
+    `model_name` instead from `costs`.
+    """
+    for key in get_model_switch_keys(model_name):
+        if key in costs:
+            return costs[key]
+    return DEFAULT_MODEL_SWITCH_SECONDS
+
+
+def order_queue(queue: list) -> list:
+    """
+    Orders the pending jobs of `queue` the way the backend picks them, see
+    Database.get_one_pending_job(): those the loaded model can run first, then the
+    jobs of the model most pending jobs ask for, and so on. `queue` lists the running
+    jobs first and then the pending jobs newest first, as Database.get_queue() does.
+    The loaded model is the one of the last running job asking for one.
+
+    The fairness window of the backend is left out, it only moves jobs that waited
+    long, not the number of switches.
+    """
+    ordered = []
+    pending = []
+    for job in queue:
+        if job.get(KEY_JOB_STATUS, "") == VALUE_JOB_RUNNING:
+            ordered.append(job)
+        else:
+            pending.append(job)
+    loaded_model = ""
+    for job in ordered:
+        loaded_model = job.get(KEY_BASE_MODEL, "") or loaded_model
+    while pending:
+        runnable = []
+        remaining = []
+        for job in pending:
+            if job.get(KEY_BASE_MODEL, "") in ["", loaded_model]:
+                runnable.append(job)
+            else:
+                remaining.append(job)
+        ordered += runnable
+        pending = remaining
+        counts = {}  # model -> (pending jobs, index of its oldest job)
+        for index, job in enumerate(pending):
+            count, _ = counts.get(job[KEY_BASE_MODEL], (0, 0))
+            counts[job[KEY_BASE_MODEL]] = (count + 1, index)
+        if counts:
+            # ties go to the model of the oldest job, listed last
+            loaded_model = max(counts, key=lambda model_name: counts[model_name])
+    return ordered
+
+
+def estimate_queue(queue: list, costs: dict, now: datetime.datetime = None) -> tuple:
+    """
+    Estimates when each job of `queue` finishes. `queue` lists the running jobs first and
+    then the pending jobs newest first, each with the updated_at of its row, and is run
+    in the order of order_queue(). Jobs requesting another base model than the one
+    before them also wait for the model to be switched.
+
+    Returns ({uuid: (position, eta_seconds)}, total_seconds), position 0 is running.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    estimates = {}
+    total_seconds = 0.0
+    position = 0
+    base_model = None  # unknown until a job requests one
+    for job in order_queue(queue):
+        seconds = estimate_seconds(job, costs)
+        requested_model = job.get(KEY_BASE_MODEL, "")
+        if requested_model:
+            if base_model is not None and requested_model != base_model:
+                seconds += estimate_model_switch_seconds(requested_model, costs)
+            base_model = requested_model
+        if job.get(KEY_JOB_STATUS, "") == VALUE_JOB_RUNNING:
+            # running since its status was updated
+            try:
+                started_at = datetime.datetime.fromisoformat(str(job["updated_at"]))
+                seconds = max(0.0, seconds - (now - started_at).total_seconds())
+            except (KeyError, ValueError):
+                pass
+        else:
+            position += 1
+        total_seconds += seconds
+        estimates[job[UUID]] = (position, round(total_seconds, 1))
+    return estimates, total_seconds
@@ -0,0 +1,107 @@
+import datetime
+import unittest
+
+from utilities.constants import DEFAULT_JOB_SECONDS
+from utilities.constants import DEFAULT_MODEL_SWITCH_SECONDS
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_STEPS
+from utilities.constants import KEY_WIDTH
+from utilities.constants import UUID
+from utilities.cost_model import estimate_model_switch_seconds
+from utilities.cost_model import estimate_queue
+from utilities.cost_model import estimate_seconds
+from utilities.cost_model import get_cost_key
+
+
+class TestCostModel(unittest.TestCase):
+    def test_get_cost_key(self):
+        self.assertEqual(get_cost_key({KEY_JOB_TYPE: "txt"}), "txt|512|512|100|Default")
+        self.assertEqual(
+            get_cost_key({KEY_JOB_TYPE: "txt", KEY_WIDTH: "768", KEY_STEPS: 20}),
+            "txt|768|512|20|Default",
+        )
+
+    def test_estimate_seconds(self):
+        job = {KEY_JOB_TYPE: "txt", KEY_STEPS: 20}
+        self.assertEqual(estimate_seconds(job, {}), DEFAULT_JOB_SECONDS)
+        # 512 * 512 * 20 / 1e6 megapixel-steps at 2 seconds each
+        self.assertAlmostEqual(estimate_seconds(job, {"txt": 2.0}), 10.48576)
+        self.assertEqual(
+            estimate_seconds(job, {"txt": 2.0, "txt|512|512|20|Default": 7.0}), 7.0
+        )
+
+    def test_estimate_queue(self):
+        now = datetime.datetime(2023, 1, 1, 0, 0, 30)
+        queue = [
+            {
+                UUID: "a",
+                KEY_JOB_TYPE: "txt",
+                KEY_JOB_STATUS: "running",
+                "updated_at": "2023-01-01 00:00:00",
+            },
+            {UUID: "b", KEY_JOB_TYPE: "txt", KEY_JOB_STATUS: "pending"},
+            {UUID: "c", KEY_JOB_TYPE: "img", KEY_JOB_STATUS: "pending"},
+        ]
+        costs = {"txt|512|512|100|Default": 40.0}
+        estimates, total = estimate_queue(queue, costs, now=now)
+        self.assertEqual(estimates["a"], (0, 10.0))
+        self.assertEqual(estimates["b"], (1, 50.0))
+        self.assertEqual(estimates["c"], (2, 50.0 + DEFAULT_JOB_SECONDS))
+        self.assertEqual(total, 50.0 + DEFAULT_JOB_SECONDS)
+
+    def test_estimate_model_switch(self):
+        self.assertEqual(
+            estimate_model_switch_seconds("a", {}), DEFAULT_MODEL_SWITCH_SECONDS
+        )
+        costs = {"model_switch": 20.0, "model_switch|a": 10.0}
+        self.assertEqual(estimate_model_switch_seconds("a", costs), 10.0)
+        self.assertEqual(estimate_model_switch_seconds("b", costs), 20.0)
+
+    def test_estimate_queue_model_switch(self):
+        queue = [
+            {UUID: "a", KEY_JOB_TYPE: "txt", KEY_BASE_MODEL: "x"},
+            {UUID: "b", KEY_JOB_TYPE: "txt"},
+            {UUID: "c", KEY_JOB_TYPE: "txt", KEY_BASE_MODEL: "x"},
+            {UUID: "d", KEY_JOB_TYPE: "txt", KEY_BASE_MODEL: "y"},
+        ]
+        costs = {"txt|512|512|100|Default": 10.0, "model_switch": 5.0}
+        estimates, total = estimate_queue(queue, costs)
+        self.assertEqual(estimates["c"], (3, 30.0))
+        self.assertEqual(estimates["d"], (4, 45.0))
+        self.assertEqual(total, 45.0)
+
+    def test_estimate_queue_interleaved_models(self):
+        now = datetime.datetime(2023, 1, 1, 0, 0, 0)
+        queue = [
+            {
+                UUID: "a",
+                KEY_JOB_TYPE: "txt",
+                KEY_JOB_STATUS: "running",
+                KEY_BASE_MODEL: "x",
+                "updated_at": "2023-01-01 00:00:00",
+            }
+        ]
+        # newest first, the way get_queue() lists them
+        for job_uuid, base_model in [("e", "y"), ("d", "x"), ("c", "y"), ("b", "x")]:
+            queue.append(
+                {
+                    UUID: job_uuid,
+                    KEY_JOB_TYPE: "txt",
+                    KEY_JOB_STATUS: "pending",
+                    KEY_BASE_MODEL: base_model,
+                }
+            )
+        costs = {"txt|512|512|100|Default": 10.0, "model_switch": 5.0}
+        estimates, total = estimate_queue(queue, costs, now=now)
+        # the jobs of the loaded model go first, then one switch for the rest
+        self.assertEqual(estimates["d"], (1, 20.0))
+        self.assertEqual(estimates["b"], (2, 30.0))
+        self.assertEqual(estimates["e"], (3, 45.0))
+        self.assertEqual(estimates["c"], (4, 55.0))
+        self.assertEqual(total, 55.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
 import os
+import base64
+import binascii
 import datetime
+import hashlib
+import json
+import math
+import random
 import sqlite3
 import fcntl
+import time
 import uuid
 
 from utilities.constants import APIKEY
@@ -14,7 +21,20 @@ from utilities.constants import VALUE_JOB_IMG2IMG
 from utilities.constants import VALUE_JOB_INPAINTING
 from utilities.constants import VALUE_JOB_RESTORATION
 from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_GROUP_ID
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_JOB_HASH
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import KEY_SEED
+from utilities.constants import KEY_WIDTH
+from utilities.constants import KEY_HEIGHT
+from utilities.constants import KEY_STEPS
+from utilities.constants import KEY_SCHEDULER
+from utilities.constants import KEY_EXEC_SECONDS
+from utilities.constants import COST_MODEL_TABLE_NAME
+from utilities.constants import COST_MODEL_ALPHA
 from utilities.constants import VALUE_JOB_PENDING
+from utilities.constants import VALUE_JOB_RUNNING
 from utilities.constants import VALUE_JOB_DONE
 from utilities.constants import LOCK_FILEPATH
 
@@ -30,11 +50,69 @@ from utilities.constants import BASE64IMAGE
 
 from utilities.constants import HISTORY_TABLE_NAME
 from utilities.constants import USERS_TABLE_NAME
+from utilities.constants import GALLERY_TABLE_NAME
+from utilities.constants import METADATA_TABLE_NAME
+from utilities.constants import KEY_USERS_VERSION
+from utilities.constants import QUOTAS_TABLE_NAME
+from utilities.constants import KEY_QUOTA_WINDOW
+from utilities.constants import VALUE_QUOTA_WINDOW_DAILY
+from utilities.constants import VALUE_QUOTA_WINDOW_MONTHLY
+from utilities.constants import JOB_BUCKET_CAPACITY
+from utilities.constants import JOB_BUCKET_REFILL_SECONDS
+from utilities.constants import USERS_CACHE_SECONDS
+from utilities.constants import USERS_VERSION_CHECK_SECONDS
+from utilities.cache import TTLCache
+from utilities.connections import ThreadConnections
 from utilities.logger import DummyLogger
 
 from utilities.times import get_epoch_now
 from utilities.times import epoch_to_string
+from utilities.images import load_image
 from utilities.images import save_image
+from utilities.job_hash import get_job_hash
+from utilities.cost_model import get_cost_key
+from utilities.cost_model import get_cost_units
+from utilities.cost_model import get_model_switch_keys
+
+
+def encode_cursor(cursor: tuple) -> str:
+    """Encodes a (created_at, uuid) pagination cursor into an opaque string"""
+    if not cursor:
+        return ""
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode()
+
+
+def decode_cursor(text: str) -> tuple:
+    """Decodes a string from encode_cursor, raises ValueError if it is malformed"""
+    if not text:
+        return ()
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(text.encode()))
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError(f"invalid cursor {text}")
+    if (
+        not isinstance(cursor, list)
+        or len(cursor) != 2
+        or not all(isinstance(value, str) for value in cursor)
+    ):
+        raise ValueError(f"invalid cursor {text}")
+    return tuple(cursor)
+
+
+class QuotaExceededError(Exception):
+    """Raised when adding jobs would exceed the limits of an apikey"""
+
+
+def get_quota_window_key(window: str) -> str:
+    """
+    Gets the key of the current UTC quota window, matching quota_window_key() of
+    manage_db.py, or "" if quota is not enforced.
+    """
+    if window == VALUE_QUOTA_WINDOW_DAILY:
+        return time.strftime("%Y-%m-%d", time.gmtime())
+    if window == VALUE_QUOTA_WINDOW_MONTHLY:
+        return time.strftime("%Y-%m", time.gmtime())
+    return ""
 
 
 # Function to acquire a lock on the database file
@@ -51,15 +129,26 @@ def release_lock():
 
 
 class Database:
-    """This class represents a SQLite database and assumes single-thread usage."""
+    """
+    This class represents a SQLite database.
+
+    It is safe to share between threads and forked worker processes: every thread of
+    every process lazily opens its own connection to the same database file.
+    """
 
     def __init__(self, logger: DummyLogger = DummyLogger(), image_folderpath=""):
         """Initialize the class with a logger instance, but without a database connection or cursor."""
-        self.__connect = None  # the database connection object
+        self.__db_filepath = ""
         self.is_connected = False
-        self.__cursor = None  # the cursor object for executing SQL statements
+        # per-thread connections, closed when their thread exits
+        self.__connections = ThreadConnections(self.__connect)
         self.__logger = logger  # the logger object for logging messages
 
+        # apikey -> username, "" for unknown apikeys
+        self.__users_cache = TTLCache(maxsize=1024, ttl_seconds=USERS_CACHE_SECONDS)
+        self.__users_version = None
+        self.__users_version_checked_at = 0.0
+
         self.__image_output_folder = ""
         self.set_image_output_folder(image_folderpath)
 
@@ -75,43 +164,181 @@ class Database:
     def connect(self, db_filepath) -> bool:
         """
         Connect to the SQLite database file specified by `db_filepath`.
+        The actual connection is opened by each thread on first use.
 
         Returns True if the connection was successful, otherwise False.
         """
         if not os.path.isfile(db_filepath):
             self.__logger.error(f"{db_filepath} does not exist!")
             return False
-        self.__connect = sqlite3.connect(db_filepath, check_same_thread=False)
+        self.__db_filepath = db_filepath
         self.__logger.info(f"Connected to database {db_filepath}")
         self.is_connected = True
         return True
 
-    def get_cursor(self):
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.__db_filepath, check_same_thread=False)
+        # readers do not block the writer and vice versa
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def __get_connection(self) -> sqlite3.Connection:
         if not self.is_connected:
             raise RuntimeError("Did you forget to connect() to the database?")
-        return self.__connect.cursor()
+        return self.__connections.get()
+
+    def count_connections(self) -> int:
+        """Returns how many connections the threads of this process hold open"""
+        return self.__connections.count()
+
+    def get_cursor(self):
+        return self.__get_connection().cursor()
 
     def commit(self):
-        if not self.is_connected:
-            raise RuntimeError("Did you forget to connect() to the database?")
-        return self.__connect.commit()
+        return self.__get_connection().commit()
+
+    def __drop_users_cache_if_changed(self):
+        """
+        Drops cached apikeys once the users version in the database moved, checking it at
+        most every USERS_VERSION_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self.__users_version_checked_at < USERS_VERSION_CHECK_SECONDS:
+            return
+        self.__users_version_checked_at = now
+
+        try:
+            result = (
+                self.get_cursor()
+                .execute(
+                    f"SELECT value FROM {METADATA_TABLE_NAME} WHERE key=?",
+                    (KEY_USERS_VERSION,),
+                )
+                .fetchone()
+            )
+        except sqlite3.OperationalError:
+            # not migrated by manage_db.py yet, entries only expire with their TTL
+            result = None
+        version = None if result is None else result[0]
+        if version != self.__users_version:
+            self.__users_cache.clear()
+            self.__users_version = version
 
     def validate_user(self, apikey: str) -> str:
         """
         Validate if the provided API key exists in the users table and return the corresponding
         username if found, or an empty string otherwise.
+
+        Results, including unknown API keys, are cached until the users table changes.
         """
+        self.__drop_users_cache_if_changed()
+        username = self.__users_cache.get(apikey, None)
+        if username is not None:
+            return username
+
         query = f"SELECT username FROM {USERS_TABLE_NAME} WHERE {APIKEY}=?"
 
         c = self.get_cursor()
         result = c.execute(query, (apikey,)).fetchone()
 
-        if result is not None:
-            return result[0]
-        return ""
+        username = "" if result is None else result[0]
+        self.__users_cache.set(apikey, username)
+        return username
 
-    def get_one_pending_job(self, apikey: str = "") -> list:
-        return self.get_jobs(apikey=apikey, job_status=VALUE_JOB_PENDING, limit_count=1)
+    def get_one_pending_job(
+        self,
+        apikey: str = "",
+        group_id: str = "",
+        lora_model: str = None,
+        base_model: str = None,
+        fairness_seconds: float = 0,
+    ) -> list:
+        """
+        Get the next pending job, preferring one of `group_id` if provided so that jobs
+        submitted together by /add_jobs run back to back, then one with the adapters
+        `lora_model` if provided ("" for none) so that the backend switches adapters
+        less often.
+
+        With `base_model`, the model the backend has loaded, only jobs that can run on it
+        are considered, so that models are switched only once no such job is left, and
+        then to the model most pending jobs ask for. Jobs asking for another model that
+        waited more than `fairness_seconds` go first though, if provided.
+        """
+        if base_model is None:
+            return self.__get_one_pending_job(apikey, group_id, lora_model)
+
+        if fairness_seconds:
+            created_before = datetime.datetime.now() - datetime.timedelta(
+                seconds=fairness_seconds
+            )
+            columns = self.__get_job_columns([])
+            query = (
+                f"SELECT {', '.join(columns)} FROM {HISTORY_TABLE_NAME}"
+                f" WHERE {KEY_JOB_STATUS} = ? AND COALESCE({KEY_BASE_MODEL}, '') NOT IN ('', ?)"
+                f" AND created_at < ?"
+            )
+            values = [VALUE_JOB_PENDING, base_model, created_before]
+            if apikey:
+                query += f" AND {APIKEY} = ?"
+                values.append(apikey)
+            query += f" ORDER BY created_at, {UUID} LIMIT 1"
+            row = self.get_cursor().execute(query, tuple(values)).fetchone()
+            if row is not None:
+                return [
+                    {columns[i]: row[i] for i in range(len(columns)) if row[i] is not None}
+                ]
+
+        jobs = self.__get_one_pending_job(
+            apikey, group_id, lora_model, base_models=["", base_model]
+        )
+        if jobs:
+            return jobs
+
+        query = (
+            f"SELECT {KEY_BASE_MODEL} FROM {HISTORY_TABLE_NAME}"
+            f" WHERE {KEY_JOB_STATUS} = ? AND COALESCE({KEY_BASE_MODEL}, '') != ''"
+        )
+        values = [VALUE_JOB_PENDING]
+        if apikey:
+            query += f" AND {APIKEY} = ?"
+            values.append(apikey)
+        query += f" GROUP BY {KEY_BASE_MODEL} ORDER BY COUNT(*) DESC, MIN(created_at)"
+        row = self.get_cursor().execute(query + " LIMIT 1", tuple(values)).fetchone()
+        if row is None:
+            return []
+        return self.__get_one_pending_job(
+            apikey, group_id, lora_model, base_models=[row[0]]
+        )
+
+    def __get_one_pending_job(
+        self, apikey: str, group_id: str, lora_model: str, base_models: list = []
+    ) -> list:
+        if group_id:
+            jobs = self.get_jobs(
+                apikey=apikey,
+                job_status=VALUE_JOB_PENDING,
+                group_id=group_id,
+                base_models=base_models,
+                limit_count=1,
+            )
+            if jobs:
+                return jobs
+        if lora_model is not None:
+            jobs = self.get_jobs(
+                apikey=apikey,
+                job_status=VALUE_JOB_PENDING,
+                lora_model=lora_model,
+                base_models=base_models,
+                limit_count=1,
+            )
+            if jobs:
+                return jobs
+        return self.get_jobs(
+            apikey=apikey,
+            job_status=VALUE_JOB_PENDING,
+            base_models=base_models,
+            limit_count=1,
+        )
 
     def count_all_pending_jobs(self, apikey: str) -> int:
         """
@@ -119,16 +346,130 @@ class Database:
 
         Returns the number of pending jobs found.
         """
+        c = self.get_cursor()
+        try:
+            # maintained by triggers of manage_db.py
+            result = c.execute(
+                f"SELECT pending FROM {QUOTAS_TABLE_NAME} WHERE {APIKEY}=?", (apikey,)
+            ).fetchone()
+            return 0 if result is None else result[0]
+        except sqlite3.OperationalError:
+            pass
+
         # Construct the SQL query string and list of arguments
         query_string = f"SELECT COUNT(*) FROM {HISTORY_TABLE_NAME} WHERE {APIKEY}=? AND {KEY_JOB_STATUS}=?"
         query_args = (apikey, VALUE_JOB_PENDING)
 
         # Execute the query and return the count
-        c = self.get_cursor()
         result = c.execute(query_string, query_args).fetchone()
         return result[0]
 
+    def __take_quota(self, c, apikey: str, job_count: int, max_pending: int):
+        """
+        Checks the pending jobs, the quota window and the token bucket of `apikey` for
+        `job_count` more jobs, and takes that many tokens. Must run under the lock.
+
+        Raises QuotaExceededError if any of them is exceeded.
+        """
+        try:
+            row = c.execute(
+                f"SELECT q.pending, q.window_key, q.window_used, q.tokens, q.tokens_at, u.quota, u.{KEY_QUOTA_WINDOW}"
+                f" FROM {USERS_TABLE_NAME} u LEFT JOIN {QUOTAS_TABLE_NAME} q ON q.{APIKEY} = u.{APIKEY}"
+                f" WHERE u.{APIKEY}=?",
+                (apikey,),
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # not migrated by manage_db.py yet
+            if self.count_all_pending_jobs(apikey) + job_count > max_pending:
+                raise QuotaExceededError(
+                    "too many jobs in queue, please wait or cancel some"
+                )
+            return
+        if row is None:
+            return
+        pending, window_key, window_used, tokens, tokens_at, quota, window = row
+
+        if (pending or 0) + job_count > max_pending:
+            raise QuotaExceededError("too many jobs in queue, please wait or cancel some")
+
+        current_window_key = get_quota_window_key(window)
+        if current_window_key:
+            used = window_used if window_key == current_window_key else 0
+            if used + job_count > int(quota or 0):
+                raise QuotaExceededError(f"{window} quota of {quota} jobs is used up")
+
+        now = time.time()
+        if tokens is None:
+            tokens = JOB_BUCKET_CAPACITY
+        else:
+            tokens = min(
+                JOB_BUCKET_CAPACITY, tokens + (now - tokens_at) / JOB_BUCKET_REFILL_SECONDS
+            )
+        if tokens < job_count:
+            wait_seconds = math.ceil((job_count - tokens) * JOB_BUCKET_REFILL_SECONDS)
+            raise QuotaExceededError(
+                f"adding jobs too fast, please retry in {wait_seconds} seconds"
+            )
+        c.execute(
+            f"INSERT OR IGNORE INTO {QUOTAS_TABLE_NAME} ({APIKEY}) VALUES (?)", (apikey,)
+        )
+        c.execute(
+            f"UPDATE {QUOTAS_TABLE_NAME} SET tokens=?, tokens_at=? WHERE {APIKEY}=?",
+            (tokens - job_count, now, apikey),
+        )
+
+    def __sample_gallery_uuids(self, limit_count: int) -> list:
+        """
+        Samples up to `limit_count` uuids from the gallery table with one index lookup
+        each, so the cost does not depend on the size of the history.
+        """
+        c = self.get_cursor()
+        min_id, max_id = c.execute(
+            f"SELECT MIN(id), MAX(id) FROM {GALLERY_TABLE_NAME}"
+        ).fetchone()
+        if min_id is None:
+            return []
+        if max_id - min_id + 1 <= 2 * limit_count:
+            rows = c.execute(f"SELECT {UUID} FROM {GALLERY_TABLE_NAME}").fetchall()
+            return [row[0] for row in random.sample(rows, min(limit_count, len(rows)))]
+
+        uuids = set()
+        # ids have gaps after deletions, so allow for some misses
+        for _ in range(3 * limit_count):
+            row = c.execute(
+                f"SELECT {UUID} FROM {GALLERY_TABLE_NAME} WHERE id >= ? ORDER BY id LIMIT 1",
+                (random.randint(min_id, max_id),),
+            ).fetchone()
+            uuids.add(row[0])
+            if len(uuids) >= limit_count:
+                break
+        return list(uuids)
+
     def get_random_jobs(self, limit_count=0) -> list:
+        try:
+            job_uuids = self.__sample_gallery_uuids(limit_count)
+        except sqlite3.OperationalError as e:
+            self.__logger.warn(f"{e}, run manage_db.py to create it, falling back to a scan")
+            return self.__get_random_jobs_by_scan(limit_count)
+
+        query = f"SELECT {', '.join(ANONYMOUS_KEYS)} FROM {HISTORY_TABLE_NAME} WHERE {UUID} IN ({', '.join(['?' for _ in job_uuids])}) ORDER BY created_at DESC"
+
+        # execute the query and return the results
+        c = self.get_cursor()
+        rows = c.execute(query, tuple(job_uuids)).fetchall()
+
+        jobs = []
+        for row in rows:
+            job = {
+                ANONYMOUS_KEYS[i]: row[i]
+                for i in range(len(ANONYMOUS_KEYS))
+                if row[i] is not None
+            }
+            jobs.append(job)
+
+        return jobs
+
+    def __get_random_jobs_by_scan(self, limit_count=0) -> list:
         query = f"SELECT {', '.join(ANONYMOUS_KEYS)} FROM {HISTORY_TABLE_NAME} WHERE rowid IN (SELECT rowid FROM {HISTORY_TABLE_NAME} WHERE {KEY_JOB_STATUS} = ? AND {KEY_IS_PRIVATE} = ? AND {KEY_JOB_TYPE} IN (?, ?, ?) ORDER BY RANDOM() LIMIT ?) ORDER BY created_at DESC"
 
         # execute the query and return the results
@@ -156,16 +497,25 @@ class Database:
 
         return jobs
 
-    def get_jobs(
-        self, job_uuid="", apikey="", job_status="", job_types=[], limit_count=0
-    ) -> list:
-        """
-        Get a list of jobs from the HISTORY_TABLE_NAME table based on optional filters.
-
-        If `job_uuid` or `apikey` or `job_status` or `job_type` is provided, the query will include that filter.
+    def __get_job_columns(self, fields: list) -> list:
+        columns = OUTPUT_ONLY_KEYS + REQUIRED_KEYS + OPTIONAL_KEYS
+        if fields:
+            columns = [column for column in columns if column in fields]
+        return columns
 
-        Returns a list of jobs matching the filters provided.
-        """
+    def __query_jobs(
+        self,
+        columns: list,
+        job_uuid="",
+        apikey="",
+        job_status="",
+        job_types=[],
+        group_id="",
+        limit_count=0,
+        cursor=(),
+        lora_model=None,
+        base_models=[],
+    ) -> list:
         # construct the SQL query string and list of arguments based on the provided filters
         values = []
         query_filters = []
@@ -183,18 +533,68 @@ class Database:
                 f"{KEY_JOB_TYPE} IN ({', '.join(['?' for _ in job_types])})"
             )
             values += job_types
+        if group_id:
+            query_filters.append(f"{KEY_GROUP_ID} = ?")
+            values.append(group_id)
+        if lora_model is not None:
+            query_filters.append(f"COALESCE({KEY_LORA_MODEL}, '') = ?")
+            values.append(lora_model)
+        if base_models:
+            query_filters.append(
+                f"COALESCE({KEY_BASE_MODEL}, '') IN ({', '.join(['?' for _ in base_models])})"
+            )
+            values += base_models
+        if cursor:
+            # keyset pagination, rows strictly older than the last row of the previous page
+            query_filters.append(
+                f"(created_at < ? OR (created_at = ? AND {UUID} < ?))"
+            )
+            values += [cursor[0], cursor[0], cursor[1]]
 
-        columns = OUTPUT_ONLY_KEYS + REQUIRED_KEYS + OPTIONAL_KEYS
         query = f"SELECT {', '.join(columns)} FROM {HISTORY_TABLE_NAME}"
         if query_filters:
             query += f" WHERE {' AND '.join(query_filters)}"
-        query += f" ORDER BY created_at DESC"
+        query += f" ORDER BY created_at DESC, {UUID} DESC"
         if limit_count:
-            query += f" LIMIT {limit_count}"
+            query += f" LIMIT {int(limit_count)}"
 
         # execute the query and return the results
         c = self.get_cursor()
-        rows = c.execute(query, tuple(values)).fetchall()
+        return c.execute(query, tuple(values)).fetchall()
+
+    def get_jobs(
+        self,
+        job_uuid="",
+        apikey="",
+        job_status="",
+        job_types=[],
+        limit_count=0,
+        fields=[],
+        group_id="",
+        lora_model=None,
+        base_models=[],
+    ) -> list:
+        """
+        Get a list of jobs from the HISTORY_TABLE_NAME table based on optional filters.
+
+        If `job_uuid` or `apikey` or `job_status` or `job_type` or `group_id` or `lora_model` is provided, the query will include that filter.
+        If `base_models` is provided, only jobs asking for one of them are included, "" for jobs asking for none.
+        If `fields` is provided, only those columns are selected.
+
+        Returns a list of jobs matching the filters provided.
+        """
+        columns = self.__get_job_columns(fields)
+        rows = self.__query_jobs(
+            columns,
+            job_uuid=job_uuid,
+            apikey=apikey,
+            job_status=job_status,
+            job_types=job_types,
+            group_id=group_id,
+            limit_count=limit_count,
+            lora_model=lora_model,
+            base_models=base_models,
+        )
 
         jobs = []
         for row in rows:
@@ -205,51 +605,324 @@ class Database:
 
         return jobs
 
-    def insert_new_job(self, job_dict: dict, job_uuid="") -> bool:
+    def get_jobs_page(
+        self, apikey: str, job_types=[], fields=[], page_size=20, cursor=()
+    ) -> tuple:
+        """
+        Get one page of jobs of `apikey`, newest first, continuing after `cursor`.
+
+        Returns the jobs and the cursor of the next page, which is () on the last page.
+        """
+        columns = self.__get_job_columns(fields)
+        rows = self.__query_jobs(
+            columns + ["created_at", UUID],
+            apikey=apikey,
+            job_types=job_types,
+            limit_count=page_size + 1,
+            cursor=cursor,
+        )
+
+        # one extra row tells whether there is a next page
+        next_cursor = ()
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = tuple(rows[-1][-2:])
+
+        jobs = []
+        for row in rows:
+            job = {
+                columns[i]: row[i] for i in range(len(columns)) if row[i] is not None
+            }
+            jobs.append(job)
+
+        return jobs, next_cursor
+
+    def get_jobs_etag(
+        self, job_uuid="", apikey="", job_types=[], limit_count=0, cursor=()
+    ) -> str:
+        """
+        Get a tag that changes whenever the jobs matching the filters change, without reading
+        any image. Pass `limit_count` one larger than the page size when paginating, so that
+        the tag also changes when a next page shows up.
+
+        Returns a hex digest built from the uuids and the max updated_at of the matching rows.
+        """
+        rows = self.__query_jobs(
+            [UUID, "updated_at"],
+            job_uuid=job_uuid,
+            apikey=apikey,
+            job_types=job_types,
+            limit_count=limit_count,
+            cursor=cursor,
+        )
+        # uuids catch inserted and deleted rows, updated_at every update_job()
+        max_updated_at = max([str(row[1]) for row in rows if row[1] is not None] + [""])
+        digest = hashlib.sha1(max_updated_at.encode())
+        for row in rows:
+            digest.update(row[0].encode())
+        return digest.hexdigest()
+
+    def get_done_result(self, job_uuid: str, base_model: str) -> dict:
+        """
+        Get the result of a done job identical to `job_uuid` made with `base_model`, with
+        the image loaded as base64 so that it can be stored as a copy.
+
+        Returns an empty dict if there is none.
+        """
+        columns = [BASE64IMAGE, KEY_SEED, KEY_WIDTH, KEY_HEIGHT, KEY_STEPS, KEY_BASE_MODEL]
+        query = (
+            f"SELECT {', '.join(columns)} FROM {HISTORY_TABLE_NAME}"
+            f" WHERE {KEY_JOB_HASH} = (SELECT {KEY_JOB_HASH} FROM {HISTORY_TABLE_NAME} WHERE {UUID} = ?)"
+            f" AND {KEY_JOB_STATUS} = ? AND {KEY_BASE_MODEL} = ? AND {BASE64IMAGE} IS NOT NULL"
+            f" ORDER BY updated_at DESC LIMIT 1"
+        )
+        c = self.get_cursor()
+        row = c.execute(query, (job_uuid, VALUE_JOB_DONE, base_model)).fetchone()
+        if row is None:
+            return {}
+
+        result = {columns[i]: row[i] for i in range(len(columns)) if row[i] is not None}
+        if "base64" not in result[BASE64IMAGE]:
+            # deleting either job removes its image file, so never share one
+            result[BASE64IMAGE] = load_image(result[BASE64IMAGE], to_base64=True)
+            if not result[BASE64IMAGE]:
+                return {}
+        return result
+
+    def get_pending_duplicates(self, job_uuid: str) -> list:
+        """
+        Get the uuids of pending jobs identical to `job_uuid`.
+        """
+        query = (
+            f"SELECT {UUID} FROM {HISTORY_TABLE_NAME}"
+            f" WHERE {KEY_JOB_HASH} = (SELECT {KEY_JOB_HASH} FROM {HISTORY_TABLE_NAME} WHERE {UUID} = ?)"
+            f" AND {KEY_JOB_STATUS} = ? AND {UUID} != ?"
+        )
+        c = self.get_cursor()
+        rows = c.execute(query, (job_uuid, VALUE_JOB_PENDING, job_uuid)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_costs(self) -> dict:
+        """
+        Get the learned cost model as {key: seconds}, see cost_model.py.
+        """
+        c = self.get_cursor()
+        try:
+            rows = c.execute(f"SELECT key, seconds FROM {COST_MODEL_TABLE_NAME}").fetchall()
+        except sqlite3.OperationalError:
+            # not migrated by manage_db.py yet
+            return {}
+        return {row[0]: row[1] for row in rows}
+
+    def record_job_cost(self, job: dict, exec_seconds: float) -> bool:
+        """
+        Store how long `job` took and fold it into the moving averages of its cost key and
+        of the per megapixel-step rate of its type.
+
+        Returns True if the update was successful, otherwise False.
+        """
+        samples = [(get_cost_key(job), exec_seconds)]
+        units = get_cost_units(job)
+        if units > 0:
+            samples.append((job.get(KEY_JOB_TYPE, ""), exec_seconds / units))
+
+        acquire_lock()
+        try:
+            c = self.get_cursor()
+            c.execute(
+                f"UPDATE {HISTORY_TABLE_NAME} SET {KEY_EXEC_SECONDS}=? WHERE {UUID}=?",
+                (exec_seconds, job[UUID]),
+            )
+            c.executemany(self.__get_cost_query(), samples)
+            self.commit()
+        except sqlite3.OperationalError as e:
+            # not migrated by manage_db.py yet
+            c.connection.rollback()
+            self.__logger.warn(f"failed to record the cost of {job[UUID]}: {e}")
+            return False
+        finally:
+            release_lock()
+        return True
+
+    def record_model_switch(self, model_name: str, seconds: float) -> bool:
+        """
+        Fold how long unloading the base model and loading `model_name` took into the
+        moving averages of switching to it and of switching models at all.
+
+        Returns True if the update was successful, otherwise False.
+        """
+        samples = [(key, seconds) for key in get_model_switch_keys(model_name)]
+        acquire_lock()
+        try:
+            c = self.get_cursor()
+            c.executemany(self.__get_cost_query(), samples)
+            self.commit()
+        except sqlite3.OperationalError as e:
+            # not migrated by manage_db.py yet
+            c.connection.rollback()
+            self.__logger.warn(f"failed to record switching to {model_name}: {e}")
+            return False
+        finally:
+            release_lock()
+        return True
+
+    def __get_cost_query(self) -> str:
+        # a plain average for the first samples, then a moving one
+        return (
+            f"INSERT INTO {COST_MODEL_TABLE_NAME} (key, seconds, samples) VALUES (?, ?, 1)"
+            f" ON CONFLICT(key) DO UPDATE SET"
+            f" seconds = seconds + MAX({COST_MODEL_ALPHA}, 1.0 / (samples + 1)) * (excluded.seconds - seconds),"
+            f" samples = samples + 1"
+        )
+
+    def get_queue(self) -> list:
+        """
+        Get the running jobs and then the pending jobs in the order the backend picks
+        them, with the columns needed to estimate their costs.
+        """
+        columns = [
+            UUID,
+            APIKEY,
+            KEY_JOB_STATUS,
+            KEY_JOB_TYPE,
+            KEY_WIDTH,
+            KEY_HEIGHT,
+            KEY_STEPS,
+            KEY_SCHEDULER,
+            KEY_BASE_MODEL,
+            "updated_at",
+        ]
+        query = (
+            f"SELECT {', '.join(columns)} FROM {HISTORY_TABLE_NAME}"
+            f" WHERE {KEY_JOB_STATUS} IN (?, ?)"
+            f" ORDER BY {KEY_JOB_STATUS} = ? DESC, created_at DESC, {UUID} DESC"
+        )
+        c = self.get_cursor()
+        rows = c.execute(
+            query, (VALUE_JOB_RUNNING, VALUE_JOB_PENDING, VALUE_JOB_RUNNING)
+        ).fetchall()
+        return [
+            {columns[i]: row[i] for i in range(len(columns)) if row[i] is not None}
+            for row in rows
+        ]
+
+    def count_queued_jobs(self) -> list:
+        """
+        Count the pending and running jobs per status and type.
+
+        Returns [(status, type, count)].
+        """
+        query = (
+            f"SELECT {KEY_JOB_STATUS}, {KEY_JOB_TYPE}, COUNT(*) FROM {HISTORY_TABLE_NAME}"
+            f" WHERE {KEY_JOB_STATUS} IN (?, ?) GROUP BY {KEY_JOB_STATUS}, {KEY_JOB_TYPE}"
+        )
+        c = self.get_cursor()
+        return c.execute(query, (VALUE_JOB_PENDING, VALUE_JOB_RUNNING)).fetchall()
+
+    def get_created_at(self, job_uuid: str):
+        """
+        Get when the job of `job_uuid` was submitted as datetime, None if unknown.
+        """
+        c = self.get_cursor()
+        row = c.execute(
+            f"SELECT created_at FROM {HISTORY_TABLE_NAME} WHERE {UUID} = ?", (job_uuid,)
+        ).fetchone()
+        try:
+            return datetime.datetime.fromisoformat(str(row[0]))
+        except (TypeError, ValueError):
+            return None
+
+    def get_caches(self) -> dict:
+        """Get the caches of this instance by name, to report their hit rates"""
+        return {"apikey": self.__users_cache}
+
+    def __save_job_images(self, job_dict: dict, epoch: int, saved_filepaths: dict):
+        """
+        Saves the reference and mask images of `job_dict` to the image output folder and
+        replaces them by their filepaths, adding what it saved to `saved_filepaths`.
+        """
+        for key, suffix in [(REFERENCE_IMG, "ref"), (MASK_IMG, "mask")]:
+            if (
+                not self.__image_output_folder
+                or key not in job_dict
+                or "base64" not in job_dict[key]
+            ):
+                continue
+            if job_dict[key] not in saved_filepaths:
+                img_filepath = f"{self.__image_output_folder}/{epoch}_{suffix}.png"
+                self.__logger.info(f"saving {key} to {img_filepath}")
+                saved_filepaths[job_dict[key]] = (
+                    img_filepath if save_image(job_dict[key], img_filepath) else ""
+                )
+            if saved_filepaths[job_dict[key]]:
+                job_dict[key] = saved_filepaths[job_dict[key]]
+
+    def insert_new_job(self, job_dict: dict, job_uuid="", max_pending=0) -> bool:
         """
         Insert a new job into the HISTORY_TABLE_NAME table.
 
         If `job_uuid` is not provided, a new UUID will be generated automatically.
+        See insert_new_jobs() for `max_pending`.
 
         Returns True if the insertion was successful, otherwise False.
         """
-        if not job_uuid:
-            job_uuid = str(uuid.uuid4())
-        self.__logger.info(f"inserting a new job with {job_uuid}")
+        return self.insert_new_jobs(
+            [job_dict], job_uuids=[job_uuid], max_pending=max_pending
+        )
 
-        current_epoch = get_epoch_now()
-        # store image to job_dict if has one
-        if (
-            self.__image_output_folder
-            and REFERENCE_IMG in job_dict
-            and "base64" in job_dict[REFERENCE_IMG]
-        ):
-            ref_img_filepath = f"{self.__image_output_folder}/{current_epoch}_ref.png"
-            self.__logger.info(f"saving reference image to {ref_img_filepath}")
-            if save_image(job_dict[REFERENCE_IMG], ref_img_filepath):
-                job_dict[REFERENCE_IMG] = ref_img_filepath
-        if (
-            self.__image_output_folder
-            and MASK_IMG in job_dict
-            and "base64" in job_dict[MASK_IMG]
-        ):
-            mask_img_filepath = f"{self.__image_output_folder}/{current_epoch}_mask.png"
-            self.__logger.info(f"saving mask image to {mask_img_filepath}")
-            if save_image(job_dict[MASK_IMG], mask_img_filepath):
-                job_dict[MASK_IMG] = mask_img_filepath
+    def insert_new_jobs(
+        self, job_dicts: list, job_uuids=[], group_id="", max_pending=0
+    ) -> bool:
+        """
+        Insert new jobs into the HISTORY_TABLE_NAME table in one transaction, all tagged
+        with `group_id` if provided.
+
+        Missing or empty `job_uuids` will be generated automatically. Reference and mask
+        images shared by several jobs are saved only once.
 
-        values = [job_uuid, VALUE_JOB_PENDING, datetime.datetime.now()]
-        columns = [UUID, KEY_JOB_STATUS, "created_at"] + REQUIRED_KEYS + OPTIONAL_KEYS
-        for column in REQUIRED_KEYS + OPTIONAL_KEYS:
-            values.append(job_dict.get(column, None))
+        If `max_pending` is provided, all jobs must belong to one apikey, and the pending
+        job limit, quota and submission rate of it are enforced in the same transaction.
+        Raises QuotaExceededError if one of them is exceeded.
 
+        Returns True if the insertion was successful, otherwise False.
+        """
+        job_uuids = [job_uuid or str(uuid.uuid4()) for job_uuid in job_uuids]
+        job_uuids += [str(uuid.uuid4()) for _ in range(len(job_dicts) - len(job_uuids))]
+        # before images are replaced by their filepaths, hashing them is cheaper
+        job_hashes = [get_job_hash(job_dict) for job_dict in job_dicts]
+        current_epoch = get_epoch_now()
+        saved_filepaths = {}  # base64 image -> filepath it was saved to
+
+        columns = [UUID, KEY_JOB_STATUS, KEY_GROUP_ID, KEY_JOB_HASH, "created_at"]
+        columns += REQUIRED_KEYS + OPTIONAL_KEYS
         query = f"INSERT INTO {HISTORY_TABLE_NAME} ({', '.join(columns)}) VALUES ({', '.join(['?' for _ in columns])})"
 
+        c = self.get_cursor()
         acquire_lock()
         try:
-            c = self.get_cursor()
-            c.execute(query, tuple(values))
+            if max_pending:
+                self.__take_quota(c, job_dicts[0][APIKEY], len(job_dicts), max_pending)
+
+            # only jobs within the quota get their images written
+            rows = []
+            for job_dict, job_uuid, job_hash in zip(job_dicts, job_uuids, job_hashes):
+                self.__logger.info(f"inserting a new job with {job_uuid}")
+                self.__save_job_images(job_dict, current_epoch, saved_filepaths)
+                values = [job_uuid, VALUE_JOB_PENDING, group_id or None]
+                values.append(job_hash or None)
+                values.append(datetime.datetime.now())
+                for column in REQUIRED_KEYS + OPTIONAL_KEYS:
+                    values.append(job_dict.get(column, None))
+                rows.append(tuple(values))
+            c.executemany(query, rows)
             self.commit()
+        except BaseException:
+            # else the next commit() of this thread would store the quota taken
+            c.connection.rollback()
+            for filepath in saved_filepaths.values():
+                if filepath and os.path.isfile(filepath):
+                    os.remove(filepath)
+            raise
         finally:
             release_lock()
         return True
@@ -352,6 +1025,6 @@ class Database:
     def safe_disconnect(self):
         if not self.is_connected:
             raise RuntimeError("Did you forget to connect() to the database?")
-        self.commit()
-        self.__connect.close()
+        self.__connections.close_all(commit=True)
+        self.is_connected = False
         self.__logger.info("Disconnected from database.")
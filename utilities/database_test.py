@@ -0,0 +1,271 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from utilities.constants import APIKEY
+from utilities.constants import KEY_GROUP_ID
+from utilities.constants import KEY_SEED
+from utilities.constants import BASE64IMAGE
+from utilities.constants import COST_MODEL_TABLE_NAME
+from utilities.constants import HISTORY_TABLE_NAME
+from utilities.constants import INTERNAL_KEYS
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import KEY_JOB_STATUS
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_PROMPT
+from utilities.constants import OPTIONAL_KEYS
+from utilities.constants import OUTPUT_ONLY_KEYS
+from utilities.constants import REQUIRED_KEYS
+from utilities.constants import UUID
+from utilities.constants import KEY_QUOTA_WINDOW
+from utilities.constants import QUOTAS_TABLE_NAME
+from utilities.constants import USERS_TABLE_NAME
+from utilities.database import Database
+from utilities.database import QuotaExceededError
+from utilities.database import get_quota_window_key
+from utilities.database import decode_cursor
+from utilities.database import encode_cursor
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        db_filepath = os.path.join(self.folder, "test.db")
+        sqlite3.connect(db_filepath).close()
+        self.database = Database()
+        self.database.connect(db_filepath)
+
+        columns = ["created_at TIMESTAMP", "updated_at TIMESTAMP"] + [
+            f"{column} TEXT"
+            for column in INTERNAL_KEYS + OUTPUT_ONLY_KEYS + REQUIRED_KEYS + OPTIONAL_KEYS
+        ]
+        c = self.database.get_cursor()
+        c.execute(f"CREATE TABLE {HISTORY_TABLE_NAME} ({', '.join(columns)})")
+        # 5 jobs of "a", 3 of them share created_at to exercise the uuid tie breaker
+        for i, created_at in enumerate(["1", "2", "2", "2", "3"]):
+            c.execute(
+                f"INSERT INTO {HISTORY_TABLE_NAME} (created_at, {UUID}, {APIKEY}, {KEY_PROMPT}, {KEY_JOB_TYPE}, {KEY_JOB_STATUS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (created_at, f"job{i}", "a", f"prompt{i}", "txt", "done"),
+            )
+        c.execute(
+            f"INSERT INTO {HISTORY_TABLE_NAME} (created_at, {UUID}, {APIKEY}) VALUES (?, ?, ?)",
+            ("4", "other", "b"),
+        )
+        self.database.commit()
+
+    def tearDown(self):
+        self.database.safe_disconnect()
+        shutil.rmtree(self.folder)
+
+    def test_thread_connections_closed(self):
+        # e.g. the threaded dev server runs every request in a thread of its own
+        for _ in range(20):
+            thread = threading.Thread(target=lambda: self.database.get_jobs(apikey="a"))
+            thread.start()
+            thread.join()
+        self.assertEqual(self.database.count_connections(), 1)
+
+    def test_get_jobs_page(self):
+        uuids = []
+        cursor = ()
+        while True:
+            jobs, cursor = self.database.get_jobs_page(
+                apikey="a", page_size=2, cursor=cursor
+            )
+            uuids += [job[UUID] for job in jobs]
+            if not cursor:
+                break
+        self.assertEqual(uuids, ["job4", "job3", "job2", "job1", "job0"])
+
+    def test_get_jobs_page_exact_fit(self):
+        jobs, cursor = self.database.get_jobs_page(apikey="a", page_size=5)
+        self.assertEqual(len(jobs), 5)
+        self.assertEqual(cursor, ())
+
+    def test_get_jobs_fields(self):
+        jobs, _ = self.database.get_jobs_page(
+            apikey="a", fields=[UUID, KEY_JOB_STATUS], page_size=1
+        )
+        self.assertEqual(jobs, [{UUID: "job4", KEY_JOB_STATUS: "done"}])
+        jobs = self.database.get_jobs(job_uuid="job0", fields=[KEY_PROMPT])
+        self.assertEqual(jobs, [{KEY_PROMPT: "prompt0"}])
+
+    def test_insert_new_jobs(self):
+        jobs = [
+            {APIKEY: "c", KEY_PROMPT: "cat", KEY_JOB_TYPE: "txt", KEY_SEED: seed}
+            for seed in ["1", "2"]
+        ]
+        self.database.insert_new_jobs(jobs, job_uuids=["c1", "c2"], group_id="g")
+        self.database.insert_new_job({APIKEY: "c", KEY_PROMPT: "dog", KEY_JOB_TYPE: "txt"})
+
+        self.assertEqual(self.database.count_all_pending_jobs("c"), 3)
+        grouped = self.database.get_jobs(group_id="g", fields=[UUID, KEY_SEED])
+        self.assertEqual(
+            sorted(grouped, key=lambda job: job[UUID]),
+            [{UUID: "c1", KEY_SEED: "1"}, {UUID: "c2", KEY_SEED: "2"}],
+        )
+        # the newest job goes first unless a group is preferred
+        self.assertEqual(self.database.get_one_pending_job()[0][KEY_PROMPT], "dog")
+        self.assertEqual(
+            self.database.get_one_pending_job(group_id="g")[0][KEY_GROUP_ID], "g"
+        )
+
+    def test_pending_job_by_lora_model(self):
+        self.database.insert_new_job(
+            {APIKEY: "c", KEY_PROMPT: "cat", KEY_JOB_TYPE: "txt", KEY_LORA_MODEL: "a:1"}
+        )
+        time.sleep(0.01)
+        self.database.insert_new_job({APIKEY: "c", KEY_PROMPT: "dog", KEY_JOB_TYPE: "txt"})
+
+        self.assertEqual(self.database.get_one_pending_job()[0][KEY_PROMPT], "dog")
+        self.assertEqual(
+            self.database.get_one_pending_job(lora_model="a:1")[0][KEY_PROMPT], "cat"
+        )
+        self.assertEqual(
+            self.database.get_one_pending_job(lora_model="")[0][KEY_PROMPT], "dog"
+        )
+        # falls back to any job if none has the adapters
+        self.assertEqual(
+            self.database.get_one_pending_job(lora_model="b:1")[0][KEY_PROMPT], "dog"
+        )
+
+    def test_pending_job_by_base_model(self):
+        for prompt, base_model in [("cat", "x"), ("dog", "y"), ("cow", "y"), ("owl", "")]:
+            self.database.insert_new_job(
+                {
+                    APIKEY: "c",
+                    KEY_PROMPT: prompt,
+                    KEY_JOB_TYPE: "txt",
+                    KEY_BASE_MODEL: base_model,
+                }
+            )
+            time.sleep(0.01)
+
+        # jobs the loaded model can run first, newest first
+        job = self.database.get_one_pending_job(base_model="x")[0]
+        self.assertEqual(job[KEY_PROMPT], "owl")
+        self.database.update_job({KEY_JOB_STATUS: "done"}, job_uuid=job[UUID])
+        job = self.database.get_one_pending_job(base_model="x")[0]
+        self.assertEqual(job[KEY_PROMPT], "cat")
+        self.database.update_job({KEY_JOB_STATUS: "done"}, job_uuid=job[UUID])
+        # then the model most pending jobs ask for
+        self.assertEqual(
+            self.database.get_one_pending_job(base_model="z")[0][KEY_PROMPT], "cow"
+        )
+        # the loaded model keeps running its jobs within the fairness window
+        self.database.insert_new_job(
+            {APIKEY: "c", KEY_PROMPT: "ant", KEY_JOB_TYPE: "txt", KEY_BASE_MODEL: "z"}
+        )
+        job = self.database.get_one_pending_job(base_model="z", fairness_seconds=60)[0]
+        self.assertEqual(job[KEY_PROMPT], "ant")
+        # but not once jobs for other models waited longer than it
+        job = self.database.get_one_pending_job(base_model="z", fairness_seconds=0.01)[0]
+        self.assertEqual(job[KEY_PROMPT], "dog")
+
+    def test_done_result(self):
+        job = {APIKEY: "c", KEY_PROMPT: "cat", KEY_JOB_TYPE: "txt", KEY_SEED: "7"}
+        self.database.insert_new_jobs([dict(job) for _ in range(3)], ["c1", "c2", "c3"])
+        self.database.insert_new_job({**job, KEY_SEED: "0"}, job_uuid="random")
+
+        self.assertEqual(self.database.get_done_result("c2", "sd"), {})
+        self.assertEqual(sorted(self.database.get_pending_duplicates("c1")), ["c2", "c3"])
+        self.assertEqual(self.database.get_pending_duplicates("random"), [])
+
+        self.database.update_job(
+            {BASE64IMAGE: "data:image/png;base64,AAAA", KEY_BASE_MODEL: "sd"},
+            job_uuid="c1",
+        )
+        self.database.update_job({KEY_JOB_STATUS: "done"}, job_uuid="c1")
+        self.assertEqual(self.database.get_done_result("c2", "other"), {})
+        result = self.database.get_done_result("c2", "sd")
+        self.assertEqual(result[BASE64IMAGE], "data:image/png;base64,AAAA")
+        self.assertEqual(result[KEY_SEED], "7")
+        self.assertEqual(self.database.get_done_result("random", "sd"), {})
+
+    def test_quota(self):
+        c = self.database.get_cursor()
+        c.execute(
+            f"CREATE TABLE {USERS_TABLE_NAME} ({APIKEY} TEXT, quota INT, {KEY_QUOTA_WINDOW} TEXT)"
+        )
+        c.execute(
+            f"CREATE TABLE {QUOTAS_TABLE_NAME} ({APIKEY} TEXT PRIMARY KEY, pending INT DEFAULT 0,"
+            " window_key TEXT DEFAULT '', window_used INT DEFAULT 0, tokens REAL, tokens_at REAL)"
+        )
+        c.execute(f"INSERT INTO {USERS_TABLE_NAME} VALUES ('q', 5, 'daily')")
+        self.database.commit()
+        job = {APIKEY: "q", KEY_PROMPT: "cat", KEY_JOB_TYPE: "txt"}
+
+        self.assertTrue(self.database.insert_new_job(dict(job), max_pending=2))
+        c.execute(f"UPDATE {QUOTAS_TABLE_NAME} SET pending = 2")
+        self.database.commit()
+        self.assertEqual(self.database.count_all_pending_jobs("q"), 2)
+        with self.assertRaisesRegex(QuotaExceededError, "too many jobs"):
+            self.database.insert_new_job(dict(job), max_pending=2)
+
+        c.execute(
+            f"UPDATE {QUOTAS_TABLE_NAME} SET pending = 0, window_key = ?, window_used = 5",
+            (get_quota_window_key("daily"),),
+        )
+        self.database.commit()
+        with self.assertRaisesRegex(QuotaExceededError, "quota"):
+            self.database.insert_new_job(dict(job), max_pending=2)
+
+        # a window of another day does not count
+        c.execute(f"UPDATE {QUOTAS_TABLE_NAME} SET window_key = '2000-01-01'")
+        self.database.commit()
+        self.assertTrue(self.database.insert_new_job(dict(job), max_pending=2))
+
+        c.execute(
+            f"UPDATE {QUOTAS_TABLE_NAME} SET tokens = 0.5, tokens_at = ?", (time.time(),)
+        )
+        self.database.commit()
+        with self.assertRaisesRegex(QuotaExceededError, "too fast"):
+            self.database.insert_new_job(dict(job), max_pending=2)
+        self.assertEqual(self.database.count_all_pending_jobs("nobody"), 0)
+
+    def test_costs(self):
+        self.assertEqual(self.database.get_costs(), {})
+        c = self.database.get_cursor()
+        c.execute(
+            f"CREATE TABLE {COST_MODEL_TABLE_NAME}"
+            " (key TEXT PRIMARY KEY, seconds REAL, samples INT DEFAULT 0)"
+        )
+        self.database.commit()
+
+        job = {UUID: "job0", KEY_JOB_TYPE: "txt"}
+        for seconds in [10.0, 20.0]:
+            self.assertTrue(self.database.record_job_cost(job, seconds))
+        costs = self.database.get_costs()
+        self.assertAlmostEqual(costs["txt|512|512|100|Default"], 15.0)
+        self.assertIn("txt", costs)
+        self.assertTrue(self.database.record_model_switch("x", 8.0))
+        costs = self.database.get_costs()
+        self.assertEqual(costs["model_switch|x"], 8.0)
+        self.assertEqual(costs["model_switch"], 8.0)
+        self.assertEqual(
+            self.database.get_jobs(job_uuid="job0", fields=[UUID])[0], {UUID: "job0"}
+        )
+
+        self.database.update_job({KEY_JOB_STATUS: "running"}, job_uuid="job2")
+        self.database.update_job({KEY_JOB_STATUS: "pending"}, job_uuid="job3")
+        self.database.update_job({KEY_JOB_STATUS: "pending"}, job_uuid="job4")
+        queue = self.database.get_queue()
+        self.assertEqual([job[UUID] for job in queue], ["job2", "job4", "job3"])
+        self.assertIn("updated_at", queue[0])
+
+    def test_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor(("2", "job3"))), ("2", "job3"))
+        self.assertEqual(decode_cursor(""), ())
+        self.assertEqual(encode_cursor(()), "")
+        for text in ["abc", encode_cursor(("2",)), "W10="]:
+            with self.assertRaises(ValueError):
+                decode_cursor(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,9 @@
+import json
 import os
+import select
+import shutil
+import subprocess
+import tempfile
 
 from utilities.constants import BASE64IMAGE
 from utilities.constants import KEY_WIDTH
@@ -9,39 +14,191 @@ from utilities.config import Config
 from utilities.logger import DummyLogger
 from utilities.images import image_to_base64
 from utilities.images import load_image
-from utilities.images import base64_to_image
-
-
-def gfpgan(
-    gfpgan_folderpath, job_uuid, img_filepath, config=Config(), logger=DummyLogger()
-):
-    if not os.path.isdir(gfpgan_folderpath):
-        logger.error(f"unable to find GFPGAN folder {gfpgan_folderpath}")
-        return {}
-
-    if not os.path.isfile(img_filepath):
-        logger.error(f"unable to find image file {img_filepath}")
-        return {}
-
-    tmp_output_dir = f"/tmp/{job_uuid}"
-    os.makedirs(tmp_output_dir, exist_ok=True)
-
-    cmd = f"/usr/bin/python {gfpgan_folderpath}/inference_gfpgan.py -i {img_filepath} -o {tmp_output_dir} -v 1.3 -s {config.get_steps()} -w {config.get_strength()}"
-    logger.info(f"running: {cmd}")
-    os.system(cmd)
-
-    img_output_path = os.path.join(tmp_output_dir, "restored_imgs", os.path.basename(img_filepath))
-    logger.info(f"image path: {img_output_path}")
-    try:
-
-        image = load_image(img_output_path)
-        width, height = image.size
-        return {
-            BASE64IMAGE: image_to_base64(image),
-            KEY_WIDTH: width,
-            KEY_HEIGHT: height,
-            KEY_BASE_MODEL: "gfpgan",
-        }
-    except Exception as e:
-        logger.error(f"Scaling failed: {e}")
-    return {}
+from utilities.images import save_image
+
+
+GFPGAN_WORKER_FILEPATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "gfpgan_worker.py"
+)
+
+
+class GfpganWorker:
+    """
+    Keeps one GFPGAN process alive so that the model is only loaded once, instead of
+    starting a new interpreter for every restoration job.
+
+    The worker reads one JSON request per line from stdin and answers with one JSON line
+    on stdout, see `utilities/gfpgan_worker.py`. It is restarted with the next request
+    if it crashes or times out.
+    """
+
+    def __init__(
+        self,
+        gfpgan_folderpath: str,
+        python_filepath: str = "/usr/bin/python",
+        worker_filepath: str = GFPGAN_WORKER_FILEPATH,
+        timeout_seconds: int = 300,
+        startup_timeout_seconds: int = 600,
+        logger: DummyLogger = DummyLogger(),
+        tmp_folderpath: str = None,
+    ):
+        self.__gfpgan_folderpath = gfpgan_folderpath
+        self.__python_filepath = python_filepath
+        self.__worker_filepath = worker_filepath
+        self.__timeout_seconds = timeout_seconds
+        self.__startup_timeout_seconds = startup_timeout_seconds
+        self.__logger = logger
+        # where the images of a batch go, the system default if None
+        self.__tmp_folderpath = tmp_folderpath
+        self.__process = None
+
+    def is_alive(self) -> bool:
+        return self.__process is not None and self.__process.poll() is None
+
+    def start(self) -> bool:
+        self.stop()
+        if not os.path.isdir(self.__gfpgan_folderpath):
+            self.__logger.error(
+                f"unable to find GFPGAN folder {self.__gfpgan_folderpath}"
+            )
+            return False
+
+        cmd = [self.__python_filepath, self.__worker_filepath, self.__gfpgan_folderpath]
+        self.__logger.info(f"running: {' '.join(cmd)}")
+        try:
+            self.__process = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+            )
+        except OSError as e:
+            # e.g. a wrong --gfpgan-python
+            self.__logger.error(f"unable to run GFPGAN worker: {e}")
+            return False
+        if not self.__read_response(self.__startup_timeout_seconds).get("ready", False):
+            self.__logger.error("GFPGAN worker failed to start")
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        if self.__process is None:
+            return
+        if self.is_alive():
+            self.__process.kill()
+        self.__process.wait()
+        for stream in [self.__process.stdin, self.__process.stdout]:
+            try:
+                stream.close()
+            except OSError:
+                # flushing to a worker that died already
+                pass
+        self.__process = None
+
+    def __read_response(self, timeout_seconds: int) -> dict:
+        # requests and responses are strictly one line each in lockstep, so nothing
+        # is left in the read buffer that select() could miss
+        ready, _, _ = select.select([self.__process.stdout], [], [], timeout_seconds)
+        if not ready:
+            self.__logger.error(f"GFPGAN worker timed out after {timeout_seconds}s")
+            return {}
+        line = self.__process.stdout.readline()
+        if not line:
+            self.__logger.error(
+                f"GFPGAN worker exited with {self.__process.wait()}"
+            )
+            return {}
+        try:
+            return json.loads(line)
+        except ValueError:
+            self.__logger.error(f"GFPGAN worker answered {line[:200]!r}")
+            return {}
+
+    def __request(self, request: dict, timeout_seconds: int) -> dict:
+        if not self.is_alive() and not self.start():
+            return {}
+        try:
+            self.__process.stdin.write(json.dumps(request) + "\n")
+            self.__process.stdin.flush()
+        except OSError:
+            self.__logger.error("GFPGAN worker is gone")
+            self.stop()
+            return {}
+
+        response = self.__read_response(timeout_seconds)
+        if not response:
+            # kill it, a fresh one is started with the next request
+            self.stop()
+        return response
+
+    def restore(self, job_uuid: str, img_filepath: str, config: Config = Config()) -> dict:
+        return self.restore_batch([(job_uuid, img_filepath, config)])[0]
+
+    def restore_batch(self, jobs: list) -> list:
+        """
+        Restores a list of (job_uuid, img_filepath, config) in one worker request, so that
+        the warm face detection and upscaling models are shared by the whole batch.
+
+        Returns one result dict per job in the same order, empty if that job failed.
+        """
+        results = [{} for _ in jobs]
+        if not jobs:
+            return results
+        tmp_output_dir = tempfile.mkdtemp(
+            prefix=f"gfpgan_{jobs[0][0]}_", dir=self.__tmp_folderpath
+        )
+        try:
+            items = []
+            indices = []
+            for i, (job_uuid, img_filepath, config) in enumerate(jobs):
+                if "base64" in img_filepath:
+                    # reference image is stored inline when no image output folder is set
+                    input_filepath = os.path.join(tmp_output_dir, f"{i}_input.png")
+                    save_image(img_filepath, input_filepath)
+                    img_filepath = input_filepath
+                if not os.path.isfile(img_filepath):
+                    self.__logger.error(f"unable to find image file {img_filepath}")
+                    continue
+                items.append(
+                    {
+                        "input": img_filepath,
+                        "output": os.path.join(
+                            tmp_output_dir, f"{i}_restored_{os.path.basename(img_filepath)}"
+                        ),
+                        "upscale": config.get_steps(),
+                        "weight": config.get_strength(),
+                    }
+                )
+                indices.append(i)
+            if not items:
+                return results
+
+            self.__logger.info(f"restoring {len(items)} images")
+            try:
+                response = self.__request(
+                    {"id": jobs[0][0], "items": items},
+                    self.__timeout_seconds * len(items),
+                )
+            except Exception as e:
+                # fails every job of the batch, the next request starts a fresh worker
+                self.__logger.error(f"GFPGAN worker request failed: {e}")
+                self.stop()
+                response = {}
+            for i, item, result in zip(indices, items, response.get("results", [])):
+                if not result.get("ok", False):
+                    self.__logger.error(
+                        f"restoration of {jobs[i][0]} failed: {result.get('error', '')}"
+                    )
+                    continue
+                try:
+                    image = load_image(item["output"])
+                    width, height = image.size
+                    results[i] = {
+                        BASE64IMAGE: image_to_base64(image),
+                        KEY_WIDTH: width,
+                        KEY_HEIGHT: height,
+                        KEY_BASE_MODEL: "gfpgan",
+                    }
+                except Exception as e:
+                    self.__logger.error(f"Scaling failed: {e}")
+        finally:
+            shutil.rmtree(tmp_output_dir, ignore_errors=True)
+        return results
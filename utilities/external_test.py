@@ -0,0 +1,131 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from PIL import Image
+
+from utilities.config import Config
+from utilities.constants import BASE64IMAGE
+from utilities.constants import KEY_WIDTH
+from utilities.external import GfpganWorker
+
+# speaks the same protocol as gfpgan_worker.py, but only copies the image
+STUB_WORKER = """
+import json
+import shutil
+import sys
+import time
+
+print(json.dumps({"ready": True}), flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    results = []
+    for item in request["items"]:
+        if "crash" in item["input"]:
+            sys.exit(1)
+        if "slow" in item["input"]:
+            time.sleep(10)
+        shutil.copyfile(item["input"], item["output"])
+        results.append({"ok": True, "error": ""})
+    print(json.dumps({"id": request["id"], "ok": True, "error": "", "results": results}), flush=True)
+"""
+
+
+class TestGfpganWorker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.worker_filepath = os.path.join(cls.folder, "stub_worker.py")
+        with open(cls.worker_filepath, "w") as f:
+            f.write(STUB_WORKER)
+        for name in ["face.png", "crash.png", "slow.png"]:
+            Image.new("RGB", (32, 16)).save(os.path.join(cls.folder, name))
+
+    def setUp(self):
+        # a temp root of its own, so that runs side by side do not count each other
+        self.tmp_folder = tempfile.mkdtemp()
+        self.worker = GfpganWorker(
+            self.folder,
+            python_filepath=sys.executable,
+            worker_filepath=self.worker_filepath,
+            timeout_seconds=1,
+            tmp_folderpath=self.tmp_folder,
+        )
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.tmp_folder)
+
+    def __count_tmp_dirs(self):
+        return len(os.listdir(self.tmp_folder))
+
+    def test_restore(self):
+        result = self.worker.restore("test", os.path.join(self.folder, "face.png"), Config())
+        self.assertTrue(result[BASE64IMAGE].startswith("data:image/png;base64,"))
+        self.assertEqual(result[KEY_WIDTH], 32)
+        self.assertTrue(self.worker.is_alive())
+        self.assertEqual(self.__count_tmp_dirs(), 0)
+
+    def test_restore_batch(self):
+        face_filepath = os.path.join(self.folder, "face.png")
+        results = self.worker.restore_batch(
+            [
+                ("a", face_filepath, Config()),
+                ("b", os.path.join(self.folder, "none.png"), Config()),
+                ("c", face_filepath, Config()),
+            ]
+        )
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][KEY_WIDTH], 32)
+        self.assertEqual(results[1], {})
+        self.assertEqual(results[2][KEY_WIDTH], 32)
+        self.assertEqual(self.__count_tmp_dirs(), 0)
+
+    def test_restart_after_crash(self):
+        self.assertEqual(self.worker.restore("test", os.path.join(self.folder, "crash.png")), {})
+        self.assertFalse(self.worker.is_alive())
+        self.assertTrue(self.worker.restore("test", os.path.join(self.folder, "face.png")))
+        self.assertEqual(self.__count_tmp_dirs(), 0)
+
+    def test_restart_after_timeout(self):
+        self.assertEqual(self.worker.restore("test", os.path.join(self.folder, "slow.png")), {})
+        self.assertFalse(self.worker.is_alive())
+        self.assertTrue(self.worker.restore("test", os.path.join(self.folder, "face.png")))
+
+    def test_worker_failures(self):
+        face_filepath = os.path.join(self.folder, "face.png")
+        worker = GfpganWorker(self.folder, python_filepath="/nonexistent/python")
+        self.assertEqual(worker.restore_batch([("a", face_filepath, Config())]), [{}])
+
+        garbage_filepath = os.path.join(self.folder, "garbage_worker.py")
+        with open(garbage_filepath, "w") as f:
+            f.write("print('not json', flush=True)\n")
+        worker = GfpganWorker(
+            self.folder, python_filepath=sys.executable, worker_filepath=garbage_filepath
+        )
+        self.assertEqual(worker.restore_batch([("a", face_filepath, Config())]), [{}])
+        worker.stop()
+
+    def test_missing_image(self):
+        self.assertEqual(self.worker.restore("test", os.path.join(self.folder, "none.png")), {})
+
+    def test_stop_after_worker_died(self):
+        self.assertTrue(self.worker.start())
+        self.worker.stop()
+        self.assertTrue(self.worker.start())
+        # kill it behind the back of the worker, with a write pending in the buffer
+        process = self.worker._GfpganWorker__process
+        process.kill()
+        process.wait()
+        process.stdin.write("x")
+        self.worker.stop()
+        self.assertFalse(self.worker.is_alive())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+
+if __name__ == "__main__":
+    unittest.main()
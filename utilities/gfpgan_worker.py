@@ -0,0 +1,131 @@
+"""
+Long-lived GFPGAN restoration worker, started by `utilities.external.GfpganWorker`.
+
+It loads the model once and then serves one JSON request per line on stdin, answering
+each with one JSON line on stdout. A request carries a batch of images that are restored
+with the same warm model. It runs with the python environment of GFPGAN, so it must only
+depend on the standard library and GFPGAN itself.
+
+request:  {"id": "...", "items": [{"input": "/in.png", "output": "/out.png", "upscale": 2, "weight": 0.5}]}
+response: {"id": "...", "ok": true, "error": "", "results": [{"ok": true, "error": ""}]}
+"""
+import argparse
+import json
+import os
+import sys
+
+
+MODEL_NAME = "GFPGANv1.3"
+MODEL_URL = "https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.3.pth"
+BG_UPSAMPLER_URL = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth"
+
+
+class Restorer:
+    """Same setup as `inference_gfpgan.py -v 1.3`, keeping one GFPGANer per upscale."""
+
+    def __init__(self, gfpgan_folderpath: str):
+        sys.path.insert(0, gfpgan_folderpath)
+        # model paths in GFPGAN are relative to its folder
+        os.chdir(gfpgan_folderpath)
+
+        import cv2
+        import torch
+        from gfpgan import GFPGANer
+
+        self.__cv2 = cv2
+        self.__gfpganer_class = GFPGANer
+        self.__restorers = {}
+
+        self.__bg_upsampler = None
+        if torch.cuda.is_available():
+            from basicsr.archs.rrdbnet_arch import RRDBNet
+            from realesrgan import RealESRGANer
+
+            self.__bg_upsampler = RealESRGANer(
+                scale=2,
+                model_path=BG_UPSAMPLER_URL,
+                model=RRDBNet(
+                    num_in_ch=3,
+                    num_out_ch=3,
+                    num_feat=64,
+                    num_block=23,
+                    num_grow_ch=32,
+                    scale=2,
+                ),
+                tile=400,
+                tile_pad=10,
+                pre_pad=0,
+                half=True,
+            )
+
+        self.__model_path = MODEL_URL
+        for folder in ["experiments/pretrained_models", "gfpgan/weights"]:
+            model_path = os.path.join(folder, MODEL_NAME + ".pth")
+            if os.path.isfile(model_path):
+                self.__model_path = model_path
+                break
+        # load the default one right away so the first job does not pay for it
+        self.get_restorer(2)
+
+    def get_restorer(self, upscale: int):
+        if upscale not in self.__restorers:
+            self.__restorers[upscale] = self.__gfpganer_class(
+                model_path=self.__model_path,
+                upscale=upscale,
+                arch="clean",
+                channel_multiplier=2,
+                bg_upsampler=self.__bg_upsampler,
+            )
+        return self.__restorers[upscale]
+
+    def restore(self, input_filepath: str, output_filepath: str, upscale: int, weight: float):
+        image = self.__cv2.imread(input_filepath, self.__cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"unable to read {input_filepath}")
+        _, _, restored_image = self.get_restorer(upscale).enhance(
+            image, has_aligned=False, only_center_face=False, paste_back=True, weight=weight
+        )
+        if restored_image is None:
+            raise ValueError(f"nothing restored from {input_filepath}")
+        self.__cv2.imwrite(output_filepath, restored_image)
+
+
+def serve(restorer: Restorer, requests, responses):
+    responses.write(json.dumps({"ready": True}) + "\n")
+    responses.flush()
+    for line in requests:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        response = {"id": request.get("id", ""), "ok": True, "error": "", "results": []}
+        for item in request.get("items", []):
+            result = {"ok": True, "error": ""}
+            try:
+                restorer.restore(
+                    item["input"],
+                    item["output"],
+                    int(item.get("upscale", 2)),
+                    float(item.get("weight", 0.5)),
+                )
+            except Exception as e:
+                result["ok"] = False
+                result["error"] = str(e)
+            response["results"].append(result)
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("gfpgan_folderpath", help="GFPGAN folderpath")
+    args = parser.parse_args()
+
+    # keep stdout for the protocol only, anything printed by libraries goes to stderr
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    serve(Restorer(args.gfpgan_folderpath), sys.stdin, responses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# numpy and skimage based image processing for the model side, loading and encoding
+# images is in images.py which the frontend imports
+from PIL import Image
+from PIL import ImageFilter
+import numpy as np
+from skimage import io as skimageio
+from skimage import transform
+from skimage import img_as_ubyte
+
+from utilities.images import crop_image
+
+
+def _grow_span(start: int, stop: int, limit: int, multiple: int) -> tuple:
+    """
+    Grows [start, stop) to a multiple of `multiple` around its center, staying within [0, limit).
+    Falls back to the largest multiple of 8 that fits if `limit` itself is too small.
+    """
+    start = max(0, start)
+    stop = min(limit, stop)
+    size = -(-(stop - start) // multiple) * multiple
+    if size > limit:
+        size = max(limit - limit % 8, min(limit, 8))
+    center = (start + stop) // 2
+    start = min(max(0, center - size // 2), limit - size)
+    return start, start + size
+
+
+def get_mask_boundary(
+    mask_image: Image.Image, multiple: int = 64, margin: int = 32
+) -> tuple:
+    """
+    Computes the boundary (left, upper, right, lower) of the masked (white) region, padded by
+    `margin` pixels of context and grown to a multiple of `multiple` in both directions.
+    Returns an empty tuple if nothing is masked.
+    """
+    mask = np.asarray(mask_image.convert("L")) > 127
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return ()
+    width, height = mask_image.size
+    left, right = _grow_span(
+        int(cols[0]) - margin, int(cols[-1]) + 1 + margin, width, multiple
+    )
+    upper, lower = _grow_span(
+        int(rows[0]) - margin, int(rows[-1]) + 1 + margin, height, multiple
+    )
+    return (left, upper, right, lower)
+
+
+def paste_with_feather(
+    image: Image.Image,
+    patch: Image.Image,
+    mask_image: Image.Image,
+    boundary: tuple,
+    feather_radius: int = 8,
+) -> Image.Image:
+    """
+    Pastes `patch` into a copy of `image` at `boundary`, blending through a dilated and
+    blurred `mask_image` (same size as `patch`) so that the seam is not visible.
+    """
+    alpha = mask_image.convert("L")
+    if feather_radius > 0:
+        alpha = alpha.filter(ImageFilter.MaxFilter(2 * feather_radius + 1)).filter(
+            ImageFilter.GaussianBlur(feather_radius)
+        )
+    original = crop_image(image, boundary)
+    blended = Image.composite(patch.convert(original.mode), original, alpha)
+    result = image.copy()
+    result.paste(blended, boundary[:2])
+    return result
+
+
+def _round_up_to_8(size: tuple) -> tuple:
+    return tuple(-(-value // 8) * 8 for value in size)
+
+
+def get_inpaint_sizes(size: tuple, max_size: tuple, max_pixels: int) -> tuple:
+    """
+    Plans inpainting a whole image of `size` (width, height) requested at `max_size`
+    without distorting it.
+
+    Returns (output_size, content_size, working_size): the image scaled up or down to
+    fit `max_size` keeping its aspect ratio, that scaled down just enough to fit
+    `max_pixels` once padded, and that padded to multiples of 8 for the model.
+    """
+    scale = min(max_size[0] / size[0], max_size[1] / size[1])
+    output_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    content_size = output_size
+    working_size = _round_up_to_8(content_size)
+    while working_size[0] * working_size[1] > max(max_pixels, 64):
+        shrink = (max_pixels / (working_size[0] * working_size[1])) ** 0.5
+        content_size = tuple(
+            max(1, min(value - 1, int(value * shrink))) for value in content_size
+        )
+        working_size = _round_up_to_8(content_size)
+    return output_size, content_size, working_size
+
+
+def pad_image(image: Image.Image, size: tuple, repeat_edge: bool = True) -> Image.Image:
+    """
+    Pads `image` on the right and at the bottom to `size`, repeating its edge pixels so
+    that the padding looks like a continuation of the image, or with black otherwise,
+    e.g. for masks that must leave the padding alone.
+    """
+    if image.size == tuple(size):
+        return image
+    pixels = np.asarray(image)
+    padding = [(0, size[1] - image.size[1]), (0, size[0] - image.size[0])]
+    padding += [(0, 0)] * (pixels.ndim - 2)
+    return Image.fromarray(
+        np.pad(pixels, padding, mode="edge" if repeat_edge else "constant")
+    )
+
+
+def _get_tile_starts(length: int, tile_size: int, overlap: int) -> list:
+    if length <= tile_size:
+        return [0]
+    stride = max(1, tile_size - overlap)
+    count = -(-(length - tile_size) // stride) + 1
+    # spread tiles evenly so the last one ends exactly at the border
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def get_tile_boundaries(size: tuple, tile_size: int, overlap: int) -> list:
+    """
+    Splits an image of `size` (width, height) into tiles of `tile_size` that overlap by at
+    least `overlap` pixels and returns their boundaries (left, upper, right, lower).
+    All tiles have the same size, which is smaller than `tile_size` only if the image is.
+    """
+    width, height = size
+    tile_width = min(tile_size, width)
+    tile_height = min(tile_size, height)
+    return [
+        (left, upper, left + tile_width, upper + tile_height)
+        for upper in _get_tile_starts(height, tile_height, overlap)
+        for left in _get_tile_starts(width, tile_width, overlap)
+    ]
+
+
+class TileBlender:
+    """
+    Accumulates overlapping tiles into one image, linearly feathering the overlaps
+    so that no seam is visible.
+    """
+
+    def __init__(self, size: tuple, overlap: int):
+        width, height = size
+        self.__overlap = overlap
+        self.__canvas = np.zeros((height, width, 3), dtype=np.float32)
+        self.__weights = np.zeros((height, width, 1), dtype=np.float32)
+
+    def __get_ramp(self, length: int) -> np.ndarray:
+        distance = np.minimum(np.arange(length) + 1, length - np.arange(length))
+        return np.minimum(1.0, distance / (self.__overlap + 1)).astype(np.float32)
+
+    def add(self, boundary: tuple, tile: Image.Image):
+        left, upper, right, lower = boundary
+        weight = np.outer(self.__get_ramp(lower - upper), self.__get_ramp(right - left))
+        weight = weight[:, :, np.newaxis]
+        pixels = np.asarray(tile.convert("RGB").resize((right - left, lower - upper)))
+        self.__canvas[upper:lower, left:right] += pixels * weight
+        self.__weights[upper:lower, left:right] += weight
+
+    def get_image(self) -> Image.Image:
+        pixels = self.__canvas / np.maximum(self.__weights, 1e-6)
+        return Image.fromarray(np.clip(np.rint(pixels), 0, 255).astype(np.uint8))
+
+
+def load_and_transform_image_for_torch(
+    img_filepath: str,
+    dimension: tuple = (),
+    force_rgb: bool = True,
+    transpose: bool = True,
+    use_ubyte: bool = False,
+) -> np.ndarray:
+    img = skimageio.imread(img_filepath)
+    if force_rgb:
+        img = img[:, :, :3]
+    if dimension:
+        img = transform.resize(img, dimension)
+    if transpose:
+        # swap color axis because
+        # numpy image: H x W x C
+        # torch image: C x H x W
+        img = img.transpose((2, 0, 1))
+    if use_ubyte:
+        img = img_as_ubyte(img)
+    return np.array(img)
@@ -0,0 +1,100 @@
+import unittest
+from PIL import Image
+
+from utilities.image_processing import get_inpaint_sizes
+from utilities.image_processing import get_mask_boundary
+from utilities.image_processing import get_tile_boundaries
+from utilities.image_processing import pad_image
+from utilities.image_processing import paste_with_feather
+from utilities.image_processing import TileBlender
+
+
+class TestImageProcessing(unittest.TestCase):
+    def test_mask_boundary(self):
+        mask = Image.new("L", (1024, 768))
+        mask.paste(255, (500, 300, 520, 330))
+        left, upper, right, lower = get_mask_boundary(mask, multiple=64, margin=16)
+        self.assertEqual((right - left) % 64, 0)
+        self.assertEqual((lower - upper) % 64, 0)
+        self.assertTrue(left <= 500 - 16 and right >= 520 + 16)
+        self.assertTrue(upper <= 300 - 16 and lower >= 330 + 16)
+
+    def test_mask_boundary_clamped(self):
+        mask = Image.new("L", (100, 60))
+        mask.paste(255, (0, 0, 100, 60))
+        self.assertEqual(get_mask_boundary(mask, multiple=64), (2, 2, 98, 58))
+
+        mask = Image.new("L", (300, 300))
+        mask.paste(255, (290, 290, 300, 300))
+        self.assertEqual(get_mask_boundary(mask, multiple=64, margin=0), (236, 236, 300, 300))
+
+    def test_empty_mask(self):
+        self.assertEqual(get_mask_boundary(Image.new("L", (64, 64))), ())
+
+    def test_paste_with_feather(self):
+        image = Image.new("RGB", (256, 256), (0, 0, 0))
+        boundary = (64, 64, 192, 192)
+        patch = Image.new("RGB", (128, 128), (255, 255, 255))
+        mask = Image.new("L", (128, 128))
+        mask.paste(255, (32, 32, 96, 96))
+        result = paste_with_feather(image, patch, mask, boundary, feather_radius=4)
+        self.assertEqual(result.size, image.size)
+        self.assertEqual(result.getpixel((128, 128)), (255, 255, 255))
+        self.assertEqual(result.getpixel((70, 70)), (0, 0, 0))
+        self.assertEqual(result.getpixel((10, 10)), (0, 0, 0))
+        self.assertEqual(image.getpixel((128, 128)), (0, 0, 0))
+
+    def test_inpaint_sizes(self):
+        self.assertEqual(
+            get_inpaint_sizes((1024, 768), (512, 512), 1024 * 1024),
+            ((512, 384), (512, 384), (512, 384)),
+        )
+        # scaled up to the requested size, padded to multiples of 8
+        self.assertEqual(
+            get_inpaint_sizes((500, 167), (1000, 1000), 1024 * 1024),
+            ((1000, 334), (1000, 334), (1000, 336)),
+        )
+
+    def test_inpaint_sizes_budget(self):
+        output_size, content_size, working_size = get_inpaint_sizes(
+            (2000, 1000), (2000, 1000), 512 * 512
+        )
+        self.assertEqual(output_size, (2000, 1000))
+        self.assertLessEqual(working_size[0] * working_size[1], 512 * 512)
+        self.assertEqual([value % 8 for value in working_size], [0, 0])
+        self.assertLess(working_size[0] - content_size[0], 8)
+        self.assertLess(working_size[1] - content_size[1], 8)
+        self.assertAlmostEqual(content_size[0] / content_size[1], 2, places=1)
+
+    def test_pad_image(self):
+        image = Image.new("RGB", (10, 5), (255, 0, 0))
+        padded = pad_image(image, (16, 8))
+        self.assertEqual(padded.size, (16, 8))
+        self.assertEqual(padded.getpixel((15, 7)), (255, 0, 0))
+        mask = pad_image(Image.new("L", (10, 5), 255), (16, 8), repeat_edge=False)
+        self.assertEqual(mask.getpixel((9, 4)), 255)
+        self.assertEqual(mask.getpixel((15, 7)), 0)
+        self.assertIs(pad_image(image, (10, 5)), image)
+
+    def test_tile_boundaries(self):
+        boundaries = get_tile_boundaries((1200, 512), tile_size=512, overlap=64)
+        self.assertEqual(len(boundaries), 3)
+        self.assertEqual(boundaries[0], (0, 0, 512, 512))
+        self.assertEqual(boundaries[-1], (688, 0, 1200, 512))
+        for (left, _, right, _), (next_left, _, _, _) in zip(boundaries, boundaries[1:]):
+            self.assertTrue(right - next_left >= 64)
+
+        self.assertEqual(get_tile_boundaries((256, 128), 512, 64), [(0, 0, 256, 128)])
+
+    def test_tile_blender(self):
+        size = (300, 200)
+        blender = TileBlender(size, overlap=32)
+        for boundary in get_tile_boundaries(size, tile_size=128, overlap=32):
+            blender.add(boundary, Image.new("RGB", (128, 128), (10, 20, 30)))
+        result = blender.get_image()
+        self.assertEqual(result.size, size)
+        self.assertEqual(result.getextrema(), ((10, 10), (20, 20), (30, 30)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,6 @@ import base64
 import os
 import io
 from typing import Union
-import numpy as np
 from PIL import Image
 
 
@@ -12,11 +11,24 @@ def load_image(image: Union[str, bytes], to_base64: bool=False) -> Union[Image.I
     elif os.path.isfile(image):
         if to_base64:
             return image_to_base64(image)
+        # numpy is only loaded where images are processed, never by the frontend
+        import numpy as np
+
         with Image.open(image) as im:
             return Image.fromarray(np.asarray(im))
     return None
 
 
+def decode_image(image: str) -> Union[Image.Image, None]:
+    """
+    Decodes a reference or mask image given as base64 string or filepath.
+    """
+    if "base64" in image:
+        return base64_to_image(image)
+    # is filepath
+    return load_image(image)
+
+
 def save_image(
     image: Union[bytes, Image.Image, str], filepath: str, override: bool = False
 ) -> bool:
@@ -69,30 +81,3 @@ def base64_to_image(image: str) -> Image.Image:
     else:
         base64parts = image
     return Image.open(io.BytesIO(base64.b64decode(base64parts)))
-
-
-from skimage import io as skimageio
-from skimage import transform
-from skimage import img_as_ubyte
-
-
-def load_and_transform_image_for_torch(
-    img_filepath: str,
-    dimension: tuple = (),
-    force_rgb: bool = True,
-    transpose: bool = True,
-    use_ubyte: bool = False,
-) -> np.ndarray:
-    img = skimageio.imread(img_filepath)
-    if force_rgb:
-        img = img[:, :, :3]
-    if dimension:
-        img = transform.resize(img, dimension)
-    if transpose:
-        # swap color axis because
-        # numpy image: H x W x C
-        # torch image: C x H x W
-        img = img.transpose((2, 0, 1))
-    if use_ubyte:
-        img = img_as_ubyte(img)
-    return np.array(img)
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from PIL import Image
+
+from utilities.images import base64_to_image
+from utilities.images import image_to_base64
+from utilities.images import load_image
+from utilities.images import save_image
+
+
+class TestImages(unittest.TestCase):
+    def test_base64(self):
+        image = Image.new("RGB", (16, 8), (255, 0, 0))
+        encoded = image_to_base64(image)
+        self.assertTrue(encoded.startswith("data:image/png;base64,"))
+        decoded = base64_to_image(encoded)
+        self.assertEqual(decoded.size, (16, 8))
+        self.assertEqual(decoded.convert("RGB").getpixel((0, 0)), (255, 0, 0))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filepath = os.path.join(folder, "image.png")
+            encoded = image_to_base64(Image.new("RGB", (16, 8)))
+            self.assertTrue(save_image(encoded, filepath))
+            self.assertFalse(save_image(encoded, filepath))
+            self.assertEqual(load_image(filepath).size, (16, 8))
+            self.assertEqual(load_image(filepath, to_base64=True), encoded)
+            self.assertIsNone(load_image(os.path.join(folder, "missing.png")))
+
+
+if __name__ == "__main__":
+    unittest.main()
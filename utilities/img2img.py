@@ -1,7 +1,11 @@
 import torch
 import re
+from functools import partial
 from typing import Union
 from PIL import Image
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_img2img import (
+    preprocess,
+)
 
 from utilities.constants import BASE64IMAGE
 from utilities.constants import KEY_SEED
@@ -11,12 +15,18 @@ from utilities.constants import KEY_STEPS
 from utilities.constants import KEY_BASE_MODEL
 from utilities.config import Config
 from utilities.logger import DummyLogger
-from utilities.memory import empty_memory_cache
+from utilities.memory import reclaim_memory_if_needed
 from utilities.model import Model
+from utilities.model import decode_latents
+from utilities.model import encode_prompt
 from utilities.times import get_epoch_now
+from utilities.times import DummySpanRecorder
+from utilities.times import SpanRecorder
 from utilities.images import image_to_base64
-from utilities.images import load_image
-from utilities.images import base64_to_image
+from utilities.images import crop_image
+from utilities.images import decode_image
+from utilities.image_processing import get_tile_boundaries
+from utilities.image_processing import TileBlender
 
 
 class Img2Img:
@@ -96,12 +106,85 @@ class Img2Img:
 
         return None, torch.cat(concat_embeds, dim=1), None, torch.cat(neg_embeds, dim=1)
 
+    def __tiled_img2img(
+        self,
+        prompt,
+        negative_prompt,
+        prompt_embeds,
+        negative_prompt_embeds,
+        reference_image: Image.Image,
+        generator,
+        config: Config,
+        spans: SpanRecorder,
+    ) -> Image.Image:
+        tile_size = config.get_tile_size()
+        overlap = min(config.get_tile_overlap(), tile_size // 2)
+        batch_size = config.get_tile_batch_size()
+        boundaries = get_tile_boundaries(reference_image.size, tile_size, overlap)
+        self.__logger.info(
+            f"splitting {reference_image.size} into {len(boundaries)} tiles of {tile_size}"
+        )
+
+        blender = TileBlender(reference_image.size, overlap)
+        for i in range(0, len(boundaries), batch_size):
+            batch = boundaries[i : i + batch_size]
+            with spans.span("denoise"):
+                result = self.model.img2img_pipeline(
+                    prompt=None if prompt is None else [prompt] * len(batch),
+                    negative_prompt=None
+                    if negative_prompt is None
+                    else [negative_prompt] * len(batch),
+                    prompt_embeds=None
+                    if prompt_embeds is None
+                    else prompt_embeds.repeat(len(batch), 1, 1),
+                    negative_prompt_embeds=None
+                    if negative_prompt_embeds is None
+                    else negative_prompt_embeds.repeat(len(batch), 1, 1),
+                    image=[crop_image(reference_image, boundary) for boundary in batch],
+                    guidance_scale=config.get_guidance_scale(),
+                    strength=config.get_strength(),
+                    num_inference_steps=config.get_steps(),
+                    generator=generator,
+                    callback=None,
+                    callback_steps=10,
+                    output_type="latent",
+                )
+            with spans.span("vae_decode"):
+                tiles = decode_latents(self.model.img2img_pipeline, result.images)
+            with spans.span("blend"):
+                for boundary, tile in zip(batch, tiles):
+                    blender.add(boundary, tile)
+            reclaim_memory_if_needed()
+
+        return blender.get_image()
+
+    def __load_reference_image(
+        self, reference_image: str, is_tiled: bool, config: Config
+    ) -> Image.Image:
+        reference_image = decode_image(reference_image).convert("RGB")
+        if is_tiled:
+            # scale (up or down) to fit the requested size, tiles take care of memory
+            scale = min(
+                config.get_width() / reference_image.size[0],
+                config.get_height() / reference_image.size[1],
+            )
+            return reference_image.resize(
+                (
+                    max(8, int(reference_image.size[0] * scale) // 8 * 8),
+                    max(8, int(reference_image.size[1] * scale) // 8 * 8),
+                ),
+                resample=Image.LANCZOS,
+            )
+        reference_image.thumbnail((config.get_width(), config.get_height()))
+        return reference_image
+
     def lunch(
         self,
         prompt: str,
         negative_prompt: str = "",
         reference_image: Union[Image.Image, None, str] = None,
         config: Config = Config(),
+        spans: SpanRecorder = DummySpanRecorder(),
     ) -> dict:
         if not prompt:
             self.__logger.error("no prompt provided, won't proceed")
@@ -116,47 +199,88 @@ class Img2Img:
         generator = torch.Generator(self.__device).manual_seed(seed)
         self.__logger.info("current seed: {}".format(seed))
 
-        if isinstance(reference_image, str):
-            if "base64" in reference_image:
-                reference_image = base64_to_image(reference_image).convert("RGB")
-            else:
-                # is filepath
-                reference_image = load_image(reference_image).convert("RGB")
-            reference_image.thumbnail((config.get_width(), config.get_height()))
-
-        (
-            prompt,
-            prompt_embeds,
-            negative_prompt,
-            negative_prompt_embeds,
-        ) = self.__token_limit_workaround(prompt, negative_prompt)
-
-        result = self.model.img2img_pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            prompt_embeds=prompt_embeds,
-            negative_prompt_embeds=negative_prompt_embeds,
-            image=reference_image,
-            guidance_scale=config.get_guidance_scale(),
-            strength=config.get_strength(),
-            num_inference_steps=config.get_steps(),
-            generator=generator,
-            callback=None,
-            callback_steps=10,
-        )
+        is_tiled = config.get_tile_size() > 0
+
+        # repeated edits of the same image skip decoding, resizing and the VAE encode
+        cache = self.model.reference_cache
+        digest = cache.get_digest(reference_image)
+        image_key = None
+        if digest is not None:
+            size = (config.get_width(), config.get_height())
+            image_key = ("img2img", digest, is_tiled) + size
+
+        with spans.span("decode_image"):
+            if isinstance(reference_image, str):
+                load = partial(
+                    self.__load_reference_image, reference_image, is_tiled, config
+                )
+                reference_image = cache.get("image", image_key, load)
+            if not is_tiled:
+                # what the pipeline would turn the image into by itself
+                reference_tensor = cache.get(
+                    "tensor", image_key, partial(preprocess, reference_image)
+                )
+
+        with spans.span("encode_prompt"):
+            (
+                prompt,
+                prompt_embeds,
+                negative_prompt,
+                negative_prompt_embeds,
+            ) = self.__token_limit_workaround(prompt, negative_prompt)
+            if prompt_embeds is None:
+                prompt_embeds, negative_prompt_embeds = encode_prompt(
+                    self.model.img2img_pipeline, self.__device, prompt, negative_prompt
+                )
+                prompt, negative_prompt = None, None
+
+        if is_tiled:
+            result_img = self.__tiled_img2img(
+                prompt,
+                negative_prompt,
+                prompt_embeds,
+                negative_prompt_embeds,
+                reference_image,
+                generator,
+                config,
+                spans,
+            )
+            width, height = result_img.size
+        else:
+            with spans.span("denoise"):
+                result = self.model.img2img_pipeline(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    image=reference_tensor,
+                    guidance_scale=config.get_guidance_scale(),
+                    strength=config.get_strength(),
+                    num_inference_steps=config.get_steps(),
+                    generator=generator,
+                    callback=None,
+                    callback_steps=10,
+                    output_type="latent",
+                )
+            with spans.span("vae_decode"):
+                result_img = decode_latents(self.model.img2img_pipeline, result.images)[0]
+            width, height = config.get_width(), config.get_height()
 
         if self.__output_folder:
             out_filepath = "{}/{}.png".format(self.__output_folder, t)
-            result.images[0].save(out_filepath)
+            result_img.save(out_filepath)
             self.__logger.info("output to file: {}".format(out_filepath))
 
-        empty_memory_cache()
+        reclaim_memory_if_needed()
+
+        with spans.span("png_encode"):
+            base64_image = image_to_base64(result_img)
 
         return {
-            BASE64IMAGE: image_to_base64(result.images[0]),
+            BASE64IMAGE: base64_image,
             KEY_SEED: str(seed),
-            KEY_WIDTH: config.get_width(),
-            KEY_HEIGHT: config.get_height(),
+            KEY_WIDTH: width,
+            KEY_HEIGHT: height,
             KEY_STEPS: config.get_steps(),
             KEY_BASE_MODEL: self.model.model_name,
         }
@@ -1,7 +1,11 @@
 import torch
 import re
+from functools import partial
 from typing import Union
 from PIL import Image
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_inpaint import (
+    prepare_mask_and_masked_image,
+)
 
 from utilities.constants import BASE64IMAGE
 from utilities.constants import KEY_SEED
@@ -9,14 +13,23 @@ from utilities.constants import KEY_WIDTH
 from utilities.constants import KEY_HEIGHT
 from utilities.constants import KEY_STEPS
 from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import VALUE_INPAINT_MODE_CROP
+from utilities.constants import INPAINT_MAX_PIXELS
 from utilities.config import Config
 from utilities.logger import DummyLogger
-from utilities.memory import empty_memory_cache
+from utilities.memory import reclaim_memory_if_needed
 from utilities.model import Model
+from utilities.model import encode_prompt
 from utilities.times import get_epoch_now
+from utilities.times import DummySpanRecorder
+from utilities.times import SpanRecorder
 from utilities.images import image_to_base64
-from utilities.images import load_image
-from utilities.images import base64_to_image
+from utilities.images import crop_image
+from utilities.images import decode_image
+from utilities.image_processing import get_inpaint_sizes
+from utilities.image_processing import get_mask_boundary
+from utilities.image_processing import pad_image
+from utilities.image_processing import paste_with_feather
 
 
 class Inpainting:
@@ -96,6 +109,57 @@ class Inpainting:
 
         return None, torch.cat(concat_embeds, dim=1), None, torch.cat(neg_embeds, dim=1)
 
+    def __load_reference_image(
+        self, reference_image: str, is_crop_mode: bool, config: Config
+    ) -> Image.Image:
+        reference_image = decode_image(reference_image).convert("RGB")
+        if is_crop_mode:
+            # crop mode works on the native resolution
+            return reference_image
+        output_size, _, _ = get_inpaint_sizes(
+            reference_image.size,
+            (config.get_width(), config.get_height()),
+            INPAINT_MAX_PIXELS,
+        )
+        if output_size == reference_image.size:
+            return reference_image
+        return reference_image.resize(output_size, resample=Image.LANCZOS)
+
+    def __load_mask_image(self, mask_image: str, size: tuple) -> Image.Image:
+        mask_image = decode_image(mask_image).convert("RGB")
+        # assume mask image and reference image size ratio is the same
+        if mask_image.size[0] < size[0]:
+            mask_image = mask_image.resize(size)
+        elif mask_image.size[0] > size[0]:
+            mask_image = mask_image.resize(size, resample=Image.LANCZOS)
+        return mask_image
+
+    def __prepare_inputs(
+        self,
+        reference_image: Image.Image,
+        mask_image: Image.Image,
+        boundary: tuple,
+        content_size: tuple,
+        working_size: tuple,
+    ) -> tuple:
+        """
+        Gets (mask, masked image) tensors the way the pipeline prepares them, of the
+        region `boundary` in crop mode or of the whole image otherwise, scaled to
+        `content_size` and padded to `working_size`.
+        """
+        inpaint_image = reference_image
+        inpaint_mask = mask_image.convert("L")
+        if boundary:
+            inpaint_image = crop_image(inpaint_image, boundary)
+            inpaint_mask = crop_image(inpaint_mask, boundary)
+        if inpaint_image.size != content_size:
+            inpaint_image = inpaint_image.resize(content_size, resample=Image.LANCZOS)
+            inpaint_mask = inpaint_mask.resize(content_size)
+        # the padding is never masked, so it is only context for the model
+        inpaint_image = pad_image(inpaint_image, working_size)
+        inpaint_mask = pad_image(inpaint_mask, working_size, repeat_edge=False)
+        return prepare_mask_and_masked_image(inpaint_image, inpaint_mask)
+
     def lunch(
         self,
         prompt: str,
@@ -103,6 +167,7 @@ class Inpainting:
         reference_image: Union[Image.Image, None, str] = None,
         mask_image: Union[Image.Image, None, str] = None,
         config: Config = Config(),
+        spans: SpanRecorder = DummySpanRecorder(),
     ) -> dict:
         if not prompt:
             self.__logger.error("no prompt provided, won't proceed")
@@ -119,70 +184,130 @@ class Inpainting:
         generator = torch.Generator(self.__device).manual_seed(seed)
         self.__logger.info("current seed: {}".format(seed))
 
-        if isinstance(reference_image, str):
-            if "base64" in reference_image:
-                reference_image = base64_to_image(reference_image).convert("RGB")
-            else:
-                # is filepath
-                reference_image = load_image(reference_image).convert("RGB")
-            reference_image.thumbnail((config.get_width(), config.get_height()))
-
-        if isinstance(mask_image, str):
-            if "base64" in mask_image:
-                mask_image = base64_to_image(mask_image).convert("RGB")
-            else:
-                # is filepath
-                mask_image = load_image(mask_image).convert("RGB")
-            # assume mask image and reference image size ratio is the same
-            if mask_image.size[0] < reference_image.size[0]:
-                mask_image = mask_image.resize(reference_image.size)
-            elif mask_image.size[0] > reference_image.size[0]:
-                mask_image = mask_image.resize(
-                    reference_image.size, resample=Image.LANCZOS
+        is_crop_mode = config.get_inpaint_mode() == VALUE_INPAINT_MODE_CROP
+
+        # repeated edits of the same image skip decoding, resizing and preparing tensors
+        cache = self.model.reference_cache
+        reference_digest = cache.get_digest(reference_image)
+        mask_digest = cache.get_digest(mask_image)
+
+        with spans.span("decode_image"):
+            if isinstance(reference_image, str):
+                size = (config.get_width(), config.get_height())
+                load = partial(
+                    self.__load_reference_image, reference_image, is_crop_mode, config
+                )
+                reference_image = cache.get(
+                    "image", ("inpaint", reference_digest, is_crop_mode) + size, load
                 )
 
-        (
-            prompt,
-            prompt_embeds,
-            negative_prompt,
-            negative_prompt_embeds,
-        ) = self.__token_limit_workaround(prompt, negative_prompt)
-
-        result = self.model.inpaint_pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            prompt_embeds=prompt_embeds,
-            negative_prompt_embeds=negative_prompt_embeds,
-            image=reference_image.resize(
-                (512, 512)
-            ),  # must use size 512 for inpaint model
-            mask_image=mask_image.convert("L").resize(
-                (512, 512)
-            ),  # must use size 512 for inpaint model
-            guidance_scale=config.get_guidance_scale(),
-            num_inference_steps=config.get_steps(),
-            generator=generator,
-            callback=None,
-            callback_steps=10,
-        )
+            if isinstance(mask_image, str):
+                load = partial(self.__load_mask_image, mask_image, reference_image.size)
+                mask_image = cache.get(
+                    "image", ("inpaint_mask", mask_digest) + reference_image.size, load
+                )
 
-        # resize it back based on ratio (keep width 512)
-        result_img = result.images[0].resize(
-            (512, int(512 * reference_image.size[1] / reference_image.size[0]))
-        )
+        boundary = ()
+        if is_crop_mode:
+            # only inpaint the masked region, so the cost depends on the edit size
+            boundary = get_mask_boundary(mask_image)
+            if not boundary:
+                self.__logger.error("mask is empty, nothing to inpaint")
+                return {}
+            self.__logger.info(
+                f"inpainting region {boundary} of {reference_image.size}"
+            )
+            region_size = (boundary[2] - boundary[0], boundary[3] - boundary[1])
+            _, content_size, working_size = get_inpaint_sizes(
+                region_size, region_size, INPAINT_MAX_PIXELS
+            )
+            if content_size != region_size:
+                self.__logger.info(f"region too large, inpainting at {working_size}")
+        else:
+            # the image keeps its aspect ratio, padded to what the model takes
+            region_size = reference_image.size
+            _, content_size, working_size = get_inpaint_sizes(
+                region_size, region_size, INPAINT_MAX_PIXELS
+            )
+            self.__logger.info(f"inpainting {region_size} at {working_size}")
+
+        with spans.span("prepare_image"):
+            tensor_key = None
+            if reference_digest is not None and mask_digest is not None:
+                tensor_key = ("inpaint", reference_digest, mask_digest)
+                tensor_key += (reference_image.size, boundary, content_size)
+            prepare = partial(
+                self.__prepare_inputs,
+                reference_image,
+                mask_image,
+                boundary,
+                content_size,
+                working_size,
+            )
+            mask_tensor, masked_image_tensor = cache.get("tensor", tensor_key, prepare)
+
+        with spans.span("encode_prompt"):
+            (
+                prompt,
+                prompt_embeds,
+                negative_prompt,
+                negative_prompt_embeds,
+            ) = self.__token_limit_workaround(prompt, negative_prompt)
+            if prompt_embeds is None:
+                prompt_embeds, negative_prompt_embeds = encode_prompt(
+                    self.model.inpaint_pipeline, self.__device, prompt, negative_prompt
+                )
+                prompt, negative_prompt = None, None
+
+        # the inpaint pipeline of this diffusers version cannot return latents, so the
+        # VAE decode is part of this span
+        with spans.span("denoise"):
+            result = self.model.inpaint_pipeline(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                # masking an already masked image again changes nothing
+                image=masked_image_tensor,
+                mask_image=mask_tensor,
+                width=working_size[0],
+                height=working_size[1],
+                guidance_scale=config.get_guidance_scale(),
+                num_inference_steps=config.get_steps(),
+                generator=generator,
+                callback=None,
+                callback_steps=10,
+            )
+
+        with spans.span("postprocess"):
+            # drop the padding, and scale back only if the pixel budget scaled it down
+            result_img = result.images[0].crop((0, 0) + content_size)
+            if content_size != region_size:
+                result_img = result_img.resize(region_size, resample=Image.LANCZOS)
+            if is_crop_mode:
+                result_img = paste_with_feather(
+                    reference_image,
+                    result_img,
+                    crop_image(mask_image, boundary),
+                    boundary,
+                )
+            width, height = result_img.size
 
         if self.__output_folder:
             out_filepath = "{}/{}.png".format(self.__output_folder, t)
             result_img.save(out_filepath)
             self.__logger.info("output to file: {}".format(out_filepath))
 
-        empty_memory_cache()
+        reclaim_memory_if_needed()
+
+        with spans.span("png_encode"):
+            base64_image = image_to_base64(result_img)
 
         return {
-            BASE64IMAGE: image_to_base64(result_img),
+            BASE64IMAGE: base64_image,
             KEY_SEED: str(seed),
-            KEY_WIDTH: config.get_width(),
-            KEY_HEIGHT: config.get_height(),
+            KEY_WIDTH: width,
+            KEY_HEIGHT: height,
             KEY_STEPS: config.get_steps(),
             KEY_BASE_MODEL: self.model.inpainting_model_name,
         }
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+
+from utilities.config import Config
+from utilities.constants import KEY_BASE_MODEL
+from utilities.constants import KEY_GUIDANCE_SCALE
+from utilities.constants import KEY_HEIGHT
+from utilities.constants import KEY_INPAINT_MODE
+from utilities.constants import KEY_SCHEDULER
+from utilities.constants import KEY_STEPS
+from utilities.constants import KEY_STRENGTH
+from utilities.constants import KEY_TILE_BATCH_SIZE
+from utilities.constants import KEY_TILE_OVERLAP
+from utilities.constants import KEY_TILE_SIZE
+from utilities.constants import KEY_WIDTH
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_LANGUAGE
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_NEG_PROMPT
+from utilities.constants import KEY_PROMPT
+from utilities.constants import KEY_SEED
+from utilities.constants import MASK_IMG
+from utilities.constants import REFERENCE_IMG
+from utilities.constants import VALUE_JOB_IMG2IMG
+from utilities.constants import VALUE_JOB_INPAINTING
+from utilities.constants import VALUE_JOB_TXT2IMG
+from utilities.lora import normalize_lora_spec
+
+
+def hash_image(image: str) -> str:
+    """
+    Hashes a reference or mask image given as base64 string or filepath.
+    """
+    digest = hashlib.sha256()
+    if "base64" not in image and os.path.isfile(image):
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(image.encode())
+    return digest.hexdigest()
+
+
+def get_job_hash(job: dict) -> str:
+    """
+    Gets a canonical hash of everything that determines the output image of `job`, so that
+    identical jobs can share one result. The model is not part of it, compare the base
+    model of the result separately.
+
+    Returns "" if the output is not deterministic, i.e. no explicit seed, or not an image
+    generation job.
+    """
+    job_type = job.get(KEY_JOB_TYPE, "")
+    if job_type not in [VALUE_JOB_TXT2IMG, VALUE_JOB_IMG2IMG, VALUE_JOB_INPAINTING]:
+        return ""
+    try:
+        seed = int(job.get(KEY_SEED, 0) or 0)
+        if seed == 0:
+            return ""
+        params = _get_job_params(job, job_type, seed)
+    except (TypeError, ValueError):
+        # malformed values fail the job later on anyway
+        return ""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def _get_job_params(job: dict, job_type: str, seed: int) -> dict:
+    # normalized through Config so that an omitted key equals its default value
+    config = Config().set_config(job)
+    params = {
+        KEY_JOB_TYPE: job_type,
+        KEY_BASE_MODEL: job.get(KEY_BASE_MODEL, ""),
+        KEY_PROMPT: job.get(KEY_PROMPT, ""),
+        KEY_NEG_PROMPT: job.get(KEY_NEG_PROMPT, ""),
+        KEY_LANGUAGE: job.get(KEY_LANGUAGE, ""),
+        KEY_SEED: seed,
+        KEY_WIDTH: config.get_width(),
+        KEY_HEIGHT: config.get_height(),
+        KEY_STEPS: config.get_steps(),
+        KEY_SCHEDULER: config.get_scheduler(),
+        KEY_GUIDANCE_SCALE: config.get_guidance_scale(),
+    }
+    # only part of it if set, so that the hashes of jobs without adapters stay the same
+    lora_model = normalize_lora_spec(config.get_lora_model())
+    if lora_model:
+        params[KEY_LORA_MODEL] = lora_model
+    if job_type in [VALUE_JOB_IMG2IMG, VALUE_JOB_INPAINTING]:
+        params[KEY_STRENGTH] = config.get_strength()
+        params[REFERENCE_IMG] = hash_image(job.get(REFERENCE_IMG, ""))
+    if job_type == VALUE_JOB_IMG2IMG:
+        params[KEY_TILE_SIZE] = config.get_tile_size()
+        params[KEY_TILE_OVERLAP] = config.get_tile_overlap()
+        params[KEY_TILE_BATCH_SIZE] = config.get_tile_batch_size()
+    if job_type == VALUE_JOB_INPAINTING:
+        params[KEY_INPAINT_MODE] = config.get_inpaint_mode()
+        params[MASK_IMG] = hash_image(job.get(MASK_IMG, ""))
+    return params
@@ -0,0 +1,60 @@
+import unittest
+
+from utilities.constants import KEY_JOB_TYPE
+from utilities.constants import KEY_LORA_MODEL
+from utilities.constants import KEY_PROMPT
+from utilities.constants import KEY_SEED
+from utilities.constants import KEY_STEPS
+from utilities.constants import MASK_IMG
+from utilities.constants import REFERENCE_IMG
+from utilities.constants import VALUE_STEPS_DEFAULT
+from utilities.job_hash import get_job_hash
+
+
+class TestJobHash(unittest.TestCase):
+    def setUp(self):
+        self.job = {KEY_JOB_TYPE: "txt", KEY_PROMPT: "a cat", KEY_SEED: "42"}
+
+    def test_random_seed(self):
+        self.assertEqual(get_job_hash({**self.job, KEY_SEED: "0"}), "")
+        self.assertEqual(get_job_hash({KEY_JOB_TYPE: "txt", KEY_PROMPT: "a cat"}), "")
+        self.assertEqual(get_job_hash({**self.job, KEY_SEED: "abc"}), "")
+
+    def test_restoration(self):
+        self.assertEqual(get_job_hash({**self.job, KEY_JOB_TYPE: "restoration"}), "")
+
+    def test_canonical(self):
+        job_hash = get_job_hash(self.job)
+        self.assertTrue(job_hash)
+        self.assertEqual(get_job_hash({**self.job, KEY_SEED: 42}), job_hash)
+        self.assertEqual(
+            get_job_hash({**self.job, KEY_STEPS: str(VALUE_STEPS_DEFAULT)}), job_hash
+        )
+        self.assertNotEqual(get_job_hash({**self.job, KEY_STEPS: 20}), job_hash)
+        self.assertNotEqual(get_job_hash({**self.job, KEY_PROMPT: "a dog"}), job_hash)
+
+    def test_images(self):
+        job = {
+            **self.job,
+            KEY_JOB_TYPE: "inpaint",
+            REFERENCE_IMG: "data:image/png;base64,AAAA",
+            MASK_IMG: "data:image/png;base64,BBBB",
+        }
+        job_hash = get_job_hash(job)
+        self.assertEqual(get_job_hash(dict(job)), job_hash)
+        self.assertNotEqual(
+            get_job_hash({**job, MASK_IMG: "data:image/png;base64,CCCC"}), job_hash
+        )
+        self.assertNotEqual(get_job_hash({**job, KEY_JOB_TYPE: "img"}), job_hash)
+
+    def test_lora_model(self):
+        job_hash = get_job_hash(self.job)
+        self.assertEqual(get_job_hash({**self.job, KEY_LORA_MODEL: ""}), job_hash)
+        lora_hash = get_job_hash({**self.job, KEY_LORA_MODEL: "b:0.5,a"})
+        self.assertNotEqual(lora_hash, job_hash)
+        self.assertEqual(get_job_hash({**self.job, KEY_LORA_MODEL: "a:1, b:.5"}), lora_hash)
+        self.assertEqual(get_job_hash({**self.job, KEY_LORA_MODEL: "../a"}), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage
+
+
+RATE_LIMITS_TABLE_NAME = "rate_limits"
+
+
+class SQLiteStorage(Storage):
+    """
+    Rate limit storage for `limits` (and so `flask_limiter`) backed by a SQLite file, so
+    that every worker process of the frontend shares the same counters.
+
+    Importing this module registers the `sqlite:///path/to/file.db` storage URI.
+    Only the fixed window strategy is supported.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.__db_filepath = uri[len("sqlite://") :]
+        self.__local = threading.local()
+        c = self.__get_connection()
+        c.execute(
+            f"CREATE TABLE IF NOT EXISTS {RATE_LIMITS_TABLE_NAME} "
+            "(key TEXT PRIMARY KEY, count INTEGER, expiry REAL)"
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def __get_connection(self) -> sqlite3.Connection:
+        # one connection per thread and per process, never carried across a fork
+        if getattr(self.__local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(
+                self.__db_filepath, timeout=10, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return self.__local.connection
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        c = self.__get_connection()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(
+                f"SELECT count, expiry FROM {RATE_LIMITS_TABLE_NAME} WHERE key=?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                count, expires_at = amount, now + expiry
+            else:
+                count = row[0] + amount
+                expires_at = now + expiry if elastic_expiry else row[1]
+            c.execute(
+                f"INSERT OR REPLACE INTO {RATE_LIMITS_TABLE_NAME} (key, count, expiry) VALUES (?, ?, ?)",
+                (key, count, expires_at),
+            )
+            # drop expired windows once in a while so the table stays small
+            if random.random() < 0.01:
+                c.execute(
+                    f"DELETE FROM {RATE_LIMITS_TABLE_NAME} WHERE expiry <= ?", (now,)
+                )
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return count
+
+    def get(self, key: str) -> int:
+        row = (
+            self.__get_connection()
+            .execute(
+                f"SELECT count FROM {RATE_LIMITS_TABLE_NAME} WHERE key=? AND expiry > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return 0 if row is None else row[0]
+
+    def get_expiry(self, key: str) -> float:
+        row = (
+            self.__get_connection()
+            .execute(f"SELECT expiry FROM {RATE_LIMITS_TABLE_NAME} WHERE key=?", (key,))
+            .fetchone()
+        )
+        return time.time() if row is None else row[0]
+
+    def check(self) -> bool:
+        try:
+            self.__get_connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        return (
+            self.__get_connection()
+            .execute(f"DELETE FROM {RATE_LIMITS_TABLE_NAME}")
+            .rowcount
+        )
+
+    def clear(self, key: str):
+        self.__get_connection().execute(
+            f"DELETE FROM {RATE_LIMITS_TABLE_NAME} WHERE key=?", (key,)
+        )
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from utilities.limiter_storage import SQLiteStorage
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def setUp(self):
+        self.db_filepath = tempfile.mktemp(suffix=".limits")
+        self.uri = f"sqlite:///{self.db_filepath}"
+
+    def test_registered(self):
+        self.assertTrue(isinstance(storage_from_string(self.uri), SQLiteStorage))
+
+    def test_counters(self):
+        storage = SQLiteStorage(self.uri)
+        self.assertTrue(storage.check())
+        self.assertEqual(storage.get("a"), 0)
+        self.assertEqual(storage.incr("a", 60), 1)
+        self.assertEqual(storage.incr("a", 60, amount=2), 3)
+        self.assertEqual(storage.get("a"), 3)
+        self.assertTrue(storage.get_expiry("a") > 0)
+        storage.clear("a")
+        self.assertEqual(storage.get("a"), 0)
+
+        self.assertEqual(storage.incr("b", 0), 1)
+        # already expired, starts over
+        self.assertEqual(storage.incr("b", 60), 1)
+        self.assertTrue(storage.reset() >= 1)
+
+    def test_shared_between_instances(self):
+        limit = RateLimitItemPerMinute(100)
+        limiters = [FixedWindowRateLimiter(SQLiteStorage(self.uri)) for _ in range(4)]
+
+        def hit(limiter):
+            for _ in range(50):
+                limiter.hit(limit, "client")
+
+        threads = [threading.Thread(target=hit, args=(limiter,)) for limiter in limiters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # every hit of every instance is counted in the same window
+        self.assertEqual(SQLiteStorage(self.uri).get(limit.key_for("client")), 200)
+        self.assertFalse(limiters[0].test(limit, "client"))
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.isfile(self.db_filepath + suffix):
+                os.remove(self.db_filepath + suffix)
+
+
+if __name__ == "__main__":
+    unittest.main()
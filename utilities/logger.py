@@ -1,14 +1,38 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
 import traceback
 from colorlog import ColoredFormatter
 
 
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, with the fields of set_log_context()
+    at the time it was logged.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        return json.dumps(entry, ensure_ascii=False)
+
+
 FORMATTER_STREAM = ColoredFormatter(
     "%(asctime)s %(log_color)s%(levelname)-.1s[%(name)s] %(message)s%(reset)s"
 )
 FORMATTER_FILE = logging.Formatter("%(asctime)s %(levelname)-.1s. %(message)s")
+FORMATTER_JSON = JsonLinesFormatter()
 
 VERBOSITY_V = 10
 VERBOSITY_VV = 100
@@ -37,6 +61,120 @@ def get_func_name(offset: int = 0):
     return sys._getframe(1 + offset).f_code.co_name
 
 
+_context = threading.local()
+
+
+def set_log_context(**fields):
+    """
+    Sets fields, e.g. job_uuid and stage, that the JSON lines formatter adds to every
+    message logged by the calling thread afterwards. A field set to None is removed.
+    """
+    context = dict(getattr(_context, "fields", {}))
+    context.update(fields)
+    _context.fields = {key: value for key, value in context.items() if value is not None}
+
+
+def clear_log_context():
+    _context.fields = {}
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attaches the fields of set_log_context() to records, on the thread that logs them.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = getattr(_context, "fields", {})
+        return True
+
+
+class QueueLogging:
+    """
+    The queue and the listener thread that do the formatting and I/O of all Loggers in
+    queue mode, see configure_logging(). The thread is restarted in forked processes.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__listener = None
+        self.queue = None
+        self.sinks = {}  # id of a Logger -> its stream and file handlers
+
+    def ensure_started(self):
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            # a forked child has a copy of the queue but not the listener thread
+            self.queue = queue.SimpleQueue()
+            self.__listener = logging.handlers.QueueListener(
+                self.queue, SinkHandler(self.sinks)
+            )
+            self.__listener.start()
+            self.__pid = os.getpid()
+
+    def stop(self):
+        """Stops the listener after it handled everything queued so far"""
+        with self.__lock:
+            if self.__pid == os.getpid():
+                self.__listener.stop()
+            self.__pid = None
+
+
+class SinkHandler(logging.Handler):
+    """
+    Hands a dequeued record to the handlers of the Logger that queued it.
+    """
+
+    def __init__(self, sinks: dict):
+        super().__init__()
+        self.__sinks = sinks
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.__sinks.get(getattr(record, "sink", None), []):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LoggerQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue_logging: QueueLogging, sink: int):
+        super().__init__(None)
+        self.__queue_logging = queue_logging
+        self.__sink = sink
+
+    def enqueue(self, record: logging.LogRecord):
+        self.__queue_logging.ensure_started()
+        record.sink = self.__sink
+        self.__queue_logging.queue.put_nowait(record)
+
+
+_queue_logging = QueueLogging()
+_loggers = []  # every Logger, configure_logging() applies to all of them
+_options = {"use_queue": False, "json_lines": False}
+
+
+def configure_logging(use_queue: bool = False, json_lines: bool = False):
+    """
+    Configures every Logger, including the ones created later on.
+
+    @param use_queue: log calls only put records into a queue, a background thread does
+        the formatting and the writing to the terminal and files.
+    @param json_lines: format messages as JSON lines, see JsonLinesFormatter.
+    """
+    if _options["use_queue"] and not use_queue:
+        # drain what is queued before the handlers are used directly again
+        _queue_logging.stop()
+    _options["use_queue"] = use_queue
+    _options["json_lines"] = json_lines
+    for logger in _loggers:
+        logger.apply_options()
+
+
+atexit.register(_queue_logging.stop)
+
+
 class DummyLogger:
     """
     DummyLogger does not do anything.
@@ -92,23 +230,50 @@ class Logger(DummyLogger):
         self.verbosity = verbosity
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
+        self.logger.addFilter(ContextFilter())
 
         self.__streamHandler = logging.StreamHandler()
         self.__streamHandler.setLevel(stream_lvl)
-        self.__streamHandler.setFormatter(FORMATTER_STREAM)
-        self.logger.addHandler(self.__streamHandler)
 
         self.__fileHandler = None
         if filepath and touch(filepath):
             file_handler = logging.FileHandler(filepath)
             file_handler.setLevel(file_lvl)
-            file_handler.setFormatter(FORMATTER_FILE)
             self.__fileHandler = file_handler
-            self.logger.addHandler(self.__fileHandler)
+
+        self.__queueHandler = LoggerQueueHandler(_queue_logging, id(self))
+        self.apply_options()
+        _loggers.append(self)
 
         self.logger.debug("log for {} started".format(name))
         self.logger.info("log output filepath: {}".format(filepath))
 
+    def apply_options(self):
+        """
+        Attaches the handlers to the logger directly or behind the queue, with the
+        formatters chosen by configure_logging().
+        """
+        handlers = [self.__streamHandler]
+        if self.__fileHandler is not None:
+            handlers.append(self.__fileHandler)
+        self.__streamHandler.setFormatter(
+            FORMATTER_JSON if _options["json_lines"] else FORMATTER_STREAM
+        )
+        if self.__fileHandler is not None:
+            self.__fileHandler.setFormatter(
+                FORMATTER_JSON if _options["json_lines"] else FORMATTER_FILE
+            )
+
+        for handler in handlers + [self.__queueHandler]:
+            self.logger.removeHandler(handler)
+        if _options["use_queue"]:
+            _queue_logging.sinks[id(self)] = handlers
+            self.logger.addHandler(self.__queueHandler)
+        else:
+            _queue_logging.sinks.pop(id(self), None)
+            for handler in handlers:
+                self.logger.addHandler(handler)
+
     def get_verbosity_value(self) -> int:
         return self.verbosity
 
@@ -117,15 +282,18 @@ class Logger(DummyLogger):
 
     def set_log_output_filepath(self, filepath: str, level=logging.DEBUG):
         # remove prior one if any, only one handler would be allowed at a time
-        if self.__fileHandler is not None:
-            self.logger.removeHandler(self.__fileHandler)
-            self.__fileHandler.close()
+        prior_file_handler = self.__fileHandler
+        if prior_file_handler is not None:
+            self.logger.removeHandler(prior_file_handler)
+            self.__fileHandler = None
         if filepath and touch(filepath):
             file_handler = logging.FileHandler(filepath)
             file_handler.setLevel(level)
-            file_handler.setFormatter(FORMATTER_FILE)
             self.__fileHandler = file_handler
-            self.logger.addHandler(self.__fileHandler)
+        self.apply_options()
+        if prior_file_handler is not None:
+            # only after the listener thread got the new handlers
+            prior_file_handler.close()
 
     def debugging_on(self):
         self.__streamHandler.setLevel(logging.DEBUG)
@@ -1,7 +1,13 @@
+import json
 import os
+import tempfile
+import threading
 import unittest
 
 from utilities.logger import Logger
+from utilities.logger import clear_log_context
+from utilities.logger import configure_logging
+from utilities.logger import set_log_context
 
 
 class TestLogger(unittest.TestCase):
@@ -24,6 +30,37 @@ class TestLogger(unittest.TestCase):
 
         self.assertTrue(os.path.isfile(self.log_filepath))
 
+    def test_queue_json_lines(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filepath = os.path.join(folder, "queue.log")
+            logger = Logger(name="queue_test", filepath=filepath)
+            configure_logging(use_queue=True, json_lines=True)
+            try:
+                set_log_context(job_uuid="abc", stage="denoise")
+                logger.info("from the job")
+                set_log_context(stage=None)
+                logger.warn("after the stage")
+                clear_log_context()
+                # the context belongs to the thread that logs
+                thread = threading.Thread(target=logger.info, args=("elsewhere",))
+                thread.start()
+                thread.join()
+            finally:
+                # drains the queue
+                configure_logging()
+
+            with open(filepath) as f:
+                # the lines logged before are plain text
+                entries = [json.loads(line) for line in f.readlines()[-3:]]
+            self.assertEqual(entries[0]["message"], "[test_queue_json_lines] from the job")
+            self.assertEqual(entries[0]["job_uuid"], "abc")
+            self.assertEqual(entries[0]["stage"], "denoise")
+            self.assertEqual(entries[1]["level"], "WARNING")
+            self.assertEqual(entries[1]["job_uuid"], "abc")
+            self.assertNotIn("stage", entries[1])
+            self.assertNotIn("job_uuid", entries[2])
+            self.assertEqual(entries[2]["name"], "queue_test")
+
     @classmethod
     def tearDownClass(self):
         if os.path.isfile(self.log_filepath):
@@ -0,0 +1,146 @@
+import math
+import os
+import re
+
+from utilities.constants import MAX_LORA_ADAPTERS
+from utilities.constants import MAX_LORA_WEIGHT
+
+
+LORA_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+LORA_FILE_EXTENSIONS = [".safetensors", ".bin", ".pt"]
+
+# modules the diffusers LoRA attention processors target, per component
+DIFFUSERS_LORA_MODULES = {
+    "unet": {"to_q": "to_q", "to_k": "to_k", "to_v": "to_v", "to_out": "to_out.0"},
+    "text_encoder": {
+        "to_q": "q_proj",
+        "to_k": "k_proj",
+        "to_v": "v_proj",
+        "to_out": "out_proj",
+    },
+}
+KOHYA_PREFIXES = {"lora_unet_": "unet", "lora_te_": "text_encoder"}
+
+
+def parse_lora_spec(text: str) -> tuple:
+    """
+    Parses the lora_model of a job, adapter names with optional weights such as
+    "add_detail:0.5,film_grain", into ((name, weight), ...) sorted by name, so that the
+    same adapter set always gives the same tuple. Weights default to 1.0, adapters
+    weighted 0 are left out.
+
+    Raises ValueError if `text` is malformed.
+    """
+    adapters = {}
+    for item in str(text or "").split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(":")
+        name = name.strip()
+        if not LORA_NAME_PATTERN.match(name) or ".." in name:
+            raise ValueError(f"invalid lora adapter name {name!r}")
+        if name in adapters:
+            raise ValueError(f"lora adapter {name} given more than once")
+        weight = float(weight) if weight.strip() else 1.0
+        if not math.isfinite(weight) or abs(weight) > MAX_LORA_WEIGHT:
+            raise ValueError(
+                f"weight of lora adapter {name} not within {-MAX_LORA_WEIGHT:g}"
+                f" and {MAX_LORA_WEIGHT:g}"
+            )
+        if weight:
+            adapters[name] = weight
+    if len(adapters) > MAX_LORA_ADAPTERS:
+        raise ValueError(f"at most {MAX_LORA_ADAPTERS} lora adapters per job")
+    return tuple(sorted(adapters.items()))
+
+
+def format_lora_spec(adapters: tuple) -> str:
+    """Formats what parse_lora_spec() returns back into a lora_model string"""
+    return ",".join(f"{name}:{weight:g}" for name, weight in adapters)
+
+
+def normalize_lora_spec(text: str) -> str:
+    """
+    Gets the canonical form of the lora_model `text`, "" for no adapters.
+
+    Raises ValueError if `text` is malformed.
+    """
+    return format_lora_spec(parse_lora_spec(text))
+
+
+def get_lora_filepath(folderpath: str, name: str) -> str:
+    """
+    Finds the file of the adapter `name` in `folderpath`, either <name>.<extension> or
+    the pytorch_lora_weights file diffusers saves into the folder <name>.
+
+    Returns "" if there is none.
+    """
+    if not folderpath:
+        return ""
+    filepaths = [
+        os.path.join(folderpath, name),
+        os.path.join(folderpath, name, "pytorch_lora_weights"),
+    ]
+    for filepath in filepaths:
+        for extension in LORA_FILE_EXTENSIONS:
+            if os.path.isfile(filepath + extension):
+                return filepath + extension
+    return ""
+
+
+def parse_lora_key(key: str) -> tuple:
+    """
+    Splits a key of a LoRA state dict into (component, module key, part), where the
+    component is "unet" or "text_encoder", the module key is the path of the module in
+    it with "_" instead of "." and the part is "down", "up" or "alpha".
+
+    Understands the keys diffusers saves, e.g.
+    "unet.mid_block.attentions.0.transformer_blocks.0.attn1.processor.to_q_lora.up.weight",
+    and the ones of kohya's scripts, e.g.
+    "lora_unet_mid_block_attentions_0_proj_in.lora_down.weight".
+
+    Returns None for keys that are neither.
+    """
+    for prefix, component in KOHYA_PREFIXES.items():
+        if key.startswith(prefix):
+            module, _, part = key[len(prefix) :].partition(".")
+            part = {
+                "lora_down.weight": "down",
+                "lora_up.weight": "up",
+                "alpha": "alpha",
+            }.get(part, "")
+            return (component, module, part) if module and part else None
+
+    match = re.match(
+        r"^(?:(unet|text_encoder)\.)?(.+?)\.(?:processor\.)?"
+        r"(to_q|to_k|to_v|to_out)_lora\.(down|up)\.weight$",
+        key,
+    )
+    if match is None:
+        return None
+    component, path, target, part = match.groups()
+    component = component or "unet"
+    module = f"{path}.{DIFFUSERS_LORA_MODULES[component][target]}"
+    return component, module.replace(".", "_"), part
+
+
+def group_lora_state_dict(state_dict: dict) -> dict:
+    """
+    Groups the tensors of a LoRA state dict by the module they change.
+
+    Returns {(component, module key): {"down": ..., "up": ..., "alpha": ...}} with
+    "alpha" only where given, leaving out keys parse_lora_key() does not understand
+    and modules missing either factor.
+    """
+    groups = {}
+    for key, value in state_dict.items():
+        parsed = parse_lora_key(key)
+        if parsed is None:
+            continue
+        component, module, part = parsed
+        groups.setdefault((component, module), {})[part] = value
+    return {
+        target: factors
+        for target, factors in groups.items()
+        if "down" in factors and "up" in factors
+    }
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from utilities.lora import format_lora_spec
+from utilities.lora import get_lora_filepath
+from utilities.lora import group_lora_state_dict
+from utilities.lora import normalize_lora_spec
+from utilities.lora import parse_lora_key
+from utilities.lora import parse_lora_spec
+
+
+class TestLoraSpec(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_lora_spec(""), ())
+        self.assertEqual(parse_lora_spec(None), ())
+        self.assertEqual(
+            parse_lora_spec("film_grain, add_detail:0.5"),
+            (("add_detail", 0.5), ("film_grain", 1.0)),
+        )
+        self.assertEqual(parse_lora_spec("a:0,b:-1"), (("b", -1.0),))
+
+    def test_invalid(self):
+        for text in ["../a", "a/b", ".a", "a:x", "a:3", "a:nan", "a,a", "a,b,c,d,e"]:
+            with self.assertRaises(ValueError, msg=text):
+                parse_lora_spec(text)
+
+    def test_normalize(self):
+        self.assertEqual(normalize_lora_spec("b:.50,a"), "a:1,b:0.5")
+        self.assertEqual(normalize_lora_spec("a:0"), "")
+        self.assertEqual(
+            format_lora_spec(parse_lora_spec("a:1,b:0.5")), normalize_lora_spec("b:0.5,a")
+        )
+
+    def test_get_lora_filepath(self):
+        with tempfile.TemporaryDirectory() as folderpath:
+            self.assertEqual(get_lora_filepath(folderpath, "a"), "")
+            filepath = os.path.join(folderpath, "a.safetensors")
+            open(filepath, "wb").close()
+            self.assertEqual(get_lora_filepath(folderpath, "a"), filepath)
+            os.makedirs(os.path.join(folderpath, "b"))
+            filepath = os.path.join(folderpath, "b", "pytorch_lora_weights.bin")
+            open(filepath, "wb").close()
+            self.assertEqual(get_lora_filepath(folderpath, "b"), filepath)
+        self.assertEqual(get_lora_filepath("", "a"), "")
+
+
+class TestLoraKeys(unittest.TestCase):
+    def test_diffusers(self):
+        self.assertEqual(
+            parse_lora_key(
+                "mid_block.attentions.0.transformer_blocks.0.attn1.processor.to_out_lora.up.weight"
+            ),
+            ("unet", "mid_block_attentions_0_transformer_blocks_0_attn1_to_out_0", "up"),
+        )
+        self.assertEqual(
+            parse_lora_key(
+                "text_encoder.text_model.encoder.layers.0.self_attn.to_q_lora.down.weight"
+            ),
+            ("text_encoder", "text_model_encoder_layers_0_self_attn_q_proj", "down"),
+        )
+
+    def test_kohya(self):
+        self.assertEqual(
+            parse_lora_key("lora_unet_mid_block_attentions_0_proj_in.lora_down.weight"),
+            ("unet", "mid_block_attentions_0_proj_in", "down"),
+        )
+        self.assertEqual(
+            parse_lora_key("lora_te_text_model_encoder_layers_0_mlp_fc1.alpha"),
+            ("text_encoder", "text_model_encoder_layers_0_mlp_fc1", "alpha"),
+        )
+        self.assertIsNone(parse_lora_key("lora_unet_proj_in.hada_w1_a"))
+        self.assertIsNone(parse_lora_key("unet.conv_in.weight"))
+
+    def test_group(self):
+        groups = group_lora_state_dict(
+            {
+                "lora_unet_proj_in.lora_down.weight": "down",
+                "lora_unet_proj_in.lora_up.weight": "up",
+                "lora_unet_proj_in.alpha": "alpha",
+                "lora_unet_proj_out.lora_down.weight": "down only",
+                "something_else": "ignored",
+            }
+        )
+        self.assertEqual(
+            groups, {("unet", "proj_in"): {"down": "down", "up": "up", "alpha": "alpha"}}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
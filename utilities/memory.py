@@ -2,6 +2,13 @@ import gc
 import torch
 
 
+# fraction of the total memory used as high-water mark if none is set
+DEFAULT_HIGH_WATER_FRACTION = 0.8
+
+_high_water_marks = {"rss": 0, "device": 0}  # bytes, 0 for the default fraction
+_reclaim_counts = {"gc": 0, "device": 0}
+
+
 def empty_memory_cache():
     """
     Performs garbage collection and empty cache in cuda device.
@@ -15,3 +22,99 @@ def tune_for_low_memory():
     Tunes PyTorch to use float16 to reduce memory footprint.
     """
     torch.set_default_dtype(torch.float16)
+
+
+def read_proc_bytes(filepath: str, key: str) -> int:
+    """
+    Reads a value given in kB, e.g. "VmHWM:  1234 kB", from a /proc file in bytes.
+    Returns 0 if unavailable, e.g. not on Linux.
+    """
+    try:
+        with open(filepath) as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def get_rss_bytes() -> int:
+    return read_proc_bytes("/proc/self/status", "VmRSS")
+
+
+def set_high_water_marks(rss_bytes: int = 0, device_bytes: int = 0):
+    """
+    Sets above which usage reclaim_memory_if_needed() collects garbage and releases
+    the cached device memory, 0 for DEFAULT_HIGH_WATER_FRACTION of the total memory.
+    """
+    _high_water_marks["rss"] = rss_bytes
+    _high_water_marks["device"] = device_bytes
+
+
+def get_high_water_marks() -> tuple:
+    """
+    Returns (rss_bytes, device_bytes), 0 if the total memory is unknown.
+    """
+    rss_bytes = _high_water_marks["rss"]
+    if not rss_bytes:
+        total = read_proc_bytes("/proc/meminfo", "MemTotal")
+        rss_bytes = int(total * DEFAULT_HIGH_WATER_FRACTION)
+    device_bytes = _high_water_marks["device"]
+    if not device_bytes and torch.cuda.is_available():
+        total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        device_bytes = int(total * DEFAULT_HIGH_WATER_FRACTION)
+    return rss_bytes, device_bytes
+
+
+def reclaim_memory_if_needed(force: bool = False) -> list:
+    """
+    Collects garbage only if the resident memory is above its high-water mark, and
+    releases the cached device memory only if the memory reserved on the device is.
+    `force` does both regardless, e.g. after running out of memory.
+
+    Returns what ran, "gc" and/or "device".
+    """
+    rss_bytes, device_bytes = get_high_water_marks()
+    reclaimed = []
+    if force or (rss_bytes and get_rss_bytes() > rss_bytes):
+        gc.collect()
+        reclaimed.append("gc")
+    if torch.cuda.is_available() and (
+        force or (device_bytes and torch.cuda.memory_reserved() > device_bytes)
+    ):
+        if not reclaimed:
+            # tensors kept alive by reference cycles hold on to device memory
+            gc.collect()
+        torch.cuda.empty_cache()
+        reclaimed.append("device")
+    for kind in reclaimed:
+        _reclaim_counts[kind] += 1
+    return reclaimed
+
+
+def get_reclaim_counts() -> dict:
+    """Returns how often reclaim_memory_if_needed() ran "gc" and "device" so far"""
+    return dict(_reclaim_counts)
+
+
+def reset_peak_memory():
+    """
+    Resets the peaks get_peak_memory() reports, e.g. before a job starts.
+    """
+    try:
+        # resets VmHWM to the current resident memory
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def get_peak_memory() -> tuple:
+    """
+    Returns (rss_bytes, device_bytes), the peaks since reset_peak_memory(), 0 if unknown.
+    """
+    device_bytes = torch.cuda.max_memory_reserved() if torch.cuda.is_available() else 0
+    return read_proc_bytes("/proc/self/status", "VmHWM"), device_bytes
@@ -0,0 +1,236 @@
+import atexit
+import sqlite3
+import threading
+import time
+
+from utilities.connections import ThreadConnections
+from utilities.logger import DummyLogger
+
+
+METRICS_TABLE_NAME = "metrics"
+
+# upper bounds of the histogram buckets, in seconds
+SECONDS_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+METRIC_HELPS = {
+    "sd_jobs": "Jobs in the queue by status and type.",
+    "sd_queue_wait_seconds": "Seconds jobs waited before the backend picked them.",
+    "sd_job_exec_seconds": "Seconds the backend spent on a job.",
+    "sd_images_total": "Images finished, rate() gives images per second.",
+    "sd_jobs_failed_total": "Jobs that failed.",
+    "sd_translation_seconds": "Seconds spent translating a prompt.",
+    "sd_model_load_seconds": "Seconds spent loading models.",
+    "sd_model_switch_seconds": "Seconds spent switching base models between jobs.",
+    "sd_cache_requests_total": "Cache lookups by cache and result, hit or miss.",
+    "sd_job_peak_rss_bytes": "Peak resident memory of the backend during the last job.",
+    "sd_job_peak_device_bytes": "Peak device memory reserved during the last job.",
+    "sd_memory_reclaims_total": "Garbage collections and device cache releases.",
+}
+
+
+def format_labels(labels: dict) -> str:
+    """Formats labels the way Prometheus expects them between curly braces"""
+    escaped = {
+        key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for key, value in labels.items()
+    }
+    return ",".join(f'{key}="{escaped[key]}"' for key in sorted(escaped))
+
+
+def get_series(name: str, labels: str) -> str:
+    return f"{name}{{{labels}}}" if labels else name
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms shared by every process connected to the same file, so that
+    the frontend can serve what the backend measured.
+
+    Updates are aggregated in memory and added to the SQLite file at most every
+    `flush_seconds`, so recording a value never waits for the disk. Until connect() is
+    called they are only kept in memory.
+    """
+
+    def __init__(
+        self,
+        flush_seconds: float = 5.0,
+        logger: DummyLogger = DummyLogger(),
+        timeout_seconds: float = 10,
+    ):
+        self.__db_filepath = ""
+        self.__flush_seconds = flush_seconds
+        self.__timeout_seconds = timeout_seconds
+        self.__logger = logger
+        self.__lock = threading.Lock()
+        # one connection per thread and per process, closed when its thread exits
+        self.__connections = ThreadConnections(self.__connect)
+        self.__pending = {}  # (name, kind, labels, le) -> value not flushed yet
+        self.__totals = {}  # the same as the store holds, until connected
+        self.__flushed_at = time.monotonic()
+        self.__caches = {}  # name -> [cache, hits flushed, misses flushed]
+
+    def connect(self, db_filepath: str):
+        """Shares the metrics through the SQLite file `db_filepath`, created if missing"""
+        self.__db_filepath = db_filepath
+        self.__get_connection().execute(
+            f"CREATE TABLE IF NOT EXISTS {METRICS_TABLE_NAME} (name TEXT, kind TEXT,"
+            " labels TEXT, le TEXT, value REAL, PRIMARY KEY (name, labels, le))"
+        )
+        atexit.register(self.flush)
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.__db_filepath,
+            timeout=self.__timeout_seconds,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def __get_connection(self) -> sqlite3.Connection:
+        return self.__connections.get()
+
+    def __add(self, name: str, kind: str, labels: dict, le: str, value: float):
+        key = (name, kind, format_labels(labels), le)
+        self.__pending[key] = self.__pending.get(key, 0) + value
+
+    def inc(self, name: str, labels: dict = {}, value: float = 1):
+        """Adds `value` to the counter `name`"""
+        with self.__lock:
+            self.__add(name, "counter", labels, "", value)
+        self.flush_if_due()
+
+    def set(self, name: str, value: float, labels: dict = {}):
+        """Sets the gauge `name` to `value`"""
+        with self.__lock:
+            self.__pending[(name, "gauge", format_labels(labels), "")] = value
+        self.flush_if_due()
+
+    def observe(self, name: str, value: float, labels: dict = {}):
+        """Records `value` in the histogram `name`"""
+        with self.__lock:
+            le = next(
+                (str(bound) for bound in SECONDS_BUCKETS if value <= bound), "+Inf"
+            )
+            self.__add(name, "histogram", labels, le, 1)
+            self.__add(name, "histogram", labels, "sum", value)
+            self.__add(name, "histogram", labels, "count", 1)
+        self.flush_if_due()
+
+    def watch_cache(self, name: str, cache):
+        """Reports the hits and misses of a TTLCache as sd_cache_requests_total"""
+        with self.__lock:
+            self.__caches[name] = [cache, cache.hits, cache.misses]
+
+    def flush_if_due(self):
+        if time.monotonic() - self.__flushed_at >= self.__flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Adds everything recorded since the last flush to the shared store"""
+        with self.__lock:
+            self.__flushed_at = time.monotonic()
+            for name, watched in self.__caches.items():
+                cache, hits, misses = watched
+                watched[1:] = [cache.hits, cache.misses]
+                deltas = [("hit", cache.hits - hits), ("miss", cache.misses - misses)]
+                for result, value in deltas:
+                    if value:
+                        self.__add(
+                            "sd_cache_requests_total",
+                            "counter",
+                            {"cache": name, "result": result},
+                            "",
+                            value,
+                        )
+            pending = self.__pending
+            self.__pending = {}
+            if not self.__db_filepath:
+                for key, value in pending.items():
+                    if key[1] == "gauge":
+                        self.__totals[key] = value
+                    else:
+                        self.__totals[key] = self.__totals.get(key, 0) + value
+        if not pending or not self.__db_filepath:
+            return
+
+        query = (
+            f"INSERT INTO {METRICS_TABLE_NAME} (name, kind, labels, le, value)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (name, labels, le) DO UPDATE SET value = "
+        )
+        c = None
+        try:
+            c = self.__get_connection()
+            c.execute("BEGIN IMMEDIATE")
+            c.executemany(
+                query + "value + excluded.value",
+                [key + (value,) for key, value in pending.items() if key[1] != "gauge"],
+            )
+            c.executemany(
+                query + "excluded.value",
+                [key + (value,) for key, value in pending.items() if key[1] == "gauge"],
+            )
+            c.execute("COMMIT")
+        except sqlite3.Error as e:
+            # e.g. locked past the timeout, then BEGIN failed and there is nothing to undo
+            if c is not None and c.in_transaction:
+                try:
+                    c.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            self.__logger.warn(f"failed to flush metrics, retrying later: {e}")
+            # keep the values for the next flush, unless newer ones were recorded
+            with self.__lock:
+                for key, value in pending.items():
+                    if key[1] == "gauge":
+                        self.__pending.setdefault(key, value)
+                    else:
+                        self.__pending[key] = self.__pending.get(key, 0) + value
+
+    def __get_rows(self) -> list:
+        if self.__db_filepath:
+            query = f"SELECT name, kind, labels, le, value FROM {METRICS_TABLE_NAME}"
+            return self.__get_connection().execute(query).fetchall()
+        with self.__lock:
+            return [key + (value,) for key, value in self.__totals.items()]
+
+    def render(self, gauges: dict = {}) -> str:
+        """
+        Renders all metrics of the store plus `gauges`, {name: [(labels, value)]} measured
+        by the caller, in the Prometheus text format.
+        """
+        self.flush()
+
+        metrics = {}  # name -> (kind, {labels: {le: value}})
+        for name, kind, labels, le, value in self.__get_rows():
+            series = metrics.setdefault(name, (kind, {}))[1]
+            series.setdefault(labels, {})[le] = value
+        for name, samples in gauges.items():
+            series = metrics.setdefault(name, ("gauge", {}))[1]
+            for labels, value in samples:
+                series[format_labels(labels)] = {"": value}
+
+        lines = []
+        for name in sorted(metrics):
+            kind, series = metrics[name]
+            if name in METRIC_HELPS:
+                lines.append(f"# HELP {name} {METRIC_HELPS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels in sorted(series):
+                values = series[labels]
+                if kind != "histogram":
+                    lines.append(f"{get_series(name, labels)} {values['']:g}")
+                    continue
+                cumulative = 0
+                for bound in [str(bound) for bound in SECONDS_BUCKETS] + ["+Inf"]:
+                    cumulative += values.get(bound, 0)
+                    bucket_labels = ",".join(filter(None, [labels, f'le="{bound}"']))
+                    lines.append(
+                        f"{get_series(name + '_bucket', bucket_labels)} {cumulative:g}"
+                    )
+                for suffix in ["sum", "count"]:
+                    series_name = get_series(f"{name}_{suffix}", labels)
+                    lines.append(f"{series_name} {values.get(suffix, 0):g}")
+        return "\n".join(lines) + "\n"
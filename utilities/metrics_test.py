@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from utilities.cache import TTLCache
+from utilities.metrics import Metrics
+from utilities.metrics import format_labels
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db_filepath = os.path.join(self.folder.name, "metrics.db")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels({}), "")
+        self.assertEqual(
+            format_labels({"type": "txt", "cache": 'a"b'}), 'cache="a\\"b",type="txt"'
+        )
+
+    def test_shared_store(self):
+        # e.g. the backend records and the frontend renders
+        backend = Metrics(flush_seconds=3600)
+        backend.connect(self.db_filepath)
+        frontend = Metrics(flush_seconds=3600)
+        frontend.connect(self.db_filepath)
+
+        backend.inc("sd_images_total", {"type": "txt"})
+        backend.inc("sd_images_total", {"type": "txt"}, value=2)
+        backend.observe("sd_job_exec_seconds", 0.3, {"type": "txt"})
+        backend.observe("sd_job_exec_seconds", 7200, {"type": "txt"})
+        # nothing is shared before a flush
+        self.assertNotIn("sd_images_total", frontend.render())
+
+        backend.flush()
+        text = frontend.render({"sd_jobs": [({"status": "pending"}, 4)]})
+        self.assertIn('sd_images_total{type="txt"} 3\n', text)
+        self.assertIn('sd_job_exec_seconds_bucket{type="txt",le="0.25"} 0\n', text)
+        self.assertIn('sd_job_exec_seconds_bucket{type="txt",le="0.5"} 1\n', text)
+        self.assertIn('sd_job_exec_seconds_bucket{type="txt",le="3600"} 1\n', text)
+        self.assertIn('sd_job_exec_seconds_bucket{type="txt",le="+Inf"} 2\n', text)
+        self.assertIn('sd_job_exec_seconds_sum{type="txt"} 7200.3\n', text)
+        self.assertIn('sd_job_exec_seconds_count{type="txt"} 2\n', text)
+        self.assertIn("# TYPE sd_jobs gauge\n", text)
+        self.assertIn('sd_jobs{status="pending"} 4\n', text)
+
+        # flushes add up instead of overwriting each other, except for gauges
+        frontend.inc("sd_images_total", {"type": "txt"})
+        frontend.set("sd_job_peak_rss_bytes", 5, {"type": "txt"})
+        frontend.flush()
+        backend.set("sd_job_peak_rss_bytes", 3, {"type": "txt"})
+        text = backend.render()
+        self.assertIn('sd_images_total{type="txt"} 4\n', text)
+        self.assertIn('sd_job_peak_rss_bytes{type="txt"} 3\n', text)
+
+    def test_flush_locked(self):
+        metrics = Metrics(flush_seconds=3600, timeout_seconds=0.05)
+        metrics.connect(self.db_filepath)
+        metrics.inc("sd_images_total")
+        # e.g. another process holding the write lock past the timeout
+        other = sqlite3.connect(self.db_filepath, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        metrics.flush()
+        other.execute("ROLLBACK")
+        other.close()
+        # kept for the next flush
+        metrics.inc("sd_images_total")
+        self.assertIn("sd_images_total 2\n", metrics.render())
+
+    def test_watch_cache(self):
+        metrics = Metrics()
+        cache = TTLCache()
+        cache.get("a")
+        metrics.watch_cache("apikey", cache)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        text = metrics.render()
+        self.assertIn('sd_cache_requests_total{cache="apikey",result="hit"} 2\n', text)
+        self.assertIn('sd_cache_requests_total{cache="apikey",result="miss"} 1\n', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import math
 import os
 from io import BytesIO
 import requests
@@ -10,6 +11,11 @@ from diffusers.pipelines.stable_diffusion.convert_from_ckpt import (
     download_from_original_stable_diffusion_ckpt,
 )
 
+from utilities.cache import TTLCache
+from utilities.constants import LORA_CACHE_SIZE
+from utilities.constants import REFERENCE_CACHE_SIZE
+from utilities.constants import SUPPORTED_CPU_PRECISIONS
+from utilities.constants import VALUE_CPU_PRECISION_INT8
 from utilities.constants import VALUE_SCHEDULER_DEFAULT
 from utilities.constants import VALUE_SCHEDULER_DDIM
 from utilities.constants import VALUE_SCHEDULER_DPM_SOLVER_MULTISTEP
@@ -17,8 +23,19 @@ from utilities.constants import VALUE_SCHEDULER_EULER_DISCRETE
 from utilities.constants import VALUE_SCHEDULER_LMS_DISCRETE
 from utilities.constants import VALUE_SCHEDULER_PNDM
 from utilities.logger import DummyLogger
+from utilities.lora import format_lora_spec
+from utilities.lora import get_lora_filepath
+from utilities.lora import group_lora_state_dict
+from utilities.lora import parse_lora_spec
 from utilities.memory import empty_memory_cache
+from utilities.memory import reclaim_memory_if_needed
 from utilities.memory import tune_for_low_memory
+from utilities.onnx_pipeline import apply_onnx
+from utilities.onnx_pipeline import get_onnx_folderpath
+from utilities.onnx_pipeline import get_session_options
+from utilities.onnx_pipeline import set_onnx_enabled
+from utilities.onnx_pipeline import unwrap_onnx
+from utilities.reference_cache import ReferenceCache
 
 
 def download_model(url, output_folder):
@@ -41,6 +58,10 @@ def download_model(url, output_folder):
     return filepath
 
 
+class ModelUnavailableError(Exception):
+    """Raised when neither the requested nor the previous model could be loaded"""
+
+
 class Model:
     """Model class."""
 
@@ -52,6 +73,11 @@ class Model:
         use_gpu: bool = True,
         gpu_device_name: str = "cuda",
         model_caching_folder_path: str = "/tmp",
+        lora_folder_path: str = "",
+        lora_cache_size: int = LORA_CACHE_SIZE,
+        reference_cache_size: int = REFERENCE_CACHE_SIZE,
+        onnx_folder_path: str = "",
+        onnx_threads: int = 0,
     ):
         self.model_name = model_name
         self.inpainting_model_name = inpainting_model_name
@@ -66,6 +92,8 @@ class Model:
             logger.info("running on CPU (expect it to be verrry sloooow)")
         self.__logger = logger
         self.__torch_dtype = torch.float64
+        # whether the Linear layers of the text encoder and UNet are quantized to int8
+        self.__quantize = False
         self.__model_caching_folder_path = model_caching_folder_path
 
         # txt2img and img2img are always loaded together
@@ -73,6 +101,23 @@ class Model:
         self.img2img_pipeline = None
         self.inpaint_pipeline = None
 
+        self.__lora_folder_path = lora_folder_path
+        # adapter name -> {(component, module key): factors}, read from disk only once
+        self.__lora_adapters = {}
+        # (base model, adapter set) -> {(component, module key): fused weight}
+        self.lora_cache = TTLCache(maxsize=lora_cache_size, ttl_seconds=math.inf)
+        # per pipeline, "txt2img" also covers img2img as they share their weights
+        self.__lora_applied = {"txt2img": (), "inpaint": ()}
+        self.__lora_original_weights = {"txt2img": {}, "inpaint": {}}
+        self.__lora_modules = {"txt2img": None, "inpaint": None}
+
+        # decoded reference and mask images, their tensors and VAE latents
+        self.reference_cache = ReferenceCache(maxsize=reference_cache_size)
+
+        # graphs exported by tools/export_onnx.py, run instead on CPU if there are any
+        self.__onnx_folder_path = onnx_folder_path
+        self.__onnx_threads = onnx_threads
+
     def use_gpu(self):
         return self.__use_gpu
 
@@ -80,17 +125,61 @@ class Model:
         return self.__gpu_device
 
     def update_model_name(self, model_name: str):
+        """
+        Swaps the txt2img and img2img pipelines for the ones of `model_name`.
+
+        Raises ValueError if `model_name` fails to load, the previous model is loaded
+        back then, or ModelUnavailableError if that fails too, leaving no txt2img and
+        img2img pipelines.
+        """
         if not model_name or model_name == self.model_name:
             self.__logger.warn("model name empty or the same, not updated")
             return
+        previous_model_name = self.model_name
         self.model_name = model_name
+        # the fused weights of the previous model would only take up memory
+        self.lora_cache.clear()
+        # give back the previous pipelines first, both would not fit at once
+        self.txt2img_pipeline = None
+        self.img2img_pipeline = None
+        empty_memory_cache()
         self.load_txt2img_and_img2img_pipeline(force_reload=True)
+        if self.txt2img_pipeline is None:
+            self.model_name = previous_model_name
+            self.load_txt2img_and_img2img_pipeline(force_reload=True)
+            if self.txt2img_pipeline is None:
+                self.__logger.critical(
+                    f"failed to load model {model_name} and to load back"
+                    f" {previous_model_name}, no txt2img and img2img pipelines left"
+                )
+                raise ModelUnavailableError(f"no model loaded, {model_name} failed")
+            raise ValueError(f"failed to load model {model_name}")
 
     def set_low_memory_mode(self):
         self.__logger.info("reduces memory usage by using float16 dtype")
         tune_for_low_memory()
         self.__torch_dtype = torch.float16
 
+    def set_cpu_precision(self, precision: str):
+        """
+        Sets what the pipelines loaded from now on run in on CPU, one of
+        SUPPORTED_CPU_PRECISIONS. "int8" loads float32 weights and quantizes the Linear
+        layers of the text encoder and UNet to int8 on the fly, see quantize_pipeline().
+
+        Raises ValueError if `precision` is not supported.
+        """
+        if precision not in SUPPORTED_CPU_PRECISIONS:
+            raise ValueError(f"not supporting cpu precision {precision}")
+        if self.use_gpu():
+            self.__logger.warn("running on GPU, cpu precision not set")
+            return
+        self.__logger.info(f"runs on CPU in {precision}")
+        self.__quantize = precision == VALUE_CPU_PRECISION_INT8
+        if self.__quantize:
+            self.__torch_dtype = torch.float32
+        else:
+            self.__torch_dtype = getattr(torch, precision)
+
     def __set_scheduler(self, scheduler: str, pipeline, default_scheduler):
         if scheduler == VALUE_SCHEDULER_DEFAULT:
             pipeline.scheduler = default_scheduler
@@ -98,7 +187,7 @@ class Model:
         config = pipeline.scheduler.config
         pipeline.scheduler = getattr(diffusers, scheduler).from_config(config)
 
-        empty_memory_cache()
+        reclaim_memory_if_needed()
 
     def set_img2img_scheduler(self, scheduler: str):
         # note the change here also affects txt2img scheduler
@@ -139,7 +228,7 @@ class Model:
         pipeline = None
         try:
             pipeline = StableDiffusionPipeline.from_pretrained(
-                model_name,
+                self.model_name,
                 revision=revision,
                 torch_dtype=self.__torch_dtype,
                 safety_checker=None,
@@ -155,17 +244,36 @@ class Model:
                 self.__logger.error(
                     "failed to load model %s: %s" % (self.model_name, e)
                 )
-        if pipeline and self.use_gpu():
+        if pipeline is None:
+            return
+        if self.use_gpu():
             pipeline.to(self.get_gpu_device_name())
+        if self.__quantize:
+            quantize_pipeline(pipeline)
+        self.__use_onnx(pipeline)
 
         self.txt2img_pipeline = pipeline
         self.__default_txt2img_scheduler = pipeline.scheduler
+        self.__forget_lora("txt2img")
+        self.reference_cache.wrap_vae(pipeline.vae, self.model_name)
 
         self.img2img_pipeline = StableDiffusionImg2ImgPipeline(**pipeline.components)
         self.__default_img2img_scheduler = self.__default_txt2img_scheduler
 
         empty_memory_cache()
 
+    def __use_onnx(self, pipeline):
+        if not self.__onnx_folder_path or self.use_gpu():
+            return
+        folderpath = get_onnx_folderpath(self.__onnx_folder_path, self.model_name)
+        graphs = apply_onnx(
+            pipeline, folderpath, get_session_options(self.__onnx_threads)
+        )
+        if graphs:
+            self.__logger.info(f"runs {', '.join(graphs)} with onnxruntime")
+        else:
+            self.__logger.warn(f"no onnx graphs in {folderpath}, runs on pytorch")
+
     def load_inpaint_pipeline(self, force_reload: bool = False):
         if (not force_reload) and (self.inpaint_pipeline is not None):
             self.__logger.warn("inpaint pipeline already loaded")
@@ -232,14 +340,189 @@ class Model:
         if pipeline:
             if self.use_gpu():
                 pipeline.to(self.get_gpu_device_name())
+            if self.__quantize:
+                quantize_pipeline(pipeline)
             self.inpaint_pipeline = pipeline
             self.__default_inpaint_scheduler = pipeline.scheduler
+            self.__forget_lora("inpaint")
+            self.reference_cache.wrap_vae(pipeline.vae, self.inpainting_model_name)
         empty_memory_cache()
 
     def load_all(self):
         self.load_txt2img_and_img2img_pipeline()
         self.load_inpaint_pipeline()
 
+    def get_lora_model(self, inpainting: bool = False) -> str:
+        """Gets the adapters currently fused into the weights, "" for none"""
+        kind = "inpaint" if inpainting else "txt2img"
+        return format_lora_spec(self.__lora_applied[kind])
+
+    def apply_lora(self, lora_model: str, inpainting: bool = False):
+        """
+        Fuses the LoRA adapters `lora_model` of a job, e.g. "add_detail:0.5,film_grain",
+        into the weights of the txt2img and img2img pipelines, or of the inpaint pipeline
+        if `inpainting`, replacing the adapters fused before. "" restores the base model.
+
+        The fused weights of the most recently used adapter sets are cached, switching
+        to one of them only copies weights.
+
+        Raises ValueError if `lora_model` is malformed or names an unknown adapter, or
+        if it names any while running in int8.
+        """
+        adapters = parse_lora_spec(lora_model)
+        if adapters and self.__quantize:
+            # only the Conv2d layers would get their deltas, see quantize_pipeline()
+            raise ValueError("lora adapters not supported with cpu precision int8")
+        kind = "inpaint" if inpainting else "txt2img"
+        if adapters == self.__lora_applied[kind]:
+            return
+        pipeline = self.inpaint_pipeline if inpainting else self.txt2img_pipeline
+        if pipeline is None:
+            raise ValueError(f"no {kind} pipeline loaded, unable to apply lora")
+        if self.__lora_modules[kind] is None:
+            self.__lora_modules[kind] = get_lora_modules(pipeline)
+        modules = self.__lora_modules[kind]
+        original_weights = self.__lora_original_weights[kind]
+
+        fused_weights = {}
+        if adapters:
+            base_model = self.inpainting_model_name if inpainting else self.model_name
+            cache_key = (base_model, format_lora_spec(adapters))
+            fused_weights = self.lora_cache.get(cache_key, None)
+            if fused_weights is None:
+                fused_weights = self.__fuse_lora(adapters, modules, original_weights)
+                self.lora_cache.set(cache_key, fused_weights)
+
+        with torch.no_grad():
+            # every module an adapter ever changed, so that the previous set is undone
+            for target, weight in original_weights.items():
+                modules[target].weight.copy_(fused_weights.get(target, weight))
+        self.__lora_applied[kind] = adapters
+        # exported graphs have the weights of the base model only
+        set_onnx_enabled(pipeline, enabled=not adapters)
+        self.__logger.info(f"{kind} lora set to {format_lora_spec(adapters) or 'none'}")
+
+    def __load_lora_adapter(self, name: str) -> dict:
+        if name in self.__lora_adapters:
+            return self.__lora_adapters[name]
+        filepath = get_lora_filepath(self.__lora_folder_path, name)
+        if not filepath:
+            raise ValueError(f"lora adapter {name} not found")
+        if filepath.endswith(".safetensors"):
+            from safetensors.torch import load_file
+
+            state_dict = load_file(filepath, device="cpu")
+        else:
+            state_dict = torch.load(filepath, map_location="cpu")
+        factors = group_lora_state_dict(state_dict)
+        if not factors:
+            raise ValueError(f"lora adapter {name} has no weights we understand")
+        self.__logger.info(f"loaded lora adapter {name} for {len(factors)} modules")
+        self.__lora_adapters[name] = factors
+        return factors
+
+    @torch.no_grad()
+    def __fuse_lora(self, adapters: tuple, modules: dict, original_weights: dict) -> dict:
+        fused_weights = {}
+        for name, weight in adapters:
+            factors = self.__load_lora_adapter(name)
+            missing = 0
+            for target, factor in factors.items():
+                module = modules.get(target, None)
+                if module is None:
+                    missing += 1
+                    continue
+                if target not in original_weights:
+                    # not changed by any adapter so far, so still the base weight
+                    original_weights[target] = module.weight.detach().clone()
+                down = factor["down"].to(module.weight.device, torch.float32)
+                up = factor["up"].to(module.weight.device, torch.float32)
+                scale = weight
+                if "alpha" in factor:
+                    scale *= float(factor["alpha"]) / down.shape[0]
+                delta = (up.flatten(1) @ down.flatten(1)).reshape(module.weight.shape)
+                if target not in fused_weights:
+                    # a copy even if float32 already, the original must stay as it is
+                    fused_weights[target] = original_weights[target].to(
+                        torch.float32, copy=True
+                    )
+                fused_weights[target] += delta * scale
+            if missing:
+                self.__logger.warn(
+                    f"lora adapter {name}: {missing} of {len(factors)} modules not found"
+                )
+        return {
+            target: fused_weight.to(original_weights[target].dtype)
+            for target, fused_weight in fused_weights.items()
+        }
+
+    def __forget_lora(self, kind: str):
+        # a freshly loaded pipeline has none of the adapters fused
+        self.__lora_applied[kind] = ()
+        self.__lora_original_weights[kind] = {}
+        self.__lora_modules[kind] = None
+
+
+def quantize_pipeline(pipeline):
+    """
+    Replaces the Linear layers of the text encoder and UNet of `pipeline` with dynamically
+    quantized int8 ones, in place. Their activations stay float32, so only the weights
+    lose precision, and LoRA adapters can no longer be fused into them.
+    """
+    for component in ["text_encoder", "unet"]:
+        torch.ao.quantization.quantize_dynamic(
+            getattr(pipeline, component),
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+            inplace=True,
+        )
+
+
+def get_lora_modules(pipeline) -> dict:
+    """
+    Gets the layers of `pipeline` LoRA adapters may change, as
+    {(component, module key): module} with the keys parse_lora_key() gives.
+    """
+    modules = {}
+    for component in ["unet", "text_encoder"]:
+        # the PyTorch modules under ONNX ones, which fall back to them with adapters
+        component_module = unwrap_onnx(getattr(pipeline, component))
+        for name, module in component_module.named_modules():
+            if isinstance(module, (torch.nn.Linear, torch.nn.Conv2d)):
+                modules[(component, name.replace(".", "_"))] = module
+    return modules
+
+
+@torch.no_grad()
+def encode_prompt(pipeline, device: str, prompt: str, negative_prompt: str) -> tuple:
+    """
+    Encodes the prompts the way `pipeline` does by itself, so that the text encoder can be
+    timed on its own.
+
+    Returns (prompt_embeds, negative_prompt_embeds) for `pipeline` to take instead.
+    """
+    # with classifier free guidance both come back concatenated, the negative one first
+    embeds = pipeline._encode_prompt(
+        prompt, device, 1, True, negative_prompt=negative_prompt
+    )
+    negative_prompt_embeds, prompt_embeds = embeds.chunk(2)
+    return prompt_embeds, negative_prompt_embeds
+
+
+@torch.no_grad()
+def decode_latents(pipeline, latents) -> list:
+    """
+    Decodes the latents `pipeline` returned with output_type="latent" into PIL images.
+
+    Decodes through the VAE itself, as decode_latents() of the img2img pipeline returns
+    a tensor where the one of the txt2img pipeline returns a numpy array.
+    """
+    image = pipeline.vae.decode(latents / pipeline.vae.config.scaling_factor).sample
+    image = (image / 2 + 0.5).clamp(0, 1)
+    # numpy has no bfloat16, float32 holds every dtype the VAE is run with
+    image = image.cpu().permute(0, 2, 3, 1).float().numpy()
+    return pipeline.numpy_to_pil(image)
+
 
 def get_revision_from_model_name(model_name: str):
     return (
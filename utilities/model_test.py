@@ -0,0 +1,187 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+
+DEPENDENCIES = ["torch", "diffusers", "transformers"]
+
+
+def make_tiny_pipeline():
+    """
+    Builds a txt2img pipeline of the tiny models the diffusers tests use, random weights
+    of the real layout. It has no tokenizer, prompts go in as embeds.
+    """
+    import torch
+    from diffusers import AutoencoderKL
+    from diffusers import DDIMScheduler
+    from diffusers import StableDiffusionPipeline
+    from diffusers import UNet2DConditionModel
+    from transformers import CLIPTextConfig
+    from transformers import CLIPTextModel
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+    )
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            bos_token_id=0,
+            eos_token_id=2,
+            hidden_size=32,
+            intermediate_size=37,
+            layer_norm_eps=1e-05,
+            num_attention_heads=4,
+            num_hidden_layers=5,
+            pad_token_id=1,
+            vocab_size=1000,
+        )
+    )
+    return StableDiffusionPipeline(
+        vae=vae.eval(),
+        text_encoder=text_encoder.eval(),
+        tokenizer=None,
+        unet=unet.eval(),
+        scheduler=DDIMScheduler(),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+@unittest.skipUnless(
+    all(importlib.util.find_spec(name) for name in DEPENDENCIES),
+    f"needs {', '.join(DEPENDENCIES)}",
+)
+class TestModel(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = make_tiny_pipeline()
+
+    def test_decode_latents(self):
+        import torch
+        from diffusers import StableDiffusionImg2ImgPipeline
+        from PIL import Image
+
+        from utilities.model import decode_latents
+
+        img2img_pipeline = StableDiffusionImg2ImgPipeline(**self.pipeline.components)
+        embeds = torch.randn(1, 77, 32)
+        kwargs = {
+            "prompt_embeds": embeds,
+            "negative_prompt_embeds": torch.zeros_like(embeds),
+            "num_inference_steps": 2,
+            "output_type": "latent",
+        }
+        results = [
+            self.pipeline(width=64, height=64, **kwargs),
+            img2img_pipeline(image=Image.new("RGB", (64, 64), (255, 0, 0)), **kwargs),
+        ]
+        for pipeline, result in zip([self.pipeline, img2img_pipeline], results):
+            images = decode_latents(pipeline, result.images)
+            self.assertEqual(len(images), 1)
+            self.assertEqual(images[0].size, (64, 64))
+            self.assertEqual(images[0].mode, "RGB")
+
+    def test_lora_restores_weights(self):
+        import torch
+
+        from utilities.model import Model
+
+        with tempfile.TemporaryDirectory() as folderpath:
+            torch.manual_seed(1)
+            torch.save(
+                {
+                    "lora_unet_conv_in.lora_down.weight": torch.randn(4, 4, 3, 3),
+                    "lora_unet_conv_in.lora_up.weight": torch.randn(32, 4, 1, 1),
+                    "lora_te_text_model_encoder_layers_0_mlp_fc1.lora_down.weight": (
+                        torch.randn(4, 32)
+                    ),
+                    "lora_te_text_model_encoder_layers_0_mlp_fc1.lora_up.weight": (
+                        torch.randn(37, 4)
+                    ),
+                },
+                os.path.join(folderpath, "a.bin"),
+            )
+            model = Model("tiny", "", use_gpu=False, lora_folder_path=folderpath)
+            model.txt2img_pipeline = self.pipeline
+            weights = [
+                self.pipeline.unet.conv_in.weight,
+                self.pipeline.text_encoder.text_model.encoder.layers[0].mlp.fc1.weight,
+            ]
+            # float32 like with --cpu-precision float32
+            originals = [weight.detach().clone() for weight in weights]
+            self.assertEqual(originals[0].dtype, torch.float32)
+
+            for _ in range(2):
+                model.apply_lora("a:0.5")
+                self.assertEqual(model.get_lora_model(), "a:0.5")
+                for weight, original in zip(weights, originals):
+                    self.assertFalse(torch.equal(weight, original))
+                model.apply_lora("")
+                for weight, original in zip(weights, originals):
+                    self.assertTrue(torch.equal(weight, original))
+
+    def test_cpu_precision(self):
+        import torch
+
+        from utilities.model import Model
+        from utilities.model import quantize_pipeline
+
+        model = Model("tiny", "", use_gpu=False)
+        with self.assertRaisesRegex(ValueError, "float8"):
+            model.set_cpu_precision("float8")
+
+        model.set_cpu_precision("int8")
+        quantize_pipeline(self.pipeline)
+        for component in [self.pipeline.text_encoder, self.pipeline.unet]:
+            self.assertFalse(
+                any(type(module) is torch.nn.Linear for module in component.modules())
+            )
+        # adapters would reach the Conv2d layers only
+        model.txt2img_pipeline = self.pipeline
+        with self.assertRaisesRegex(ValueError, "int8"):
+            model.apply_lora("a:0.5")
+        model.apply_lora("")
+        self.assertEqual(model.get_lora_model(), "")
+
+    def test_update_model_name(self):
+        from utilities.model import Model
+        from utilities.model import ModelUnavailableError
+
+        model = Model("previous", "", use_gpu=False)
+
+        def load(force_reload):
+            if model.model_name == "previous" and previous_loads:
+                model.txt2img_pipeline = self.pipeline
+
+        with mock.patch.object(model, "load_txt2img_and_img2img_pipeline", load):
+            previous_loads = True
+            with self.assertRaisesRegex(ValueError, "failed to load model next"):
+                model.update_model_name("next")
+            self.assertEqual(model.model_name, "previous")
+            self.assertIs(model.txt2img_pipeline, self.pipeline)
+
+            previous_loads = False
+            with self.assertRaises(ModelUnavailableError):
+                model.update_model_name("next")
+            self.assertIsNone(model.txt2img_pipeline)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,349 @@
+import os
+import re
+import shutil
+
+import numpy as np
+import torch
+
+
+ONNX_OPSET = 14
+ONNX_FILENAME = "model.onnx"
+ONNX_WEIGHTS_FILENAME = "weights.pb"  # the UNet is larger than a protobuf may be
+
+# graphs per folder of a model, the ones with a resolution bucket get a _<W>x<H> suffix
+ONNX_TEXT_ENCODER = "text_encoder"
+ONNX_UNET = "unet"
+ONNX_VAE_DECODER = "vae_decoder"
+BUCKET_PATTERN = re.compile(r"^(\d+)x(\d+)$")
+
+
+def parse_bucket(text: str) -> tuple:
+    """
+    Parses a resolution bucket such as "512x768", width first, into (width, height).
+
+    Raises ValueError if `text` is malformed or a side is not a multiple of 8.
+    """
+    match = BUCKET_PATTERN.match(text.strip())
+    if match is None:
+        raise ValueError(f"invalid resolution bucket {text!r}, expected <W>x<H>")
+    width, height = int(match.group(1)), int(match.group(2))
+    if not width or not height or width % 8 or height % 8:
+        raise ValueError(f"sides of resolution bucket {text} not multiples of 8")
+    return width, height
+
+
+def get_onnx_folderpath(folderpath: str, model_name: str) -> str:
+    """Gets where the graphs of `model_name` are exported to in `folderpath`"""
+    return os.path.join(folderpath, model_name.replace("/", "--"))
+
+
+def get_onnx_filepath(folderpath: str, graph: str, width: int = 0, height: int = 0):
+    """Gets the file of `graph`, of the bucket `width` x `height` if given"""
+    if width and height:
+        graph = f"{graph}_{width}x{height}"
+    return os.path.join(folderpath, graph, ONNX_FILENAME)
+
+
+def list_onnx_buckets(folderpath: str, graph: str) -> list:
+    """Lists the (width, height) buckets `graph` was exported for in `folderpath`"""
+    buckets = []
+    if not os.path.isdir(folderpath):
+        return buckets
+    for name in sorted(os.listdir(folderpath)):
+        if not name.startswith(graph + "_"):
+            continue
+        try:
+            bucket = parse_bucket(name[len(graph) + 1 :])
+        except ValueError:
+            continue
+        if os.path.isfile(get_onnx_filepath(folderpath, graph, *bucket)):
+            buckets.append(bucket)
+    return buckets
+
+
+class _TextEncoderGraph(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids, return_dict=False)[0]
+
+
+class _UNetGraph(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states):
+        return self.unet(sample, timestep, encoder_hidden_states, return_dict=False)[0]
+
+
+class _VaeDecoderGraph(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latent_sample):
+        return self.vae.decode(latent_sample, return_dict=False)[0]
+
+
+def _export(module, args: tuple, filepath: str, names: list, dynamic_axes: dict):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    torch.onnx.export(
+        module,
+        args,
+        filepath,
+        input_names=names[:-1],
+        output_names=names[-1:],
+        dynamic_axes=dynamic_axes,
+        do_constant_folding=True,
+        opset_version=ONNX_OPSET,
+    )
+
+
+def _save_with_external_weights(filepath: str):
+    import onnx
+
+    # torch writes one file per tensor next to a graph too large, gather them in one
+    model = onnx.load(filepath)
+    folderpath = os.path.dirname(filepath)
+    shutil.rmtree(folderpath)
+    os.makedirs(folderpath)
+    onnx.save_model(
+        model,
+        filepath,
+        save_as_external_data=True,
+        all_tensors_to_one_file=True,
+        location=ONNX_WEIGHTS_FILENAME,
+        convert_attribute=False,
+    )
+
+
+@torch.no_grad()
+def export_onnx(pipeline, folderpath: str, buckets: list) -> list:
+    """
+    Exports the text encoder, UNet and VAE decoder of a float32 `pipeline` to ONNX in
+    `folderpath`, laid out the way diffusers lays out ONNX pipelines except that the
+    UNet and VAE decoder get one fixed size graph per (width, height) of `buckets`, e.g.
+    unet_512x768/model.onnx. Batch sizes stay dynamic, as does the prompt length.
+
+    Returns the files written.
+    """
+    filepaths = []
+    text_encoder = pipeline.text_encoder
+    config = text_encoder.config
+    filepath = get_onnx_filepath(folderpath, ONNX_TEXT_ENCODER)
+    _export(
+        _TextEncoderGraph(text_encoder),
+        (torch.zeros((1, config.max_position_embeddings), dtype=torch.int64),),
+        filepath,
+        ["input_ids", "last_hidden_state"],
+        {"input_ids": {0: "batch", 1: "sequence"}, "last_hidden_state": {0: "batch"}},
+    )
+    filepaths.append(filepath)
+
+    unet = pipeline.unet
+    vae = pipeline.vae
+    for width, height in buckets:
+        # the latents are 8 times smaller than the image
+        size = (height // 8, width // 8)
+        filepath = get_onnx_filepath(folderpath, ONNX_UNET, width, height)
+        _export(
+            _UNetGraph(unet),
+            (
+                torch.randn((2, unet.config.in_channels) + size),
+                torch.ones((1,)),
+                torch.randn((2, config.max_position_embeddings, config.hidden_size)),
+            ),
+            filepath,
+            ["sample", "timestep", "encoder_hidden_states", "out_sample"],
+            {
+                "sample": {0: "batch"},
+                "encoder_hidden_states": {0: "batch"},
+                "out_sample": {0: "batch"},
+            },
+        )
+        _save_with_external_weights(filepath)
+        filepaths.append(filepath)
+
+        filepath = get_onnx_filepath(folderpath, ONNX_VAE_DECODER, width, height)
+        _export(
+            _VaeDecoderGraph(vae),
+            (torch.randn((1, vae.config.latent_channels) + size),),
+            filepath,
+            ["latent_sample", "sample"],
+            {"latent_sample": {0: "batch"}, "sample": {0: "batch"}},
+        )
+        filepaths.append(filepath)
+    return filepaths
+
+
+def get_session_options(threads: int = 0):
+    """
+    Gets the ONNX Runtime session options of the backend, which runs one job at a time,
+    so all `threads` go to the operators themselves. 0 leaves it to ONNX Runtime.
+    """
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.inter_op_num_threads = 1
+    if threads:
+        options.intra_op_num_threads = threads
+    return options
+
+
+def load_session(filepath: str, sess_options=None):
+    import onnxruntime
+
+    return onnxruntime.InferenceSession(
+        filepath, sess_options=sess_options, providers=["CPUExecutionProvider"]
+    )
+
+
+def _run(session, inputs: dict, dtype, device) -> torch.Tensor:
+    outputs = session.run(None, inputs)
+    return torch.from_numpy(outputs[0]).to(device=device, dtype=dtype)
+
+
+def _to_numpy(tensor: torch.Tensor, dtype=torch.float32) -> np.ndarray:
+    # the graphs are float32, numpy has no bfloat16 anyway
+    return tensor.detach().to("cpu", dtype).numpy()
+
+
+class OnnxModule(torch.nn.Module):
+    """
+    Stands in for the text encoder or UNet of a pipeline and runs ONNX Runtime sessions
+    instead, falling back to `torch_module` for what no session can run, e.g. a size
+    no bucket was exported for, or while `enabled` is False.
+
+    `sessions` maps the latent (height, width) of a bucket to its session, None to the
+    session of a graph without buckets.
+    """
+
+    def __init__(self, torch_module, sessions: dict):
+        super().__init__()
+        self.torch_module = torch_module
+        self.sessions = sessions
+        self.config = torch_module.config
+        self.enabled = True
+
+    @property
+    def dtype(self):
+        return self.torch_module.dtype
+
+    @property
+    def device(self):
+        return self.torch_module.device
+
+
+class OnnxTextEncoder(OnnxModule):
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        session = self.sessions.get(None, None)
+        if not self.enabled or session is None or attention_mask is not None or kwargs:
+            return self.torch_module(input_ids, attention_mask=attention_mask, **kwargs)
+        inputs = {"input_ids": _to_numpy(input_ids, torch.int64)}
+        return (_run(session, inputs, self.dtype, input_ids.device),)
+
+
+class OnnxUNet(OnnxModule):
+    def forward(
+        self,
+        sample,
+        timestep,
+        encoder_hidden_states,
+        cross_attention_kwargs=None,
+        return_dict: bool = True,
+        **kwargs,
+    ):
+        from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+        session = self.sessions.get(tuple(sample.shape[-2:]), None)
+        if not self.enabled or session is None or cross_attention_kwargs or kwargs:
+            return self.torch_module(
+                sample,
+                timestep,
+                encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+                return_dict=return_dict,
+                **kwargs,
+            )
+        inputs = {
+            "sample": _to_numpy(sample),
+            # the graph broadcasts one timestep over the batch
+            "timestep": _to_numpy(torch.as_tensor(timestep).reshape(-1)[:1]),
+            "encoder_hidden_states": _to_numpy(encoder_hidden_states),
+        }
+        out_sample = _run(session, inputs, sample.dtype, sample.device)
+        return UNet2DConditionOutput(sample=out_sample) if return_dict else (out_sample,)
+
+
+def wrap_vae_decoder(vae, sessions: dict):
+    """
+    Makes vae.decode() run the session of the latent (height, width) in `sessions`,
+    and the PyTorch decoder for sizes no bucket was exported for.
+    """
+    # wrapping again, e.g. after a reload, replaces the previous wrapper
+    decode = getattr(vae.decode, "torch_decode", vae.decode)
+
+    def onnx_decode(z, return_dict: bool = True, **kwargs):
+        from diffusers.models.vae import DecoderOutput
+
+        session = sessions.get(tuple(z.shape[-2:]), None)
+        if session is None or kwargs:
+            return decode(z, return_dict=return_dict, **kwargs)
+        sample = _run(session, {"latent_sample": _to_numpy(z)}, z.dtype, z.device)
+        return DecoderOutput(sample=sample) if return_dict else (sample,)
+
+    onnx_decode.torch_decode = decode
+    vae.decode = onnx_decode
+
+
+def apply_onnx(pipeline, folderpath: str, sess_options=None) -> list:
+    """
+    Swaps the text encoder and UNet of `pipeline` for ONNX Runtime sessions of the
+    graphs export_onnx() wrote to `folderpath`, and its VAE decoder too, keeping the
+    PyTorch modules for whatever the graphs cannot run.
+
+    Returns the graphs loaded.
+    """
+    loaded = []
+    filepath = get_onnx_filepath(folderpath, ONNX_TEXT_ENCODER)
+    if os.path.isfile(filepath):
+        sessions = {None: load_session(filepath, sess_options)}
+        pipeline.text_encoder = OnnxTextEncoder(
+            unwrap_onnx(pipeline.text_encoder), sessions
+        )
+        loaded.append(ONNX_TEXT_ENCODER)
+
+    for graph in [ONNX_UNET, ONNX_VAE_DECODER]:
+        sessions = {}
+        for width, height in list_onnx_buckets(folderpath, graph):
+            filepath = get_onnx_filepath(folderpath, graph, width, height)
+            sessions[(height // 8, width // 8)] = load_session(filepath, sess_options)
+            loaded.append(f"{graph}_{width}x{height}")
+        if not sessions:
+            continue
+        if graph == ONNX_UNET:
+            pipeline.unet = OnnxUNet(unwrap_onnx(pipeline.unet), sessions)
+        else:
+            wrap_vae_decoder(pipeline.vae, sessions)
+    return loaded
+
+
+def set_onnx_enabled(pipeline, enabled: bool):
+    """
+    Switches the ONNX text encoder and UNet of `pipeline` on or off, off e.g. while LoRA
+    adapters are fused into the PyTorch weights the graphs do not have.
+    """
+    for component in ["text_encoder", "unet"]:
+        module = getattr(pipeline, component, None)
+        if isinstance(module, OnnxModule):
+            module.enabled = enabled
+
+
+def unwrap_onnx(module):
+    """Gets the PyTorch module an OnnxModule stands in for, `module` itself otherwise"""
+    return module.torch_module if isinstance(module, OnnxModule) else module
@@ -0,0 +1,143 @@
+import importlib.util
+import tempfile
+import types
+import unittest
+
+
+DEPENDENCIES = ["torch", "diffusers", "transformers", "onnx", "onnxruntime"]
+
+
+@unittest.skipUnless(
+    all(importlib.util.find_spec(name) for name in DEPENDENCIES),
+    f"needs {', '.join(DEPENDENCIES)}",
+)
+class TestOnnxPipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from diffusers import AutoencoderKL
+        from diffusers import UNet2DConditionModel
+        from transformers import CLIPTextConfig
+        from transformers import CLIPTextModel
+
+        # the tiny models the diffusers tests use, random weights of the real layout
+        torch.manual_seed(0)
+        unet = UNet2DConditionModel(
+            block_out_channels=(32, 64),
+            layers_per_block=2,
+            sample_size=32,
+            in_channels=4,
+            out_channels=4,
+            down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+            up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+            cross_attention_dim=32,
+        )
+        vae = AutoencoderKL(
+            block_out_channels=[32, 64],
+            in_channels=3,
+            out_channels=3,
+            down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+            up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+            latent_channels=4,
+        )
+        text_encoder = CLIPTextModel(
+            CLIPTextConfig(
+                bos_token_id=0,
+                eos_token_id=2,
+                hidden_size=32,
+                intermediate_size=37,
+                layer_norm_eps=1e-05,
+                num_attention_heads=4,
+                num_hidden_layers=5,
+                pad_token_id=1,
+                vocab_size=1000,
+            )
+        )
+        cls.torch_modules = types.SimpleNamespace(
+            unet=unet.eval(), vae=vae.eval(), text_encoder=text_encoder.eval()
+        )
+        cls.folder = tempfile.TemporaryDirectory()
+        from utilities.onnx_pipeline import export_onnx
+
+        export_onnx(cls.torch_modules, cls.folder.name, [(64, 64)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.folder.cleanup()
+
+    def setUp(self):
+        from utilities.onnx_pipeline import apply_onnx
+
+        self.pipeline = types.SimpleNamespace(**vars(self.torch_modules))
+        self.loaded = apply_onnx(self.pipeline, self.folder.name)
+
+    def tearDown(self):
+        # apply_onnx() wraps vae.decode() of the shared VAE in place
+        del self.torch_modules.vae.decode
+
+    def assertClose(self, actual, expected):
+        import torch
+
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertTrue(
+            torch.allclose(actual, expected, atol=1e-4, rtol=1e-3),
+            f"max difference {(actual - expected).abs().max()}",
+        )
+
+    def test_loaded(self):
+        from utilities.onnx_pipeline import list_onnx_buckets
+
+        self.assertEqual(
+            self.loaded, ["text_encoder", "unet_64x64", "vae_decoder_64x64"]
+        )
+        self.assertEqual(list_onnx_buckets(self.folder.name, "unet"), [(64, 64)])
+
+    def test_parity(self):
+        import torch
+
+        torch.manual_seed(1)
+        input_ids = torch.randint(3, 1000, (2, 77))
+        latents = torch.randn(2, 4, 8, 8)
+        with torch.no_grad():
+            embeds = self.torch_modules.text_encoder(input_ids)[0]
+            self.assertClose(self.pipeline.text_encoder(input_ids)[0], embeds)
+            # the prompt embeds of the backend may be longer, in 77 token chunks
+            self.assertClose(
+                self.pipeline.text_encoder(input_ids[:, :20])[0],
+                self.torch_modules.text_encoder(input_ids[:, :20])[0],
+            )
+
+            for timestep in [torch.tensor(999), torch.tensor(10.5)]:
+                self.assertClose(
+                    self.pipeline.unet(latents, timestep, embeds).sample,
+                    self.torch_modules.unet(latents, timestep, embeds).sample,
+                )
+
+            self.assertClose(
+                self.pipeline.vae.decode(latents[:1]).sample,
+                self.pipeline.vae.decode.torch_decode(latents[:1]).sample,
+            )
+
+    def test_fallback(self):
+        import torch
+
+        from utilities.onnx_pipeline import set_onnx_enabled
+
+        torch.manual_seed(2)
+        # no bucket exported for 128x128, PyTorch runs it
+        latents = torch.randn(2, 4, 16, 16)
+        embeds = torch.randn(2, 77, 32)
+        with torch.no_grad():
+            expected = self.torch_modules.unet(latents, 10, embeds).sample
+            actual = self.pipeline.unet(latents, 10, embeds).sample
+            self.assertTrue(torch.equal(actual, expected))
+            # nor while disabled, e.g. with LoRA adapters fused
+            set_onnx_enabled(self.pipeline, False)
+            latents = latents[..., :8, :8]
+            expected = self.torch_modules.unet(latents, 10, embeds).sample
+            actual = self.pipeline.unet(latents, 10, embeds).sample
+            self.assertTrue(torch.equal(actual, expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
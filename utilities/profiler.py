@@ -0,0 +1,126 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import shutil
+
+from utilities.logger import DummyLogger
+
+
+def get_folder_bytes(folderpath: str) -> int:
+    total = 0
+    for root, _, filenames in os.walk(folderpath):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+class JobProfiler:
+    """
+    Profiles a randomly sampled fraction of jobs with cProfile and, if torch is
+    installed, the torch profiler.
+
+    The profiles of a job go to a folder named by its uuid under `folderpath`:
+    cprofile.prof for pstats or snakeviz, cprofile.txt with the top functions and
+    torch_trace.json for chrome://tracing. The oldest folders are deleted once all of
+    them take more than `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        folderpath: str = "profiles",
+        max_bytes: int = 500 * 1024 * 1024,
+        logger: DummyLogger = DummyLogger(),
+        use_torch: bool = True,
+        random_fn=random.random,
+    ):
+        self.__sample_rate = sample_rate
+        self.__folderpath = folderpath
+        self.__max_bytes = max_bytes
+        self.__logger = logger
+        self.__use_torch = use_torch
+        self.__random_fn = random_fn
+        self.__job_uuid = ""
+        self.__cprofile = None
+        self.__torch_profile = None
+
+    def start(self, job_uuid: str) -> bool:
+        """
+        Starts profiling the job of `job_uuid` if it is sampled.
+
+        Returns True if it is profiled, call stop() once the job is done.
+        """
+        if self.__sample_rate <= 0 or self.__random_fn() >= self.__sample_rate:
+            return False
+        self.__job_uuid = job_uuid
+        if self.__use_torch:
+            self.__torch_profile = self.__start_torch_profile()
+        self.__cprofile = cProfile.Profile()
+        self.__cprofile.enable()
+        return True
+
+    def __start_torch_profile(self):
+        # imported only when needed, it takes a while and most jobs are not profiled
+        try:
+            import torch
+            import torch.profiler
+        except ImportError:
+            return None
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        torch_profile = torch.profiler.profile(activities=activities, profile_memory=True)
+        torch_profile.start()
+        return torch_profile
+
+    def stop(self):
+        """Stops profiling and writes the profiles, does nothing if not profiling"""
+        if self.__cprofile is None:
+            return
+        self.__cprofile.disable()
+        if self.__torch_profile is not None:
+            self.__torch_profile.stop()
+
+        job_folderpath = os.path.join(self.__folderpath, self.__job_uuid)
+        try:
+            os.makedirs(job_folderpath, exist_ok=True)
+            self.__cprofile.dump_stats(os.path.join(job_folderpath, "cprofile.prof"))
+            summary = io.StringIO()
+            stats = pstats.Stats(self.__cprofile, stream=summary)
+            stats.sort_stats("cumulative").print_stats(50)
+            with open(os.path.join(job_folderpath, "cprofile.txt"), "w") as f:
+                f.write(summary.getvalue())
+            if self.__torch_profile is not None:
+                self.__torch_profile.export_chrome_trace(
+                    os.path.join(job_folderpath, "torch_trace.json")
+                )
+            self.__logger.info(f"profiled {self.__job_uuid} into {job_folderpath}")
+        except OSError as e:
+            self.__logger.error(f"failed to write profiles of {self.__job_uuid}: {e}")
+        finally:
+            self.__cprofile = None
+            self.__torch_profile = None
+
+        self.enforce_max_bytes()
+
+    def enforce_max_bytes(self):
+        """Deletes the oldest profile folders until all of them fit in `max_bytes`"""
+        try:
+            folderpaths = [entry.path for entry in os.scandir(self.__folderpath)]
+        except OSError:
+            return
+        folderpaths = [path for path in folderpaths if os.path.isdir(path)]
+        folderpaths.sort(key=os.path.getmtime)
+        sizes = {path: get_folder_bytes(path) for path in folderpaths}
+        total = sum(sizes.values())
+        # the newest profile is kept, even if it is too large by itself
+        for path in folderpaths[:-1]:
+            if total <= self.__max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
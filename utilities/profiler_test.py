@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from utilities.profiler import JobProfiler
+from utilities.profiler import get_folder_bytes
+
+
+class TestJobProfiler(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_sampling(self):
+        profiler = JobProfiler(
+            sample_rate=0.5,
+            folderpath=self.folder.name,
+            use_torch=False,
+            random_fn=lambda: 0.7,
+        )
+        self.assertFalse(profiler.start("a"))
+        profiler.stop()
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+        profiler = JobProfiler(folderpath=self.folder.name, use_torch=False)
+        self.assertFalse(profiler.start("a"))
+
+    def test_profile(self):
+        profiler = JobProfiler(sample_rate=1, folderpath=self.folder.name, use_torch=False)
+        self.assertTrue(profiler.start("a"))
+        sorted(range(10000), key=lambda x: -x)
+        profiler.stop()
+        job_folderpath = os.path.join(self.folder.name, "a")
+        self.assertTrue(os.path.isfile(os.path.join(job_folderpath, "cprofile.prof")))
+        with open(os.path.join(job_folderpath, "cprofile.txt")) as f:
+            self.assertIn("<lambda>", f.read())
+
+    def test_max_bytes(self):
+        for i, name in enumerate(["old", "middle", "new"]):
+            os.makedirs(os.path.join(self.folder.name, name))
+            with open(os.path.join(self.folder.name, name, "profile"), "wb") as f:
+                f.write(b"0" * 1000)
+            os.utime(os.path.join(self.folder.name, name), (i, i))
+
+        JobProfiler(folderpath=self.folder.name, max_bytes=2500).enforce_max_bytes()
+        self.assertEqual(sorted(os.listdir(self.folder.name)), ["middle", "new"])
+        self.assertEqual(get_folder_bytes(self.folder.name), 2000)
+
+        JobProfiler(folderpath=self.folder.name, max_bytes=10).enforce_max_bytes()
+        self.assertEqual(os.listdir(self.folder.name), ["new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import hashlib
+import math
+from typing import Callable
+
+from utilities.cache import TTLCache
+from utilities.constants import REFERENCE_CACHE_SIZE
+from utilities.job_hash import hash_image
+
+
+def get_tensor_digest(tensor) -> str:
+    """Hashes the content of a torch tensor together with its shape, dtype and device"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{tuple(tensor.shape)}|{tensor.dtype}|{tensor.device}".encode())
+    # numpy has no bfloat16, float32 holds every dtype the VAE is run with
+    digest.update(tensor.detach().float().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ReferenceCache:
+    """
+    LRU caches of what img2img and inpainting derive from reference and mask images,
+    keyed by the content of the images, so that editing the same image again skips
+    decoding, resizing and the VAE encode. One cache per kind:
+
+    - "image": decoded and resized images
+    - "tensor": image and mask tensors handed to the pipelines
+    - "latent": outputs of vae.encode(), see wrap_vae()
+    """
+
+    def __init__(self, maxsize: int = REFERENCE_CACHE_SIZE):
+        self.caches = {
+            kind: TTLCache(maxsize=maxsize, ttl_seconds=math.inf)
+            for kind in ["image", "tensor", "latent"]
+        }
+
+    def get(self, kind: str, key, make: Callable):
+        """
+        Gets the entry of `key` in the cache of `kind`, calling make() for it on a miss.
+        A `key` of None is never cached, make() is always called then.
+        """
+        if key is None:
+            return make()
+        cache = self.caches[kind]
+        value = cache.get(key, None)
+        if value is None:
+            value = make()
+            cache.set(key, value)
+        return value
+
+    def get_digest(self, image) -> str:
+        """
+        Gets the content hash of a reference or mask image given as base64 string or
+        filepath, None for anything else, e.g. an image already decoded.
+        """
+        return hash_image(image) if isinstance(image, str) else None
+
+    def wrap_vae(self, vae, model_name: str):
+        """
+        Makes vae.encode() of the model `model_name` return what it returned for equal
+        inputs before. The pipelines only sample the returned latent distribution with
+        their own generator, so their results stay the same.
+        """
+        # wrapping again, e.g. after a reload, replaces the previous wrapper
+        encode = getattr(vae.encode, "uncached", vae.encode)
+
+        def cached_encode(x, *args, **kwargs):
+            key = (model_name, get_tensor_digest(x), args, tuple(sorted(kwargs.items())))
+            return self.get("latent", key, lambda: encode(x, *args, **kwargs))
+
+        cached_encode.uncached = encode
+        vae.encode = cached_encode
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
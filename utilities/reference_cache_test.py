@@ -0,0 +1,61 @@
+import importlib.util
+import unittest
+from PIL import Image
+
+from utilities.images import image_to_base64
+from utilities.reference_cache import ReferenceCache
+
+
+class TestReferenceCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ReferenceCache(maxsize=2)
+        self.made = []
+
+    def make(self, value):
+        self.made.append(value)
+        return value
+
+    def test_get(self):
+        self.assertEqual(self.cache.get("image", ("a",), lambda: self.make(1)), 1)
+        self.assertEqual(self.cache.get("image", ("a",), lambda: self.make(2)), 1)
+        # every kind has its own cache
+        self.assertEqual(self.cache.get("tensor", ("a",), lambda: self.make(3)), 3)
+        self.assertEqual(self.made, [1, 3])
+        self.assertEqual(self.cache.caches["image"].hits, 1)
+
+    def test_uncached(self):
+        self.cache.get("image", None, lambda: self.make(1))
+        self.cache.get("image", None, lambda: self.make(2))
+        self.assertEqual(self.made, [1, 2])
+        self.assertEqual(len(self.cache.caches["image"]), 0)
+
+    def test_digest(self):
+        image = image_to_base64(Image.new("RGB", (8, 8), (255, 0, 0)))
+        other = image_to_base64(Image.new("RGB", (8, 8), (0, 255, 0)))
+        self.assertEqual(self.cache.get_digest(image), self.cache.get_digest(str(image)))
+        self.assertNotEqual(self.cache.get_digest(image), self.cache.get_digest(other))
+        self.assertIsNone(self.cache.get_digest(Image.new("RGB", (8, 8))))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "needs torch")
+    def test_wrap_vae(self):
+        import torch
+
+        class Encoder(torch.nn.Module):
+            def encode(self, x, return_dict=True):
+                calls.append(x)
+                return x * 2
+
+        calls = []
+        vae = Encoder()
+        self.cache.wrap_vae(vae, "model")
+        self.cache.wrap_vae(vae, "model")
+        x = torch.ones(1, 3, 8, 8)
+        self.assertTrue(torch.equal(vae.encode(x), x * 2))
+        self.assertTrue(torch.equal(vae.encode(x.clone()), x * 2))
+        self.assertEqual(len(calls), 1)
+        vae.encode(torch.zeros(1, 3, 8, 8))
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,9 +10,13 @@ from utilities.constants import KEY_STEPS
 from utilities.constants import KEY_BASE_MODEL
 from utilities.config import Config
 from utilities.logger import DummyLogger
-from utilities.memory import empty_memory_cache
+from utilities.memory import reclaim_memory_if_needed
 from utilities.model import Model
+from utilities.model import decode_latents
+from utilities.model import encode_prompt
 from utilities.times import get_epoch_now
+from utilities.times import DummySpanRecorder
+from utilities.times import SpanRecorder
 from utilities.images import image_to_base64
 
 
@@ -94,7 +98,11 @@ class Text2Img:
         return None, torch.cat(concat_embeds, dim=1), None, torch.cat(neg_embeds, dim=1)
 
     def lunch(
-        self, prompt: str, negative_prompt: str = "", config: Config = Config()
+        self,
+        prompt: str,
+        negative_prompt: str = "",
+        config: Config = Config(),
+        spans: SpanRecorder = DummySpanRecorder(),
     ) -> dict:
         if not prompt:
             self.__logger.error("no prompt provided, won't proceed")
@@ -107,36 +115,50 @@ class Text2Img:
         generator = torch.Generator(self.__device).manual_seed(seed)
         self.__logger.info("current seed: {}".format(seed))
 
-        (
-            prompt,
-            prompt_embeds,
-            negative_prompt,
-            negative_prompt_embeds,
-        ) = self.__token_limit_workaround(prompt, negative_prompt)
-
-        result = self.model.txt2img_pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            prompt_embeds=prompt_embeds,
-            negative_prompt_embeds=negative_prompt_embeds,
-            width=config.get_width(),
-            height=config.get_height(),
-            guidance_scale=config.get_guidance_scale(),
-            num_inference_steps=config.get_steps(),
-            generator=generator,
-            callback=None,
-            callback_steps=10,
-        )
+        with spans.span("encode_prompt"):
+            (
+                prompt,
+                prompt_embeds,
+                negative_prompt,
+                negative_prompt_embeds,
+            ) = self.__token_limit_workaround(prompt, negative_prompt)
+            if prompt_embeds is None:
+                prompt_embeds, negative_prompt_embeds = encode_prompt(
+                    self.model.txt2img_pipeline, self.__device, prompt, negative_prompt
+                )
+                prompt, negative_prompt = None, None
+
+        with spans.span("denoise"):
+            result = self.model.txt2img_pipeline(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                width=config.get_width(),
+                height=config.get_height(),
+                guidance_scale=config.get_guidance_scale(),
+                num_inference_steps=config.get_steps(),
+                generator=generator,
+                callback=None,
+                callback_steps=10,
+                output_type="latent",
+            )
+
+        with spans.span("vae_decode"):
+            result_img = decode_latents(self.model.txt2img_pipeline, result.images)[0]
 
         if self.__output_folder:
             out_filepath = "{}/{}.png".format(self.__output_folder, t)
-            result.images[0].save(out_filepath)
+            result_img.save(out_filepath)
             self.__logger.info("output to file: {}".format(out_filepath))
 
-        empty_memory_cache()
+        reclaim_memory_if_needed()
+
+        with spans.span("png_encode"):
+            base64_image = image_to_base64(result_img)
 
         return {
-            BASE64IMAGE: image_to_base64(result.images[0]),
+            BASE64IMAGE: base64_image,
             KEY_SEED: str(seed),
             KEY_WIDTH: config.get_width(),
             KEY_HEIGHT: config.get_height(),
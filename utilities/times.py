@@ -1,4 +1,5 @@
 import calendar
+import contextlib
 import time
 
 
@@ -115,3 +116,77 @@ class Timer():
 
     def remaining_seconds_estimation(self, current_progress: float) -> int:
         return int(self.elapsed_seconds() / current_progress)
+
+
+class SpanRecorder():
+    '''
+    Records how long the stages of one job take, with the monotonic high resolution
+    clock. Spans may nest, e.g.
+
+        with spans.span("denoise"):
+            ...
+    '''
+
+    def __init__(self, timer=time.perf_counter):
+        self.__timer = timer
+        self.__origin = timer()
+        self.__started_at = time.time()
+        self.__spans = []  # [name, start, duration], seconds since the recorder started
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = self.__timer()
+        try:
+            yield
+        finally:
+            self.add(name, start, self.__timer())
+
+    def add(self, name: str, start: float, stop: float):
+        '''
+        Adds a span measured elsewhere, `start` and `stop` are values of the timer.
+        '''
+        self.__spans.append([name, start - self.__origin, stop - start])
+
+    def get_spans(self) -> list:
+        return list(self.__spans)
+
+    def to_dict(self) -> dict:
+        '''
+        Gets the spans in the form stored as timings of a job, rounded to microseconds.
+        '''
+        return {
+            "started_at": round(self.__started_at, 6),
+            "spans": [
+                [name, round(start, 6), round(duration, 6)]
+                for name, start, duration in self.__spans
+            ],
+        }
+
+
+class DummySpanRecorder(SpanRecorder):
+    '''
+    Drops all spans, for callers that do not care about timings.
+    '''
+
+    def add(self, name: str, start: float, stop: float):
+        pass
+
+
+def timings_to_trace_events(timings: dict, tid: int = 0, args: dict = {}) -> list:
+    '''
+    Converts the timings of a job, see SpanRecorder.to_dict(), into complete events of the
+    Chrome trace format on thread `tid`, timestamps in microseconds since the epoch.
+    '''
+    started_at = timings.get("started_at", 0)
+    return [
+        {
+            "name": name,
+            "ph": "X",
+            "ts": round((started_at + start) * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": 0,
+            "tid": tid,
+            "args": args,
+        }
+        for name, start, duration in timings.get("spans", [])
+    ]
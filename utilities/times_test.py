@@ -8,6 +8,9 @@ from utilities.times import get_epoch_now
 from utilities.times import string_to_epoch
 from utilities.times import time_to_epoch
 from utilities.times import Timer
+from utilities.times import DummySpanRecorder
+from utilities.times import SpanRecorder
+from utilities.times import timings_to_trace_events
 from utilities.times import wait_for_seconds
 
 
@@ -56,6 +59,30 @@ class TestTimes(unittest.TestCase):
         self.assertEqual(t.elapsed_seconds(), 5)
         self.assertEqual(t.remaining_seconds_estimation(0.5), 10)
 
+    def test_span_recorder(self):
+        now = [10.0]
+        spans = SpanRecorder(timer=lambda: now[0])
+        with spans.span("job"):
+            now[0] = 10.5
+            with spans.span("denoise"):
+                now[0] = 12.25
+        self.assertEqual(spans.get_spans(), [["denoise", 0.5, 1.75], ["job", 0, 2.25]])
+
+        timings = spans.to_dict()
+        timings["started_at"] = 100.0
+        events = timings_to_trace_events(timings, tid=3, args={"uuid": "a"})
+        self.assertEqual(events[0]["name"], "denoise")
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["ts"], 100500000)
+        self.assertEqual(events[0]["dur"], 1750000)
+        self.assertEqual(events[0]["tid"], 3)
+        self.assertEqual(events[1]["args"], {"uuid": "a"})
+
+        dummy = DummySpanRecorder()
+        with dummy.span("job"):
+            pass
+        self.assertEqual(dummy.get_spans(), [])
+
 
 if __name__ == '__main__':
     unittest.main()